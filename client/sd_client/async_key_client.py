@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+异步合并的密钥请求客户端
+
+WebUI / API worker 同时加载一个 checkpoint 加几个加密 LoRA、embedding 时，每个文件都会在
+加载线程上阻塞调用一次 request_decryption_key。AsyncKeyClient 在一个后台事件循环里：
+- single-flight：同一个 key_func(model_path) 的请求在途时，后来的调用直接等同一个结果
+- 并发上限：真正的阻塞请求在大小为 max_concurrency 的线程池里执行
+- fetch_key() 立即返回 concurrent.futures.Future，调用方可以先发起取密钥、接着读文件，
+  用到密钥时再 .result()，网络延迟和 IO 重叠
+
+同步调用用 get_key_sync()，协程里用 await client.get_key()（可以在任意事件循环里 await）。
+请求失败不会被缓存，异常会传给所有等待同一请求的调用方。
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MAX_CONCURRENCY = 4
+
+class AsyncKeyClient:
+    def __init__(self, fetch, key_func=None, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        """
+        fetch: 阻塞的取密钥函数 fetch(model_path) -> key
+        key_func: 合并请求用的标识函数，默认用 model_path 本身
+        """
+        self.fetch = fetch
+        self.key_func = key_func or (lambda model_path: model_path)
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="SecureModelLoader-key")
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._inflight = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.fetches = 0
+
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever,
+                                                name="SecureModelLoader-key-loop", daemon=True)
+                self._thread.start()
+        return self._loop
+
+    async def _get_key(self, model_path):
+        """只在客户端自己的事件循环里运行，_inflight 不需要加锁"""
+        self.calls += 1
+        flight_key = self.key_func(model_path)
+        future = self._inflight.get(flight_key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+        self.fetches += 1
+        future = self._loop.run_in_executor(self._executor, self.fetch, model_path)
+        self._inflight[flight_key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(flight_key, None))
+        return await asyncio.shield(future)
+
+    def fetch_key(self, model_path):
+        """发起（或加入在途的）密钥请求，立即返回 concurrent.futures.Future"""
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._get_key(model_path), loop)
+
+    async def get_key(self, model_path):
+        """协程接口，可在任意事件循环中 await"""
+        return await asyncio.wrap_future(self.fetch_key(model_path))
+
+    def get_key_sync(self, model_path, timeout=None):
+        """同步接口，阻塞到拿到密钥；不能在客户端自己的事件循环线程里调用"""
+        if self._thread is not None and threading.current_thread() is self._thread:
+            raise RuntimeError("不能在密钥客户端的事件循环线程里同步等待")
+        return self.fetch_key(model_path).result(timeout)
+
+    def stats(self):
+        return {"calls": self.calls, "coalesced": self.coalesced, "fetches": self.fetches,
+                "inflight": len(self._inflight)}
+
+    def close(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._loop.close()
+            self._loop = None
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+不加载权重的模型信息读取
+
+print_model_metadata 原来对 ckpt/pt 调用 torch.load，只为了打印一个 metadata 字典就要
+反序列化并读出几个 GB 的权重。read_checkpoint_info 只读结构信息，返回
+metadata、tensor 名称、shape 和 dtype（dtype 统一用 safetensors 的写法，如 F16）：
+
+- safetensors：只读 8 字节长度和 header
+- torch zip 格式（torch>=1.6 默认）：只解压 archive/data.pkl，用受限的 Unpickler 反序列化，
+  storage 换成只带 dtype 的占位对象，tensor 换成 (dtype, shape)，不读 data/ 下的任何 storage
+- torch 旧格式（非zip）：依次读出文件开头的几个 pickle，storage 数据在它们之后，同样不读
+- 其他情况退回 torch.load(mmap=True)，只在结构读取失败时才会用到
+
+受限 Unpickler 不导入、不执行 pickle 里引用的任意类（未知类一律换成占位对象），
+读取来历不明的 checkpoint 也不会执行其中的代码；退回 torch.load 时用 weights_only=True。
+"""
+
+import json
+import pickle
+import zipfile
+
+from lazy_safetensors import TORCH_DTYPES
+from model_index import parse_metadata
+
+# torch 的 storage 类型名 -> safetensors dtype（dtype 名见 lazy_safetensors.TORCH_DTYPES）
+STORAGE_DTYPES = {
+    "DoubleStorage": "F64",
+    "FloatStorage": "F32",
+    "HalfStorage": "F16",
+    "BFloat16Storage": "BF16",
+    "LongStorage": "I64",
+    "IntStorage": "I32",
+    "ShortStorage": "I16",
+    "CharStorage": "I8",
+    "ByteStorage": "U8",
+    "BoolStorage": "BOOL",
+}
+# 反序列化时允许使用真实对象的内置类型
+SAFE_GLOBALS = {
+    ("collections", "OrderedDict"),
+    ("builtins", "set"),
+    ("builtins", "frozenset"),
+    ("builtins", "slice"),
+    ("builtins", "complex"),
+    ("builtins", "range"),
+}
+
+class TensorInfo:
+    """反序列化时代替 tensor 的占位对象"""
+
+    def __init__(self, dtype, shape):
+        self.dtype = dtype
+        self.shape = [int(n) for n in shape]
+
+    def as_dict(self):
+        return {"dtype": self.dtype, "shape": self.shape}
+
+class _Storage:
+    def __init__(self, dtype):
+        self.dtype = dtype
+
+class _Opaque:
+    """未知类的占位：接受任意构造参数和 state，只保留类名"""
+    _name = "object"
+
+    def __init__(self, *args, **kwargs):
+        self.args = args
+
+    def __setstate__(self, state):
+        self.state = state
+
+    def __repr__(self):
+        return f"<{self._name}>"
+
+def _opaque_class(module, name):
+    return type(name, (_Opaque,), {"_name": f"{module}.{name}"})
+
+def _rebuild_tensor(storage, storage_offset, size, *args):
+    return TensorInfo(getattr(storage, "dtype", None), size)
+
+def _rebuild_parameter(data, *args):
+    return data
+
+def _rebuild_from_type(func, new_type, args, state):
+    return func(*args)
+
+def _rebuild_meta_tensor(dtype, size, *args):
+    return TensorInfo(getattr(dtype, "name", None), size)
+
+_TORCH_REBUILDERS = {
+    ("torch._utils", "_rebuild_tensor"): _rebuild_tensor,
+    ("torch._utils", "_rebuild_tensor_v2"): _rebuild_tensor,
+    ("torch._utils", "_rebuild_qtensor"): _rebuild_tensor,
+    ("torch._utils", "_rebuild_parameter"): _rebuild_parameter,
+    ("torch._utils", "_rebuild_parameter_with_state"): _rebuild_parameter,
+    ("torch._tensor", "_rebuild_from_type_v2"): _rebuild_from_type,
+    ("torch._utils", "_rebuild_meta_tensor_no_storage"): _rebuild_meta_tensor,
+}
+
+class _DtypeName:
+    def __init__(self, name):
+        self.name = name
+
+class _StructureUnpickler(pickle.Unpickler):
+    """只还原结构的 Unpickler：storage 用 persistent_load 换成占位，类一律不真正导入"""
+
+    def find_class(self, module, name):
+        if (module, name) in SAFE_GLOBALS:
+            return super().find_class(module, name)
+        rebuild = _TORCH_REBUILDERS.get((module, name))
+        if rebuild is not None:
+            return rebuild
+        if module == "torch" and name in STORAGE_DTYPES:
+            return _DtypeName(STORAGE_DTYPES[name])
+        if module == "torch" and name in TORCH_DTYPES:
+            return _DtypeName(TORCH_DTYPES[name])
+        return _opaque_class(module, name)
+
+    def persistent_load(self, pid):
+        # zip 格式: ('storage', storage_type, key, location, numel)
+        # 旧格式:   ('storage', storage_type, root_key, location, numel, view_metadata)
+        if isinstance(pid, tuple) and pid and pid[0] == "storage":
+            return _Storage(getattr(pid[1], "name", None))
+        return _Opaque(pid)
+
+def _load_structure(f):
+    return _StructureUnpickler(f, encoding="utf-8").load()
+
+def _read_torch_zip(path):
+    with zipfile.ZipFile(path) as archive:
+        names = [n for n in archive.namelist() if n.endswith("data.pkl")]
+        if not names:
+            raise ValueError("zip中没有data.pkl，不是torch checkpoint")
+        with archive.open(min(names, key=len)) as f:
+            return _load_structure(f)
+
+def _read_torch_legacy(path):
+    # 旧格式: magic number、协议版本、sys_info 三个 pickle 之后是模型本体，storage 数据在最后
+    with open(path, "rb") as f:
+        for _ in range(3):
+            _load_structure(f)
+        return _load_structure(f)
+
+def _read_torch_full(path):
+    import torch
+    try:
+        return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    except (RuntimeError, TypeError):
+        return torch.load(path, map_location="cpu", weights_only=True)
+
+def _tensor_entry(value):
+    if isinstance(value, TensorInfo):
+        return value.as_dict()
+    # 退回 torch.load 时得到的是真实 tensor
+    if hasattr(value, "dtype") and hasattr(value, "shape"):
+        dtype = TORCH_DTYPES.get(str(value.dtype).replace("torch.", ""), str(value.dtype))
+        return {"dtype": dtype, "shape": list(value.shape)}
+    return None
+
+def read_safetensors_info(path):
+    with open(path, "rb") as f:
+        header_len = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(header_len))
+    tensors = {name: {"dtype": info["dtype"], "shape": info["shape"]}
+               for name, info in header.items() if isinstance(info, dict) and "dtype" in info}
+    return {"format": "safetensors", "metadata": parse_metadata(header.get("__metadata__")), "tensors": tensors}
+
+def read_torch_info(path):
+    try:
+        if zipfile.is_zipfile(path):
+            fmt, state = "torch-zip", _read_torch_zip(path)
+        else:
+            fmt, state = "torch-legacy", _read_torch_legacy(path)
+    except Exception:
+        fmt, state = "torch-load", _read_torch_full(path)
+    info = {"format": fmt, "metadata": {}, "tensors": {}, "keys": []}
+    if not isinstance(state, dict):
+        return info
+    info["keys"] = [str(k) for k in state.keys()]
+    metadata = state.get("metadata")
+    info["metadata"] = metadata if isinstance(metadata, dict) else {}
+    weights = state.get("state_dict") if isinstance(state.get("state_dict"), dict) else state
+    for name, value in weights.items():
+        entry = _tensor_entry(value)
+        if entry is not None:
+            info["tensors"][str(name)] = entry
+    return info
+
+def read_checkpoint_info(path):
+    """
+    返回 {"format", "metadata", "tensors": {名称: {"dtype", "shape"}}}；torch 格式另有 "keys"（顶层键）。
+    safetensors 按扩展名判断，其余按 torch checkpoint 处理
+    """
+    path = str(path)
+    if path.lower().endswith(".safetensors"):
+        return read_safetensors_info(path)
+    return read_torch_info(path)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+部分加密策略
+
+整块加密时客户端每次加载都要把整个模型异或一遍，而让模型不可用并不需要保护全部权重。
+EncryptionPolicy 选出 tensor 数据区里需要加密的字节范围：
+- patterns: 名称匹配 fnmatch 模式的 tensor 整块加密（如 "*.attn1.to_q.weight"）
+- fraction: 把数据区按 block_size 切块，均匀选出这一比例的块加密
+- max_tensor_bytes: 不超过该大小的 tensor 整块加密（norm / bias 等小 tensor，开销小但缺了就不可用）
+多个条件取并集；都不指定时表示整块加密（不写范围记录，与原格式完全一致）。
+
+选出的范围以 JSON 字符串写进 safetensors 的 __metadata__["encrypted_ranges"]：
+
+    {"version": 1, "ranges": [[start, end], ...]}
+
+偏移相对 tensor 数据区起点，key 相位与整块加密一致（= 字节偏移），所以范围内的字节
+仍可以单独解密。加载时只解密这些范围，其余字节直接使用文件映射，不拷贝。
+
+注意：范围外的权重以明文存放，覆盖率越低越容易被部分恢复，按模型的保护需求选择。
+
+xor 加密的 safetensors 文件开头没有 flag，加密工具在 __metadata__["wk_encrypted"] 写入
+"xor" 作为标记，客户端据此判断是否走解密流程（is_encrypted_metadata）；解密还原的
+明文文件去掉标记和范围记录（header_without_encryption）。
+
+格式变化：加标记之前的加密工具原样保留 header，写出的文件和明文模型在 header 上无法区分，
+现在的客户端会把它们当成普通模型。这类文件用 tools/mark_encrypted.py 补一次标记（只改
+header，不需要 key）。改写后的 header 保持 key 顺序并补齐 8 字节对齐，tensor 数据区与
+原来逐字节相同；由 safetensors 写出的 header 去掉标记后与原文件逐字节相同。
+"""
+
+import fnmatch
+import json
+
+RANGES_KEY = "encrypted_ranges"
+ENCRYPTED_KEY = "wk_encrypted"
+XOR_SCHEME = "xor"
+RANGES_VERSION = 1
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+HEADER_ALIGNMENT = 8
+
+def merge_ranges(ranges):
+    """排序并合并相邻/重叠的 [start, end) 范围，去掉空范围"""
+    merged = []
+    for start, end in sorted((int(s), int(e)) for s, e in ranges):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def covered_bytes(ranges):
+    return sum(end - start for start, end in ranges)
+
+class EncryptionPolicy:
+    def __init__(self, patterns=None, fraction=None, max_tensor_bytes=None, block_size=DEFAULT_BLOCK_SIZE):
+        if fraction is not None and not 0 <= fraction <= 1:
+            raise ValueError(f"加密比例必须在0~1之间: {fraction}")
+        if block_size <= 0:
+            raise ValueError(f"块大小必须为正数: {block_size}")
+        self.patterns = list(patterns or [])
+        self.fraction = fraction
+        self.max_tensor_bytes = max_tensor_bytes
+        self.block_size = block_size
+
+    @property
+    def is_full(self):
+        return not self.patterns and self.fraction is None and self.max_tensor_bytes is None
+
+    def select(self, header, payload_len):
+        """
+        header: 解析后的 safetensors header dict；返回合并后的加密范围列表，
+        整块加密时返回 None
+        """
+        if self.is_full:
+            return None
+        ranges = []
+        for name, info in header.items():
+            if name == "__metadata__":
+                continue
+            start, end = info["data_offsets"]
+            if any(fnmatch.fnmatchcase(name, pattern) for pattern in self.patterns):
+                ranges.append((start, end))
+            elif self.max_tensor_bytes is not None and end - start <= self.max_tensor_bytes:
+                ranges.append((start, end))
+        if self.fraction:
+            # 第 i 块在 floor((i+1)*f) > floor(i*f) 时加密，选中的块在数据区里均匀分布
+            block_count = (payload_len + self.block_size - 1) // self.block_size
+            for index in range(block_count):
+                if int((index + 1) * self.fraction) > int(index * self.fraction):
+                    ranges.append((index * self.block_size, min((index + 1) * self.block_size, payload_len)))
+        return merge_ranges(ranges)
+
+def dump_header(header):
+    """
+    按 safetensors 自己的写法序列化 header：紧凑 JSON、非 ASCII 字符原样输出，末尾补空格到
+    HEADER_ALIGNMENT 字节，tensor 数据区的起点保持对齐
+    """
+    data = json.dumps(header, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return data + b" " * (-len(data) % HEADER_ALIGNMENT)
+
+def update_header_metadata(header_bytes, update):
+    """
+    用 update(metadata) 修改 header 的 __metadata__，返回新的 header bytes。
+    其余 key 保持原顺序，原来没有 __metadata__ 时插在最前面（与 safetensors 一致）；
+    metadata 没有变化时原样返回
+    """
+    header = json.loads(header_bytes)
+    original = header.get("__metadata__") or {}
+    metadata = dict(original)
+    update(metadata)
+    if metadata == original:
+        return header_bytes
+    if not metadata:
+        header.pop("__metadata__", None)
+    elif "__metadata__" in header:
+        header["__metadata__"] = metadata
+    else:
+        header = {"__metadata__": metadata, **header}
+    return dump_header(header)
+
+def header_with_ranges(header_bytes, ranges):
+    """把加密范围写进 safetensors header 的 __metadata__，返回新的 header bytes；ranges 为 None 时原样返回"""
+    if ranges is None:
+        return header_bytes
+    record = json.dumps({"version": RANGES_VERSION, "ranges": ranges}, separators=(",", ":"))
+    return update_header_metadata(header_bytes, lambda metadata: metadata.__setitem__(RANGES_KEY, record))
+
+def ranges_from_metadata(metadata):
+    """从 __metadata__ dict 取出加密范围，没有记录（整块加密）时返回 None"""
+    raw = (metadata or {}).get(RANGES_KEY)
+    if not raw:
+        return None
+    record = raw if isinstance(raw, dict) else json.loads(raw)
+    if record.get("version") != RANGES_VERSION:
+        raise ValueError(f"不支持的加密范围记录版本: {record.get('version')}")
+    return merge_ranges(record["ranges"])
+
+def ranges_from_header(header_bytes):
+    """从 safetensors header bytes 取出加密范围，没有记录时返回 None"""
+    try:
+        header = json.loads(header_bytes)
+    except ValueError:
+        return None
+    return ranges_from_metadata(header.get("__metadata__") if isinstance(header, dict) else None)
+
+def header_with_marker(header_bytes, scheme=XOR_SCHEME):
+    """在 safetensors header 的 __metadata__ 里写入加密标记，返回新的 header bytes"""
+    return update_header_metadata(header_bytes, lambda metadata: metadata.__setitem__(ENCRYPTED_KEY, scheme))
+
+def header_without_encryption(header_bytes):
+    """去掉加密标记和加密范围记录，用于解密还原出的明文文件"""
+    def strip(metadata):
+        metadata.pop(ENCRYPTED_KEY, None)
+        metadata.pop(RANGES_KEY, None)
+    return update_header_metadata(header_bytes, strip)
+
+def is_encrypted_metadata(metadata):
+    """
+    __metadata__ dict 是否来自 xor 加密的文件。没有标记的旧文件里，记录了加密范围的
+    也只可能是部分加密写出的，一并识别
+    """
+    metadata = metadata or {}
+    return metadata.get(ENCRYPTED_KEY) == XOR_SCHEME or RANGES_KEY in metadata
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+分块完整性清单（manifest）
+
+原来的完整性校验只有一个覆盖整个模型的 MD5，只能串行计算，也不知道坏在哪里。
+这里把 tensor 数据（明文）按 chunk_size 切块，每块算 BLAKE2b-128，再对所有块摘要
+算一个根摘要（两层树）。清单以 JSON 字符串写进 safetensors 的
+__metadata__["integrity_manifest"]：
+
+    {"algo": "blake2b-128", "chunk_size": 4194304, "root": "...", "chunks": ["...", ...]}
+
+- 加密工具在流式加密的同一遍里生成清单（先写等长占位 header，结束后回写）
+- 加载时在解密的同一遍里逐块校验（ManifestChecker），各块可以多线程并行（hashlib 处理大块数据时
+  会释放 GIL），遇到第一个坏块就停止解密并报告它对应的 tensor
+- VerifiedCache 记录已校验通过的 (path, size, mtime, key id)，文件没变就不再重复 hash
+"""
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from encryption_policy import update_header_metadata
+
+MANIFEST_KEY = "integrity_manifest"
+MANIFEST_ALGO = "blake2b-128"
+DEFAULT_MANIFEST_CHUNK_SIZE = 4 * 1024 * 1024
+DIGEST_SIZE = 16
+
+def chunk_digest(data):
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).hexdigest()
+
+def root_digest(chunks):
+    root = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    for digest in chunks:
+        root.update(bytes.fromhex(digest))
+    return root.hexdigest()
+
+class ManifestBuilder:
+    """按顺序喂入明文（任意切分），生成分块清单"""
+
+    def __init__(self, chunk_size=DEFAULT_MANIFEST_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self._current = hashlib.blake2b(digest_size=DIGEST_SIZE)
+        self._filled = 0
+
+    def update(self, data):
+        view = memoryview(data).cast("B")
+        pos = 0
+        while pos < len(view):
+            n = min(self.chunk_size - self._filled, len(view) - pos)
+            self._current.update(view[pos:pos + n])
+            self._filled += n
+            pos += n
+            if self._filled == self.chunk_size:
+                self.chunks.append(self._current.hexdigest())
+                self._current = hashlib.blake2b(digest_size=DIGEST_SIZE)
+                self._filled = 0
+
+    def finish(self):
+        if self._filled:
+            self.chunks.append(self._current.hexdigest())
+            self._filled = 0
+        return {"algo": MANIFEST_ALGO, "chunk_size": self.chunk_size,
+                "root": root_digest(self.chunks), "chunks": list(self.chunks)}
+
+def placeholder_manifest(payload_len, chunk_size=DEFAULT_MANIFEST_CHUNK_SIZE):
+    """与最终清单序列化后等长的占位清单，用于先写 header、加密完再回写"""
+    count = (payload_len + chunk_size - 1) // chunk_size
+    zero = "0" * (DIGEST_SIZE * 2)
+    return {"algo": MANIFEST_ALGO, "chunk_size": chunk_size, "root": zero, "chunks": [zero] * count}
+
+def header_with_manifest(header_bytes, manifest):
+    """把清单写进 safetensors header 的 __metadata__，返回新的 header bytes（占位与真实清单写出的长度相同）"""
+    record = json.dumps(manifest, separators=(",", ":"))
+    return update_header_metadata(header_bytes, lambda metadata: metadata.__setitem__(MANIFEST_KEY, record))
+
+def manifest_from_header(header_bytes):
+    """从 safetensors header 取出清单，没有时返回 None"""
+    try:
+        raw = (json.loads(header_bytes).get("__metadata__") or {}).get(MANIFEST_KEY)
+        if isinstance(raw, dict):
+            return raw
+        return json.loads(raw) if raw else None
+    except (ValueError, AttributeError):
+        return None
+
+def verify_manifest(buffer, manifest, workers=None):
+    """
+    多线程并行校验明文 buffer 的每一块，返回不匹配的块下标列表（空列表表示全部通过）
+    """
+    view = memoryview(buffer).cast("B")
+    chunk_size = manifest["chunk_size"]
+    expected = manifest["chunks"]
+    if (len(view) + chunk_size - 1) // chunk_size != len(expected):
+        return list(range(len(expected)))
+    workers = workers or os.cpu_count() or 1
+
+    def check(index):
+        start = index * chunk_size
+        return chunk_digest(view[start:start + chunk_size]) == expected[index]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(check, range(len(expected))))
+    return [index for index, ok in enumerate(results) if not ok]
+
+class ManifestChecker:
+    """
+    解密时的逐块校验回调：作为 xor_into_hashed 的 chunk_check，按清单的 chunk_size 切块，
+    块不匹配时记进 bad_chunks 并返回 False，解密在坏块处停止，不再单独遍历一遍明文
+    """
+
+    def __init__(self, manifest):
+        self.chunk_size = manifest["chunk_size"]
+        self.expected = manifest["chunks"]
+        self.bad_chunks = []
+
+    def matches_length(self, payload_len):
+        return (payload_len + self.chunk_size - 1) // self.chunk_size == len(self.expected)
+
+    def __call__(self, index, chunk):
+        if index < len(self.expected) and chunk_digest(chunk) == self.expected[index]:
+            return True
+        self.bad_chunks.append(index)
+        return False
+
+def verify_manifest_stream(builder, manifest):
+    """ManifestBuilder 顺序喂完数据后与清单比对，返回不匹配的块下标列表"""
+    actual = builder.finish()["chunks"]
+    expected = manifest["chunks"]
+    if len(actual) != len(expected):
+        return list(range(len(expected)))
+    return [index for index, (a, b) in enumerate(zip(actual, expected)) if a != b]
+
+def corrupt_tensors(header_bytes, bad_chunks, chunk_size):
+    """把坏块下标映射到涉及的 tensor 名称；__metadata__ 和 model_md5 这类非 tensor 条目跳过"""
+    if not bad_chunks:
+        return []
+    header = json.loads(header_bytes)
+    names = []
+    for name, info in header.items():
+        if not isinstance(info, dict) or "data_offsets" not in info:
+            continue
+        start, end = info["data_offsets"]
+        if end <= start:
+            continue
+        first, last = start // chunk_size, (end - 1) // chunk_size
+        if any(first <= index <= last for index in bad_chunks):
+            names.append(name)
+    return names
+
+class VerifiedCache:
+    """
+    已校验通过的文件记录：(path, size, mtime, key id)。
+    path 为 None 时只在进程内记录，否则同时持久化到 JSON 文件
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = set()
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._entries = set(json.load(f))
+            except (OSError, ValueError):
+                self._entries = set()
+
+    @staticmethod
+    def entry_id(model_path, key_bytes):
+        path = os.path.abspath(str(model_path))
+        st = os.stat(path)
+        key_id = hashlib.sha256(key_bytes).hexdigest()[:16]
+        return f"{path}|{st.st_size}|{st.st_mtime_ns}|{key_id}"
+
+    def contains(self, model_path, key_bytes):
+        try:
+            return self.entry_id(model_path, key_bytes) in self._entries
+        except OSError:
+            return False
+
+    def add(self, model_path, key_bytes):
+        with self._lock:
+            self._entries.add(self.entry_id(model_path, key_bytes))
+            if self.path:
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(sorted(self._entries), f)
+                os.replace(tmp_path, self.path)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+解密密钥缓存
+
+按 (API key, 模型标识) 缓存许可证服务器返回的解密密钥，避免 WebUI 每次切换模型都要
+做一次阻塞的 HTTPS 往返。
+
+- 进程内缓存：dict，带 TTL
+- 可选磁盘缓存：JSON 文件，每条记录用设备绑定的密钥做 AES-GCM 加密，
+  换机器或设备指纹变化后无法解开，直接当作未命中；条目 id 为 sha256，不落盘明文 API key
+- invalidate() 显式失效，get() 统计命中/未命中次数
+"""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+
+def model_identity(model_path):
+    """模型标识：绝对路径 + 大小 + mtime，文件被替换后自动换一个缓存条目"""
+    path = os.path.abspath(str(model_path))
+    try:
+        st = os.stat(path)
+        return f"{path}|{st.st_size}|{st.st_mtime_ns}"
+    except OSError:
+        return path
+
+class KeyCache:
+    def __init__(self, ttl=3600, disk_path=None, device_secret=None):
+        """
+        ttl: 缓存有效期（秒），<=0 表示不缓存
+        disk_path: 磁盘缓存文件路径，None 表示只用进程内缓存
+        device_secret: 设备绑定的密钥材料（bytes 或可调用对象，首次写/读磁盘时才求值）
+        """
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self._device_secret = device_secret
+        self._aes_key = None
+        self._memory = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _entry_id(api_key, model_id):
+        return hashlib.sha256(f"{api_key}\0{model_id}".encode("utf-8")).hexdigest()
+
+    def _disk_cipher(self):
+        if not self.disk_path or self._device_secret is None:
+            return None
+        try:
+            # 延迟导入：只有启用磁盘缓存时才需要 cryptography
+            from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        except ImportError:
+            return None
+        if self._aes_key is None:
+            secret = self._device_secret() if callable(self._device_secret) else self._device_secret
+            if isinstance(secret, str):
+                secret = secret.encode("utf-8")
+            self._aes_key = hashlib.sha256(b"SecureModelLoader-key-cache\0" + secret).digest()
+        return AESGCM(self._aes_key)
+
+    def _load_disk(self):
+        try:
+            with open(self.disk_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_disk(self, entries):
+        tmp_path = f"{self.disk_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.disk_path)
+
+    def _get_disk(self, entry_id, now):
+        cipher = self._disk_cipher()
+        if cipher is None:
+            return None
+        record = self._load_disk().get(entry_id)
+        if not record:
+            return None
+        try:
+            nonce = base64.b64decode(record["nonce"])
+            plain = cipher.decrypt(nonce, base64.b64decode(record["data"]), entry_id.encode())
+            value = json.loads(plain)
+        except Exception:
+            # 设备变化或文件损坏，当作未命中
+            return None
+        if value["expires"] <= now:
+            return None
+        return value["key"], value["expires"]
+
+    def _put_disk(self, entry_id, key, expires):
+        cipher = self._disk_cipher()
+        if cipher is None:
+            return
+        nonce = os.urandom(12)
+        plain = json.dumps({"key": key, "expires": expires}).encode("utf-8")
+        entries = {k: v for k, v in self._load_disk().items() if v.get("expires", 0) > time.time()}
+        entries[entry_id] = {
+            "nonce": base64.b64encode(nonce).decode(),
+            "data": base64.b64encode(cipher.encrypt(nonce, plain, entry_id.encode())).decode(),
+            "expires": expires,
+        }
+        self._save_disk(entries)
+
+    def get(self, api_key, model_id):
+        """命中返回密钥，未命中或过期返回 None"""
+        if self.ttl <= 0:
+            return None
+        entry_id = self._entry_id(api_key, model_id)
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(entry_id)
+            if cached is None or cached[1] <= now:
+                cached = self._get_disk(entry_id, now)
+                if cached is not None:
+                    self._memory[entry_id] = cached
+            if cached is None:
+                self._memory.pop(entry_id, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return cached[0]
+
+    def put(self, api_key, model_id, key):
+        if self.ttl <= 0:
+            return
+        entry_id = self._entry_id(api_key, model_id)
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._memory[entry_id] = (key, expires)
+            try:
+                self._put_disk(entry_id, key, expires)
+            except OSError:
+                pass
+
+    def invalidate(self, api_key=None, model_id=None):
+        """指定 api_key 和 model_id 时只删这一条，否则清空全部缓存（包括磁盘）"""
+        with self._lock:
+            if api_key is not None and model_id is not None:
+                entry_id = self._entry_id(api_key, model_id)
+                self._memory.pop(entry_id, None)
+                if self.disk_path and os.path.exists(self.disk_path):
+                    entries = self._load_disk()
+                    if entries.pop(entry_id, None) is not None:
+                        self._save_disk(entries)
+            else:
+                self._memory.clear()
+                if self.disk_path and os.path.exists(self.disk_path):
+                    os.remove(self.disk_path)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._memory)}
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+加密safetensors按需随机读取
+
+header 里每个 tensor 都带有 data_offsets，而 XOR 的 key 相位只和字节偏移有关，
+所以单个 tensor（甚至其中连续的几行）可以单独解密。LazyEncryptedSafetensors
+提供与 safetensors.safe_open 相近的 keys() / get_tensor() / get_slice() 接口，
+每次调用只解密实际用到的字节，并直接包装成 torch tensor，不做额外拷贝。
+
+用法:
+    with LazyEncryptedSafetensors(path, bytes.fromhex(key)) as f:
+        unet = {k: f.get_tensor(k) for k in f.keys() if k.startswith("model.diffusion_model.")}
+"""
+
+import json
+import mmap
+import os
+
+from encryption_policy import ranges_from_metadata
+from xor_cipher import xor_ranges_into
+
+# safetensors dtype -> torch dtype 名；checkpoint_info 和 tools/tensor_encryptor.py 也用这一份
+DTYPES = {
+    "F64": "float64",
+    "F32": "float32",
+    "F16": "float16",
+    "BF16": "bfloat16",
+    "I64": "int64",
+    "I32": "int32",
+    "I16": "int16",
+    "I8": "int8",
+    "U8": "uint8",
+    "BOOL": "bool",
+    "F8_E4M3": "float8_e4m3fn",
+    "F8_E5M2": "float8_e5m2",
+}
+# torch dtype 名 -> safetensors dtype
+TORCH_DTYPES = {torch_name: dtype for dtype, torch_name in DTYPES.items()}
+
+def _to_tensor(buf, dtype, shape):
+    """把解密后的bytearray零拷贝包装成torch tensor"""
+    import torch
+    torch_dtype = getattr(torch, DTYPES[dtype])
+    if not len(buf):
+        return torch.empty(shape, dtype=torch_dtype)
+    return torch.frombuffer(buf, dtype=torch_dtype).reshape(shape)
+
+def state_dict_from_buffer(header_bytes, buffer):
+    """
+    按 header 的 data_offsets 把整块明文 buffer 切成 tensor dict，tensor 与 buffer 共享内存，不拷贝。
+    buffer 应当可写（文件映射用 ACCESS_COPY）：只读 buffer 上的 tensor 被原地修改会直接崩溃，
+    torch 会对此给出不可写警告
+    """
+    header = json.loads(header_bytes)
+    view = memoryview(buffer).cast("B")
+    state_dict = {}
+    for name, info in header.items():
+        if not isinstance(info, dict) or "data_offsets" not in info:
+            continue
+        start, end = info["data_offsets"]
+        state_dict[name] = _to_tensor(view[start:end], info["dtype"], info["shape"])
+    return state_dict
+
+class EncryptedSlice:
+    """
+    get_slice 返回的切片对象：沿第0维的切片只解密涉及的那几行，
+    其余维度的索引在解密出的小tensor上完成
+    """
+
+    def __init__(self, reader, name):
+        self._reader = reader
+        self._name = name
+        self._info = reader.tensor_info(name)
+
+    def get_shape(self):
+        return list(self._info["shape"])
+
+    def get_dtype(self):
+        return self._info["dtype"]
+
+    def __getitem__(self, index):
+        if not self._info["shape"]:
+            return self._reader.get_tensor(self._name)[index]
+        if not isinstance(index, tuple):
+            index = (index,)
+        first, rest = index[0], index[1:]
+        rows = range(self._info["shape"][0])
+        if isinstance(first, int):
+            row = rows[first]
+            return self._reader.get_rows(self._name, row, row + 1)[(0,) + rest]
+        if not isinstance(first, slice):
+            # 高级索引直接整块解密
+            return self._reader.get_tensor(self._name)[index]
+        rows = rows[first]
+        if rows.step < 0:
+            raise ValueError("不支持负步长切片")
+        if not rows:
+            block = self._reader.get_rows(self._name, 0, 0)
+        else:
+            block = self._reader.get_rows(self._name, rows[0], rows[-1] + 1)[::rows.step]
+        return block[(slice(None),) + rest]
+
+class LazyEncryptedSafetensors:
+    """加密safetensors的按需读取器，只解密每次调用涉及的字节"""
+
+    def __init__(self, path, key_bytes, workers=1):
+        self.path = str(path)
+        self.key_bytes = key_bytes
+        self.workers = workers
+        self._file = open(self.path, "rb")
+        try:
+            header_len = int.from_bytes(self._file.read(8), "little")
+            header = json.loads(self._file.read(header_len))
+            self._metadata = header.pop("__metadata__", {}) or {}
+            self._ranges = ranges_from_metadata(self._metadata)
+            self._tensors = header
+            self._data_start = 8 + header_len
+            size = os.fstat(self._file.fileno()).st_size
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        except Exception:
+            self._file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def keys(self):
+        return list(self._tensors.keys())
+
+    def metadata(self):
+        return dict(self._metadata)
+
+    def tensor_info(self, name):
+        if name not in self._tensors:
+            raise KeyError(f"模型中不存在tensor: {name}")
+        return self._tensors[name]
+
+    def read_range(self, start, end):
+        """解密tensor数据区 [start, end) 的字节（偏移相对tensor数据区起点，部分加密时只异或加密范围），返回bytearray"""
+        out = bytearray(end - start)
+        if end > start:
+            src = memoryview(self._mmap)
+            try:
+                xor_ranges_into(src[self._data_start + start:self._data_start + end], out,
+                                self.key_bytes, self._ranges, start, workers=self.workers)
+            finally:
+                src.release()
+        return out
+
+    def get_tensor(self, name):
+        info = self.tensor_info(name)
+        start, end = info["data_offsets"]
+        return _to_tensor(self.read_range(start, end), info["dtype"], info["shape"])
+
+    def get_rows(self, name, lo, hi):
+        """只解密第0维 [lo, hi) 这几行"""
+        info = self.tensor_info(name)
+        shape = list(info["shape"])
+        start, end = info["data_offsets"]
+        row_bytes = (end - start) // shape[0] if shape[0] else 0
+        buf = self.read_range(start + lo * row_bytes, start + hi * row_bytes)
+        return _to_tensor(buf, info["dtype"], [hi - lo] + shape[1:])
+
+    def get_slice(self, name):
+        return EncryptedSlice(self, name)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+许可证服务器 HTTP 客户端
+
+secure_loader 和 test_verify_key 共用：
+- 持久化 requests.Session + 连接池（keep-alive），不必每次请求都重新建 TCP/TLS 连接
+- 连接超时与读取超时分开配置
+- 网络错误、超时、429 和 5xx 自动重试，指数退避 + 随机抖动；4xx（授权失败等）不重试
+- 记录每次请求的耗时、重试次数，metrics() 汇总 p50/p99
+"""
+
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+class LicenseClient:
+    def __init__(self, connect_timeout=5, read_timeout=15, max_retries=3,
+                 backoff_base=0.5, backoff_max=8.0, pool_size=8, user_agent="SecureModelLoader/1.1"):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"User-Agent": user_agent})
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+
+    def _backoff(self, attempt):
+        """指数退避 + full jitter"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _record(self, latency, retries, failed):
+        with self._lock:
+            self._latencies.append(latency)
+            self.requests += 1
+            self.retries += retries
+            if failed:
+                self.failures += 1
+
+    def post_json(self, url, payload, headers=None, logger=None):
+        """
+        POST JSON，失败按策略重试。返回最后一次的 Response（调用方自行 raise_for_status）；
+        重试用尽仍是网络错误时抛出 requests 的异常
+        """
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            attempt_start = time.perf_counter()
+            try:
+                response = self.session.post(url, json=payload, headers=headers,
+                                             timeout=(self.connect_timeout, self.read_timeout))
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= self.max_retries:
+                    self._record(time.perf_counter() - start, attempt, True)
+                    raise
+                delay = self._backoff(attempt)
+                if logger:
+                    logger.warning(f"⚠️ 请求失败({type(e).__name__})，{delay:.2f}s 后第 {attempt + 1} 次重试")
+            else:
+                if response.status_code not in RETRY_STATUS or attempt >= self.max_retries:
+                    latency = time.perf_counter() - start
+                    self._record(latency, attempt, response.status_code >= 400)
+                    if logger:
+                        logger.info(f"⏱️ 请求耗时 {latency * 1000:.0f}ms（本次 {(time.perf_counter() - attempt_start) * 1000:.0f}ms，"
+                                    f"重试 {attempt} 次，状态码 {response.status_code}）")
+                    return response
+                delay = self._backoff(attempt)
+                if logger:
+                    logger.warning(f"⚠️ 服务器返回 {response.status_code}，{delay:.2f}s 后第 {attempt + 1} 次重试")
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def metrics(self):
+        """请求次数、重试、失败以及耗时分位数（毫秒）"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            result = {"requests": self.requests, "retries": self.retries, "failures": self.failures}
+        if latencies:
+            result.update({
+                "p50_ms": latencies[len(latencies) // 2] * 1000,
+                "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+                "max_ms": latencies[-1] * 1000,
+            })
+        return result
+
+    def close(self):
+        self.session.close()
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_license_client(**kwargs):
+    """进程内共享的客户端，首次调用时按 kwargs 创建"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LicenseClient(**kwargs)
+        return _client
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+加密模型加载流程的分阶段指标
+
+原来每一步只有 print 和 emoji 日志，看不出时间花在哪里。LoadMetrics 记录每个阶段
+（flag检查、读header、取密钥、解密、hash、写文件）的耗时、处理字节数和峰值内存，结束时：
+- 作为一行 JSON 写进指标日志（logger 名为 SecureModelLoader.metrics）
+- 可选写 Prometheus textfile（node_exporter 的 textfile collector 直接采集）
+- 依次调用 register_metrics_callback 注册的回调
+
+环境变量 SECURE_LOADER_PROFILE=cprofile|tracemalloc 时，对下一次加载做一次性剖析，
+结果写到 PROFILE_DIR（cProfile 为 .prof，tracemalloc 为内存分配 top 统计文本）。
+
+日志通过 QueueHandler 写入，文件 IO 在 QueueListener 的后台线程里完成，不占加载关键路径。
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+PROFILE_ENV = "SECURE_LOADER_PROFILE"
+
+_callbacks = []
+_listeners = []
+_load_counts = {}
+_counts_lock = threading.Lock()
+_profile_lock = threading.Lock()
+_profile_used = False
+
+# ========== 峰值内存 ==========
+# tools/benchmark.py 也用这几个函数统计每个用例的内存
+def _proc_status_mb(field):
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def reset_peak_rss():
+    """
+    Linux 下清零本进程的峰值RSS（VmHWM），让每个阶段只统计自己的峰值；其他平台无操作。
+    ru_maxrss 会继承父进程 fork 时的值，不清零的话小阶段的峰值会被之前的内存占用掩盖
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def current_rss_mb():
+    rss = _proc_status_mb("VmRSS")
+    return rss if rss is not None else peak_rss_mb()
+
+def peak_rss_mb():
+    peak = _proc_status_mb("VmHWM")
+    if peak is not None:
+        return peak
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss：Linux 下单位是 KB，macOS 是字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+# ========== 日志 ==========
+def queued_logger(name, handler, level=logging.INFO):
+    """
+    返回挂着 QueueHandler 的 logger，真正的 handler 由后台 QueueListener 线程调用；
+    logger 已有 handler 时原样返回（防止重复添加）
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    if logger.handlers:
+        return logger
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    return logger
+
+def stop_listeners():
+    """停止后台日志线程并写完队列里剩余的记录（进程退出时自动调用）"""
+    while _listeners:
+        _listeners.pop().stop()
+
+atexit.register(stop_listeners)
+
+# ========== 回调 / Prometheus ==========
+def register_metrics_callback(callback):
+    """注册指标回调，每次加载结束时以记录 dict 调用；回调抛出的异常只记日志"""
+    _callbacks.append(callback)
+    return callback
+
+def unregister_metrics_callback(callback):
+    if callback in _callbacks:
+        _callbacks.remove(callback)
+
+def _prom_labels(**labels):
+    return ",".join(f'{k}="{str(v).replace(chr(34), "")}"' for k, v in labels.items())
+
+def write_prometheus_textfile(path, record):
+    """把最近一次加载的指标和累计加载次数写成 Prometheus 文本格式（先写临时文件再替换）"""
+    with _counts_lock:
+        counts = dict(_load_counts)
+    lines = [
+        "# HELP secure_loader_loads_total Secure loader runs by kind and status.",
+        "# TYPE secure_loader_loads_total counter",
+    ]
+    lines += [f"secure_loader_loads_total{{{_prom_labels(kind=k, status=s)}}} {n}"
+              for (k, s), n in sorted(counts.items())]
+    lines += [
+        "# HELP secure_loader_last_load_seconds Wall time of the last encrypted model load.",
+        "# TYPE secure_loader_last_load_seconds gauge",
+        f"secure_loader_last_load_seconds {record['total_ms'] / 1000:.6f}",
+        "# HELP secure_loader_phase_seconds Wall time of each phase of the last load.",
+        "# TYPE secure_loader_phase_seconds gauge",
+    ]
+    lines += [f"secure_loader_phase_seconds{{{_prom_labels(phase=p['name'])}}} {p['ms'] / 1000:.6f}"
+              for p in record["phases"]]
+    lines += [
+        "# HELP secure_loader_phase_bytes Bytes processed by each phase of the last load.",
+        "# TYPE secure_loader_phase_bytes gauge",
+    ]
+    lines += [f"secure_loader_phase_bytes{{{_prom_labels(phase=p['name'])}}} {p['bytes']}" for p in record["phases"]]
+    lines += [
+        "# HELP secure_loader_phase_peak_rss_bytes Peak RSS observed during each phase of the last load.",
+        "# TYPE secure_loader_phase_peak_rss_bytes gauge",
+    ]
+    lines += [f"secure_loader_phase_peak_rss_bytes{{{_prom_labels(phase=p['name'])}}} {int(p['peak_rss_mb'] * 1024**2)}"
+              for p in record["phases"] if p.get("peak_rss_mb") is not None]
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+
+# ========== 一次性剖析 ==========
+def _claim_profile():
+    """环境变量要求剖析且本进程还没剖析过时返回模式名，否则返回 None"""
+    global _profile_used
+    mode = os.environ.get(PROFILE_ENV, "").strip().lower()
+    if mode not in ("cprofile", "tracemalloc"):
+        return None
+    with _profile_lock:
+        if _profile_used:
+            return None
+        _profile_used = True
+    return mode
+
+@contextmanager
+def maybe_profile(profile_dir, logger=None):
+    """按 SECURE_LOADER_PROFILE 对包住的代码做一次 cProfile / tracemalloc 剖析"""
+    mode = _claim_profile()
+    if mode is None:
+        yield None
+        return
+    os.makedirs(profile_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d_%H%M%S")
+    if mode == "cprofile":
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield mode
+        finally:
+            profiler.disable()
+            path = os.path.join(profile_dir, f"load_{stamp}.prof")
+            profiler.dump_stats(path)
+            if logger:
+                logger.info(f"🔬 cProfile 结果已保存: {path}（python -m pstats 查看）")
+    else:
+        import tracemalloc
+        tracemalloc.start(25)
+        try:
+            yield mode
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            path = os.path.join(profile_dir, f"load_{stamp}_tracemalloc.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"current={current / 1024**2:.1f}MB peak={peak / 1024**2:.1f}MB\n")
+                for stat in snapshot.statistics("lineno")[:50]:
+                    f.write(f"{stat}\n")
+            if logger:
+                logger.info(f"🔬 tracemalloc 结果已保存: {path}")
+
+# ========== 分阶段记录 ==========
+class LoadMetrics:
+    """
+    一次加载的分阶段指标:
+        metrics = LoadMetrics(model_path)
+        with metrics.phase("decrypt", nbytes=data_len):
+            ...
+        metrics.finish("ok", metrics_logger, prometheus_path)
+    """
+
+    def __init__(self, model_path, kind="load"):
+        self.model_path = str(model_path)
+        self.kind = kind
+        self.phases = []
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name, nbytes=0, **extra):
+        """记录一个阶段；nbytes 可以在阶段内通过返回的 dict 的 "bytes" 字段再修改"""
+        entry = {"name": name, "bytes": nbytes}
+        entry.update(extra)
+        reset_peak_rss()
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            elapsed = time.perf_counter() - start
+            entry["ms"] = round(elapsed * 1000, 3)
+            if entry["bytes"]:
+                entry["mb_s"] = round(entry["bytes"] / 1024**2 / max(elapsed, 1e-9), 1)
+            peak = peak_rss_mb()
+            entry["peak_rss_mb"] = round(peak, 1) if peak is not None else None
+            self.phases.append(entry)
+
+    def record(self, status):
+        return {
+            "event": f"secure_loader.{self.kind}",
+            "model": self.model_path,
+            "status": status,
+            "total_ms": round((time.perf_counter() - self.start) * 1000, 3),
+            "phases": list(self.phases),
+        }
+
+    def finish(self, status="ok", logger=None, prometheus_path=None):
+        """生成记录并输出到 JSON 日志 / Prometheus textfile / 回调，返回记录 dict"""
+        record = self.record(status)
+        with _counts_lock:
+            _load_counts[(self.kind, status)] = _load_counts.get((self.kind, status), 0) + 1
+        if logger is not None:
+            logger.info(json.dumps(record, ensure_ascii=False))
+        if prometheus_path:
+            try:
+                write_prometheus_textfile(prometheus_path, record)
+            except OSError as e:
+                logging.getLogger("SecureModelLoader").warning(f"⚠️ 写Prometheus指标失败: {str(e)}")
+        for callback in list(_callbacks):
+            try:
+                callback(record)
+            except Exception as e:
+                logging.getLogger("SecureModelLoader").warning(f"⚠️ 指标回调异常: {str(e)}")
+        return record
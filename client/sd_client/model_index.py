@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+模型库持久化索引
+
+is_my_model / read_safetensors_metadata 每次调用都要重新打开、解析文件；模型库放在
+网络存储上、有几百个 checkpoint/LoRA/embedding 时，全量扫描非常慢。这里把每个文件的
+探测结果存进 SQLite，以 (path, size, mtime) 为键，文件没变就直接查库，变了才重新解析。
+
+每条记录: 是否加密、加密方式、header长度、解析后的 __metadata__、tensor 数量、tensor 数据总大小
+
+加密方式: "container" 为文件开头带 ENCRYPT_FLAG 的 hybrid 容器（flag 补 \0 到16字节，按前缀比较），
+"xor" 为 __metadata__ 里带加密标记的 xor safetensors（见 encryption_policy.is_encrypted_metadata）
+
+命令行: python model_index.py <模型目录> [索引文件]  增量刷新并打印索引
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+from encryption_policy import XOR_SCHEME, is_encrypted_metadata
+
+ENCRYPT_FLAG = b'WK_ENCRYPTED_v1'  # 与 secure_loader.ENCRYPT_FLAG 保持一致
+DEFAULT_INDEX_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), "model_index.sqlite"))
+CONTAINER_SCHEME = "container"
+# 表结构或探测逻辑变化时加一，打开旧索引时丢弃全部记录重新探测
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    encrypted INTEGER NOT NULL,
+    scheme TEXT,
+    header_len INTEGER,
+    metadata TEXT,
+    tensor_count INTEGER,
+    payload_size INTEGER
+)
+"""
+
+def parse_metadata(raw):
+    """与 read_safetensors_metadata 相同：值是 JSON 字符串时再解析一层"""
+    res = {}
+    for k, v in (raw or {}).items():
+        res[k] = v
+        if isinstance(v, str) and v[0:1] == '{':
+            try:
+                res[k] = json.loads(v)
+            except Exception:
+                pass
+    return res
+
+def probe_file(path, encrypt_flag=ENCRYPT_FLAG):
+    """读取文件头部，返回索引记录（不含 path/size/mtime）"""
+    record = {"encrypted": False, "scheme": None, "header_len": None, "metadata": {}, "tensor_count": None,
+              "payload_size": None}
+    with open(path, "rb") as f:
+        head = f.read(len(encrypt_flag))
+        if head == encrypt_flag:
+            record["encrypted"], record["scheme"] = True, CONTAINER_SCHEME
+            return record
+        f.seek(0)
+        header_len = int.from_bytes(f.read(8), "little")
+        json_start = f.read(2)
+        if header_len <= 2 or json_start not in (b'{"', b"{'"):
+            return record
+        try:
+            header = json.loads(json_start + f.read(header_len - 2))
+        except ValueError:
+            return record
+        size = os.fstat(f.fileno()).st_size
+    record["header_len"] = header_len
+    record["metadata"] = parse_metadata(header.pop("__metadata__", {}))
+    if is_encrypted_metadata(record["metadata"]):
+        record["encrypted"], record["scheme"] = True, XOR_SCHEME
+    record["tensor_count"] = len(header)
+    record["payload_size"] = max(0, size - 8 - header_len)
+    return record
+
+class ModelIndex:
+    def __init__(self, db_path=DEFAULT_INDEX_FILE, encrypt_flag=ENCRYPT_FLAG):
+        self.db_path = db_path
+        self.encrypt_flag = encrypt_flag
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self._conn.execute("DROP TABLE IF EXISTS files")
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._conn.execute(SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _row_to_record(row):
+        path, size, mtime_ns, encrypted, scheme, header_len, metadata, tensor_count, payload_size = row
+        return {
+            "path": path,
+            "size": size,
+            "mtime_ns": mtime_ns,
+            "encrypted": bool(encrypted),
+            "scheme": scheme,
+            "header_len": header_len,
+            "metadata": json.loads(metadata) if metadata else {},
+            "tensor_count": tensor_count,
+            "payload_size": payload_size,
+        }
+
+    def _lookup(self, path, st):
+        row = self._conn.execute(
+            "SELECT path, size, mtime_ns, encrypted, scheme, header_len, metadata, tensor_count, payload_size "
+            "FROM files WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (path, st.st_size, st.st_mtime_ns),
+        ).fetchone()
+        return self._row_to_record(row) if row else None
+
+    def _store(self, path, st):
+        record = probe_file(path, self.encrypt_flag)
+        record.update({"path": path, "size": st.st_size, "mtime_ns": st.st_mtime_ns})
+        self._conn.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, st.st_size, st.st_mtime_ns, int(record["encrypted"]), record["scheme"], record["header_len"],
+             json.dumps(record["metadata"], ensure_ascii=False), record["tensor_count"], record["payload_size"]),
+        )
+        return record
+
+    def get(self, path):
+        """返回文件的索引记录；文件大小或 mtime 变了会重新解析，文件不存在抛 OSError"""
+        path = os.path.abspath(str(path))
+        st = os.stat(path)
+        with self._lock:
+            record = self._lookup(path, st)
+            if record is None:
+                record = self._store(path, st)
+                self._conn.commit()
+            return record
+
+    def refresh(self, root, extensions):
+        """
+        增量刷新目录：只对新增或变化的文件重新解析，删除已不存在的文件记录
+        返回目录下全部文件的记录列表
+        """
+        root = os.path.abspath(root)
+        extensions = tuple(ext.lower() for ext in extensions)
+        records = []
+        seen = set()
+        with self._lock:
+            for dirpath, _, files in os.walk(root):
+                for name in files:
+                    if not name.lower().endswith(extensions):
+                        continue
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                        record = self._lookup(path, st) or self._store(path, st)
+                    except OSError:
+                        continue
+                    seen.add(path)
+                    records.append(record)
+            stale = [
+                (path,) for (path,) in self._conn.execute(
+                    "SELECT path FROM files WHERE path LIKE ?", (root.rstrip(os.sep) + os.sep + "%",))
+                if path not in seen
+            ]
+            self._conn.executemany("DELETE FROM files WHERE path = ?", stale)
+            self._conn.commit()
+        return records
+
+def main():
+    if len(sys.argv) < 2:
+        print("用法: python model_index.py <模型目录> [索引文件]")
+        sys.exit(1)
+    index = ModelIndex(sys.argv[2] if len(sys.argv) > 2 else DEFAULT_INDEX_FILE)
+    records = index.refresh(sys.argv[1], [".safetensors", ".ckpt", ".pt"])
+    for record in records:
+        flag = "🔒" if record["encrypted"] else "🟢"
+        print(f"{flag} {record['path']}  tensors={record['tensor_count']}  payload={record['payload_size']}")
+    print(f"共 {len(records)} 个模型文件，加密 {sum(r['encrypted'] for r in records)} 个")
+
+if __name__ == "__main__":
+    main()
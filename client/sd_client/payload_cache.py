@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+进程内解密结果缓存
+
+用户经常在几个 checkpoint 之间来回切换做对比，每次切回一个几分钟前刚解密过的模型，
+on_model_loaded 都要重新取密钥、读文件、整块异或、算md5。PayloadCache 把最近解密并
+校验通过的 tensor 数据（明文 buffer）留在内存里：
+- 总字节预算，超出时按 LRU 淘汰，单个超过预算的模型不缓存
+- 缓存持有自己的一份明文，调用方拿到的都是私有 buffer：zero-copy 的 state dict 被原地修改
+  不会污染下一次命中。Linux 下明文放在 memfd 里，put / get 返回它的 ACCESS_COPY 映射
+  （写时复制，与缓存共享物理页，不拷贝）；其他平台缓存只读 bytes，get 时拷贝一份
+- 内存压力感知：系统可用内存低于 min_available_bytes 时，从最久未使用的开始淘汰（每次
+  get / put 时检查）。被淘汰的明文可能仍被已加载模型的 tensor 引用，淘汰它不一定释放内存：
+  淘汰后可用内存没有相应回升就停止，且不淘汰最近使用的那一个条目
+- stats() 报告命中率、缓存字节数、条目数和淘汰次数
+
+键为模型标识（路径+大小+mtime），文件被替换后自动失效。
+"""
+
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+def available_memory_bytes():
+    """系统可用内存（字节）：优先 psutil，其次 /proc/meminfo 的 MemAvailable，都拿不到返回 None"""
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+class _CachedPayload:
+    """缓存自己持有的一份明文（见模块说明）"""
+
+    def __init__(self, buffer):
+        view = memoryview(buffer).cast("B")
+        self.nbytes = len(view)
+        self._fd = None
+        self._data = None
+        if hasattr(os, "memfd_create") and self.nbytes:
+            self._fd = os.memfd_create("secure_loader_payload", os.MFD_CLOEXEC)
+            try:
+                with open(self._fd, "wb", closefd=False) as f:
+                    f.write(view)
+            except BaseException:
+                self.close()
+                raise
+        else:
+            self._data = bytes(view)
+
+    @property
+    def shares_pages(self):
+        return self._fd is not None
+
+    def view(self):
+        """返回调用方可以随意修改的私有 buffer"""
+        if self._fd is None:
+            return bytearray(self._data)
+        return mmap.mmap(self._fd, self.nbytes, access=mmap.ACCESS_COPY)
+
+    def close(self):
+        # 已经交出去的映射不受影响，物理页在最后一个映射释放后回收
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+class PayloadCache:
+    def __init__(self, budget_bytes, min_available_bytes=0, available_memory=available_memory_bytes):
+        """
+        budget_bytes: 缓存明文的总字节上限，<=0 表示不缓存
+        min_available_bytes: 系统可用内存低于该值时开始淘汰，0 表示不检查
+        """
+        self.budget_bytes = budget_bytes
+        self.min_available_bytes = min_available_bytes
+        self._available_memory = available_memory
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.pressure_evictions = 0
+
+    def _remove(self, model_id):
+        payload = self._entries.pop(model_id)
+        self.bytes -= payload.nbytes
+        payload.close()
+        return payload.nbytes
+
+    def _pop_oldest(self):
+        self.evictions += 1
+        return self._remove(next(iter(self._entries)))
+
+    def _relieve_pressure(self):
+        """
+        可用内存低于阈值时从最久未使用的开始淘汰，保留最近使用的条目；某次淘汰后可用内存
+        回升不到淘汰字节数的一半，说明明文还被别处引用，继续淘汰也没用，停止
+        """
+        if not self.min_available_bytes:
+            return
+        available = self._available_memory()
+        while len(self._entries) > 1 and available is not None and available < self.min_available_bytes:
+            freed = self._pop_oldest()
+            self.pressure_evictions += 1
+            after = self._available_memory()
+            if after is None or after - available < freed // 2:
+                return
+            available = after
+
+    def get(self, model_id):
+        """命中时标记为最近使用，返回一份私有的明文 buffer；未命中返回 None"""
+        with self._lock:
+            payload = self._entries.get(model_id)
+            if payload is None:
+                self.misses += 1
+                self._relieve_pressure()
+                return None
+            self._entries.move_to_end(model_id)
+            self.hits += 1
+            self._relieve_pressure()
+            return payload.view()
+
+    def put(self, model_id, buffer):
+        """
+        缓存一份明文的私有拷贝，返回调用方之后应当使用的 buffer，没有缓存时返回 None：
+        memfd 可用时是缓存拷贝的写时复制映射（与缓存共享物理页，传入的 buffer 可以释放），
+        否则就是传入的 buffer 本身。两种情况下调用方修改它都不影响缓存
+        """
+        nbytes = len(buffer)
+        with self._lock:
+            if model_id in self._entries:
+                self._remove(model_id)
+            if nbytes > self.budget_bytes:
+                return None
+            while self._entries and self.bytes + nbytes > self.budget_bytes:
+                self._pop_oldest()
+            payload = _CachedPayload(buffer)
+            self._entries[model_id] = payload
+            self.bytes += nbytes
+            self._relieve_pressure()
+            return payload.view() if payload.shares_pages else buffer
+
+    def invalidate(self, model_path=None):
+        """删除某个模型文件的所有条目（不论大小/mtime），不传时清空"""
+        with self._lock:
+            prefix = None if model_path is None else os.path.abspath(str(model_path)) + "|"
+            for model_id in [m for m in self._entries if prefix is None or m.startswith(prefix)]:
+                self._remove(model_id)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "budget_bytes": self.budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "pressure_evictions": self.pressure_evictions,
+            }
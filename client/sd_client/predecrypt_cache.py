@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+加密模型预解密缓存
+
+扩展加载时可选启动一个后台线程：扫描模型目录，找出加密模型，提前解密成普通
+safetensors 放进缓存目录。用户选中模型时直接使用缓存里的明文，不再在关键路径上解密。
+
+- 缓存目录有字节预算，超出时按最近使用时间（文件 mtime，命中时刷新）淘汰最旧的
+- 写缓存先写临时文件再 os.replace，进程中途退出也不会留下半个文件
+- 只缓存校验通过的明文（分块清单或 md5），没有任何校验信息的模型不做预解密
+- 缓存文件名由模型标识（路径+大小+mtime）的 sha256 得到，原文件变化后自动失效
+
+注意：缓存里是明文模型，只应放在受信任的本机目录。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from encryption_policy import ranges_from_header
+from integrity import ManifestBuilder, manifest_from_header, verify_manifest_stream
+from xor_cipher import xor_stream
+
+CACHE_SUFFIX = ".safetensors"
+
+class PredecryptCache:
+    def __init__(self, cache_dir, budget_bytes):
+        self.cache_dir = cache_dir
+        self.budget_bytes = budget_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_path(self, model_id):
+        name = hashlib.sha256(model_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, name + CACHE_SUFFIX)
+
+    def lookup(self, model_id):
+        """命中返回缓存文件路径并刷新其最近使用时间，未命中返回 None"""
+        path = self.entry_path(model_id)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(CACHE_SUFFIX):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self, reserve=0):
+        """淘汰最久未使用的条目，直到总大小 + reserve 不超过预算"""
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            while entries and total + reserve > self.budget_bytes:
+                _, size, path = entries.pop(0)
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            return total
+
+    def store(self, model_id, model_path, key_bytes, logger=None):
+        """
+        把加密 safetensors 解密成普通 safetensors 写入缓存，返回缓存路径。
+        缓存的明文之后加载时不再校验，所以写入前必须校验通过：有分块清单时按清单、否则按 md5，
+        两者都没有（无法校验）、超出预算或校验失败时不缓存，返回 None
+        """
+        size = os.path.getsize(model_path)
+        if size > self.budget_bytes:
+            return None
+        with open(model_path, "rb") as f:
+            metadata = f.read(int.from_bytes(f.read(8), "little"))
+        manifest = manifest_from_header(metadata)
+        try:
+            md5_expected = json.loads(metadata).get("model_md5")
+        except ValueError:
+            md5_expected = None
+        if not manifest and not md5_expected:
+            if logger:
+                logger.info(f"🗂️ 模型没有分块清单和md5，无法校验，不做预解密: {model_path}")
+            return None
+        self.evict(reserve=size)
+        final_path = self.entry_path(model_id)
+        tmp_path = f"{final_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        hasher = ManifestBuilder(manifest["chunk_size"]) if manifest else hashlib.md5()
+        try:
+            with open(model_path, "rb") as fin, open(tmp_path, "wb") as fout:
+                header = fin.read(8)
+                fout.write(header)
+                fout.write(fin.read(int.from_bytes(header, "little")))
+                xor_stream(fin, fout, key_bytes, hasher=hasher, ranges=ranges_from_header(metadata))
+            if manifest:
+                bad_chunks = verify_manifest_stream(hasher, manifest)
+                ok, detail = not bad_chunks, f"分块清单坏块 {bad_chunks[:20]}"
+            else:
+                ok, detail = hasher.hexdigest() == md5_expected, "md5不一致"
+            if not ok:
+                if logger:
+                    logger.error(f"❌ 预解密校验失败（{detail}），不写入缓存: {model_path}")
+                os.remove(tmp_path)
+                return None
+            os.replace(tmp_path, final_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return final_path
+
+class PredecryptWorker(threading.Thread):
+    """
+    后台预解密线程
+    is_encrypted(path) / get_key(path) / model_id(path) 由 secure_loader 注入，
+    避免本模块依赖 WebUI 和许可证服务器；传入 index（ModelIndex）时用索引扫描目录
+    """
+
+    def __init__(self, cache, models_dir, extensions, is_encrypted, get_key, model_id, logger=None, index=None):
+        super().__init__(name="SecureModelLoader-predecrypt", daemon=True)
+        self.cache = cache
+        self.models_dir = models_dir
+        self.extensions = tuple(extensions)
+        self.is_encrypted = is_encrypted
+        self.get_key = get_key
+        self.model_id = model_id
+        self.logger = logger
+        self.index = index
+
+    def scan(self):
+        if self.index is not None:
+            # 有模型索引时增量刷新一次，直接拿到加密文件列表，不再逐个打开文件
+            for record in self.index.refresh(self.models_dir, self.extensions):
+                if record["encrypted"] and not os.path.abspath(record["path"]).startswith(
+                        os.path.abspath(self.cache.cache_dir)):
+                    yield record["path"]
+            return
+        cache_dir = os.path.abspath(self.cache.cache_dir)
+        for root, _, files in os.walk(self.models_dir):
+            if os.path.abspath(root).startswith(cache_dir):
+                continue
+            for name in files:
+                if name.lower().endswith(self.extensions):
+                    yield os.path.join(root, name)
+
+    def run(self):
+        start = time.perf_counter()
+        done = 0
+        for path in self.scan():
+            try:
+                if not self.is_encrypted(path):
+                    continue
+                model_id = self.model_id(path)
+                if self.cache.lookup(model_id):
+                    continue
+                if self.cache.store(model_id, path, bytes.fromhex(self.get_key(path)), self.logger):
+                    done += 1
+                    if self.logger:
+                        self.logger.info(f"🗂️ 预解密完成: {path}")
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"❌ 预解密失败 {path}: {str(e)}")
+        if self.logger:
+            self.logger.info(f"🗂️ 预解密扫描结束，新缓存 {done} 个模型，耗时 {time.perf_counter() - start:.1f}s")
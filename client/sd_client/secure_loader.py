@@ -1,35 +1,121 @@
+import time
+_IMPORT_START = time.perf_counter()
 import os
-import torch
+import sys
 import uuid
 import platform
 import subprocess
-import requests
 import base64
+import functools
+import inspect
+import atexit
+import tempfile
 from pathlib import Path
 from modules import script_callbacks
 import struct
+import mmap
+
+# torch / requests / cryptography 只在真正加载加密模型时才导入，扩展注册不为它们买单
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from xor_cipher import HASH_CHUNK_SIZE, xor_bytes, xor_into_parallel, xor_into_hashed, xor_ranges_into
+from encryption_policy import XOR_SCHEME, header_without_encryption, ranges_from_header
+from lazy_safetensors import LazyEncryptedSafetensors, state_dict_from_buffer
+from key_cache import KeyCache, model_identity
+from async_key_client import AsyncKeyClient
+from predecrypt_cache import PredecryptCache, PredecryptWorker
+from shared_model_store import SharedModelStore
+from payload_cache import PayloadCache
+from model_index import CONTAINER_SCHEME, ModelIndex, probe_file
+from checkpoint_info import read_checkpoint_info
+from load_metrics import LoadMetrics, maybe_profile, queued_logger
+from integrity import (ManifestBuilder, ManifestChecker, VerifiedCache, corrupt_tensors,
+                       manifest_from_header, verify_manifest_stream)
 
 # ========== 直接配置参数 ==========
 SERVER_URL = "https://vercel-model-manager.vercel.app/api/verify-key"
 API_KEY = "APIKEY_wk_test_model_1_lv3s2cc4"
-TIMEOUT = 15
+TIMEOUT = 15  # 读取超时（秒）
+CONNECT_TIMEOUT = 5  # 连接超时（秒）
+MAX_RETRIES = 3  # 网络错误/5xx时的重试次数
 LOG_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), "secure_loader.log"))
 MODEL_EXTENSIONS = [".safetensors", ".ckpt", ".pt"]
 
 ENCRYPT_FLAG = b'WK_ENCRYPTED_v1'  # 16字节flag
+# 解密buffer上限（字节），0表示整块解密到一个buffer；超过上限时按该大小分窗口解密并边解边校验
+# （加载前钩子要返回完整 state dict，不分窗口）
+DECRYPT_BUFFER_LIMIT = 0
+# 并行解密线程数，None表示使用全部CPU核，1表示串行
+DECRYPT_WORKERS = None
+# 解密密钥缓存有效期（秒），0表示不缓存，每次加载都请求服务器
+KEY_CACHE_TTL = 3600
+# 磁盘密钥缓存文件（用设备绑定密钥加密），None表示只在进程内缓存
+KEY_CACHE_FILE = None
+# 后台预解密：扩展加载时扫描模型目录，把加密模型提前解密到缓存目录（缓存为明文，仅用于受信任的本机）
+PREDECRYPT_ENABLED = False
+PREDECRYPT_MODELS_DIR = None  # None表示使用WebUI的models目录
+PREDECRYPT_CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "predecrypt_cache"))
+PREDECRYPT_CACHE_BYTES = 20 * 1024**3  # 缓存目录字节预算，超出按LRU淘汰
+# 模型库索引（SQLite，按path+size+mtime缓存加密flag和header解析结果），None表示每次都读文件
+MODEL_INDEX_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), "model_index.sqlite"))
+# 已校验通过的文件记录（path+size+mtime+key id）持久化文件，None表示只在进程内记录
+VERIFIED_CACHE_FILE = None
+# 多个WebUI/API进程共享同一份解密后的模型（共享内存 + 引用计数），仅支持POSIX系统
+SHARED_STORE_ENABLED = False
+SHARED_STORE_DIR = os.path.join(tempfile.gettempdir(), "secure_loader_shm")
+# 进程内缓存最近解密过的模型明文，来回切换模型时直接复用；0表示不缓存
+PAYLOAD_CACHE_BYTES = 0
+PAYLOAD_CACHE_MIN_AVAILABLE = 2 * 1024**3  # 系统可用内存低于该值时按LRU淘汰缓存，0表示不检查
+# 在WebUI读取state dict之前接管加密模型，直接返回解密后的state dict（文件只读、只反序列化一次）
+PRELOAD_HOOK_ENABLED = True
+# 同时在途的密钥请求上限（相同模型的并发请求会合并为一个）
+KEY_FETCH_CONCURRENCY = 4
+# 分阶段指标：JSON日志文件（默认不写，需要时设为路径，如 secure_loader_metrics.jsonl）、
+# Prometheus textfile路径（None表示不写）
+METRICS_LOG_FILE = None
+METRICS_LOG_MAX_BYTES = 10 * 1024**2  # 指标日志超过该大小时轮转，保留 METRICS_LOG_BACKUPS 个旧文件
+METRICS_LOG_BACKUPS = 3
+METRICS_PROMETHEUS_FILE = None
+# 设置环境变量 SECURE_LOADER_PROFILE=cprofile|tracemalloc 时，下一次加载的剖析结果写到这里
+PROFILE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "profiles"))
+# 扩展注册耗时预算（毫秒），超出时在日志中告警
+IMPORT_BUDGET_MS = 200
 
 def get_logger():
     import logging
     logger = logging.getLogger("SecureModelLoader")
-    logger.setLevel(logging.INFO)
-    # 防止重复添加handler
+    # 防止重复添加handler；文件写入在后台线程里完成（QueueHandler + QueueListener）
     if not logger.handlers:
         file_handler = logging.FileHandler(LOG_FILE, encoding="utf-8")
         file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-        logger.addHandler(file_handler)
+        queued_logger("SecureModelLoader", file_handler)
+    logger.setLevel(logging.INFO)
     return logger
 
-def get_device_fingerprint():
+def get_metrics_logger():
+    """分阶段指标日志：每行一条JSON记录，和普通日志分开写并按大小轮转，METRICS_LOG_FILE为None时不写"""
+    import logging
+    import logging.handlers
+    logger = logging.getLogger("SecureModelLoader.metrics")
+    logger.propagate = False
+    if not METRICS_LOG_FILE:
+        return None
+    if not logger.handlers:
+        file_handler = logging.handlers.RotatingFileHandler(
+            METRICS_LOG_FILE, maxBytes=METRICS_LOG_MAX_BYTES, backupCount=METRICS_LOG_BACKUPS, encoding="utf-8")
+        file_handler.setFormatter(logging.Formatter('%(message)s'))
+        queued_logger("SecureModelLoader.metrics", file_handler)
+    return logger
+
+@functools.lru_cache(maxsize=None)
+def get_device_profile():
+    """
+    设备信息每个进程只计算一次：查询CUDA属性、扫描/proc/cpuinfo、取MAC都比较慢，
+    且在进程生命周期内不会变化
+    返回 {"device_id", "mac", "gpu"}
+    """
+    import torch
+    mac = ":".join([f"{(uuid.getnode() >> i) & 0xff:02x}" for i in range(0, 8*6, 8)][::-1])
+    gpu = "unknown"
     try:
         gpu_info = ""
         if torch.cuda.is_available():
@@ -37,6 +123,7 @@ def get_device_fingerprint():
             gpu_props = torch.cuda.get_device_properties(0)
             gpu_memory_gb = gpu_props.total_memory // (1024**3)
             gpu_info = f"{gpu_name} ({gpu_memory_gb}GB)"
+            gpu = gpu_name
         else:
             if os.path.exists("/proc/cpuinfo"):
                 with open("/proc/cpuinfo", "r") as f:
@@ -44,11 +131,13 @@ def get_device_fingerprint():
                         if "model name" in line.lower():
                             gpu_info = line.split(":")[1].strip()
                             break
-        mac = ":".join([f"{(uuid.getnode() >> i) & 0xff:02x}" for i in range(0, 8*6, 8)][::-1])
         device_id = uuid.uuid5(uuid.NAMESPACE_DNS, f"{gpu_info}-{mac}").hex
-        return device_id
     except Exception as e:
-        return "unknown_device"
+        device_id = "unknown_device"
+    return {"device_id": device_id, "mac": mac, "gpu": gpu}
+
+def get_device_fingerprint():
+    return get_device_profile()["device_id"]
 
 def decode_xor_result(xor_result: str, timestamp: int, logger=None) -> str:
     try:
@@ -70,8 +159,29 @@ def decode_xor_result(xor_result: str, timestamp: int, logger=None) -> str:
             logger.error(f"❌ 解码异或结果失败: {str(e)}")
         raise ValueError(f"解码失败: {str(e)}")
 
+_model_index = None
+
+def get_model_index():
+    """首次使用时打开模型库索引，未配置或打开失败时返回None（退回直接读文件）"""
+    global _model_index
+    if _model_index is None and MODEL_INDEX_FILE:
+        try:
+            _model_index = ModelIndex(MODEL_INDEX_FILE, ENCRYPT_FLAG)
+        except Exception as e:
+            get_logger().warning(f"⚠️ 打开模型索引失败，改为直接读取文件: {str(e)}")
+            _model_index = False
+    return _model_index or None
+
 def read_safetensors_metadata(filepath: str, logger=None):
     try:
+        index = get_model_index()
+        if index is not None:
+            record = index.get(filepath)
+            if record["header_len"] is None:
+                if logger:
+                    logger.warning(f"⚠️ {filepath} 不是有效的safetensors文件")
+                return {}
+            return record["metadata"]
         import json
         with open(filepath, mode="rb") as file:
             metadata_len = file.read(8)
@@ -97,55 +207,84 @@ def read_safetensors_metadata(filepath: str, logger=None):
             logger.error(f"❌ 读取safetensors metadata失败: {str(e)}")
         return {}
 
-def is_my_model(filepath: str, logger=None) -> bool:
+def encryption_scheme(filepath: str, logger=None):
+    """
+    返回文件的加密方式: "xor"（__metadata__ 带加密标记的 safetensors，客户端直接解密加载）、
+    "container"（开头带 ENCRYPT_FLAG 的 hybrid 容器），非加密文件返回 None
+    """
     try:
-        with open(filepath, "rb") as f:
-            file_flag = f.read(16)
-        if file_flag == ENCRYPT_FLAG:
-            if logger:
-                logger.info(f"检测到加密flag: {file_flag}")
-            return True
+        index = get_model_index()
+        if index is not None:
+            scheme = index.get(filepath)["scheme"]
+            source = "索引"
         else:
-            if logger:
-                logger.info(f"未检测到加密flag: {file_flag}")
-            return False
+            scheme = probe_file(filepath, ENCRYPT_FLAG)["scheme"]
+            source = "文件头"
+        if logger:
+            logger.info(f"检测到加密标记（{source}）: {scheme}" if scheme else f"未检测到加密标记（{source}）")
+        return scheme
     except Exception as e:
         if logger:
             logger.error(f"检测加密flag失败: {str(e)}")
-        return False
+        return None
+
+def is_my_model(filepath: str, logger=None) -> bool:
+    return encryption_scheme(filepath, logger) is not None
 
-def request_decryption_key(model_path: str, logger=None) -> str:
+KEY_CACHE = KeyCache(ttl=KEY_CACHE_TTL, disk_path=KEY_CACHE_FILE, device_secret=lambda: get_device_fingerprint())
+PAYLOAD_CACHE = PayloadCache(PAYLOAD_CACHE_BYTES, PAYLOAD_CACHE_MIN_AVAILABLE)
+
+def invalidate_key_cache(model_path=None):
+    """让某个模型（或全部）的缓存密钥失效，例如密钥在后台被更换后；同时丢弃用旧密钥解出的内存明文"""
+    KEY_CACHE.invalidate(API_KEY if model_path is not None else None,
+                         model_identity(model_path) if model_path is not None else None)
+    PAYLOAD_CACHE.invalidate(model_path)
+
+def payload_cache_stats():
+    """进程内明文缓存的命中率、字节数等统计"""
+    return PAYLOAD_CACHE.stats()
+
+def request_decryption_key(model_path: str, logger=None, force_refresh=False) -> str:
+    import requests
     try:
-        if logger:
-            logger.info(f"🌐 开始向服务器请求解密密钥...")
         if not API_KEY:
             raise ValueError("API密钥未设置，请在config.py中配置API_KEY")
-        device_id = get_device_fingerprint()
-        mac = ":".join([f"{(uuid.getnode() >> i) & 0xff:02x}" for i in range(0, 8*6, 8)][::-1])
-        gpu = "unknown"
-        if torch.cuda.is_available():
-            gpu = torch.cuda.get_device_name(0)
+        cache_id = model_identity(model_path)
+        if not force_refresh:
+            cached_key = KEY_CACHE.get(API_KEY, cache_id)
+            stats = KEY_CACHE.stats()
+            if cached_key is not None:
+                if logger:
+                    logger.info(f"🔑 命中密钥缓存（命中 {stats['hits']} / 未命中 {stats['misses']}）")
+                return cached_key
+            if logger:
+                logger.info(f"🔑 密钥缓存未命中（命中 {stats['hits']} / 未命中 {stats['misses']}）")
+        if logger:
+            logger.info(f"🌐 开始向服务器请求解密密钥...")
+        profile = get_device_profile()
+        device_id, mac, gpu = profile["device_id"], profile["mac"], profile["gpu"]
         if logger:
             logger.info(f"📱 设备ID: {device_id[:16]}...")
             logger.info(f"🔗 MAC地址: {mac}")
             logger.info(f"🎮 GPU信息: {gpu}")
             logger.info(f"📤 发送请求到服务器: {SERVER_URL}")
-        response = requests.post(
+        from license_client import get_license_client
+        client = get_license_client(connect_timeout=CONNECT_TIMEOUT, read_timeout=TIMEOUT, max_retries=MAX_RETRIES)
+        response = client.post_json(
             SERVER_URL,
-            json={
+            {
                 "key": API_KEY,
                 "mac": mac,
                 "cpu": gpu
             },
-            timeout=TIMEOUT
+            logger=logger
         )
         response.raise_for_status()
-        print("服务器原始响应内容：", response.text)
-        if logger:
-            logger.info(f"服务器原始响应内容：{response.text}")
         data = response.json()
         if logger:
-            logger.info(f"📥 服务器响应: {data}")
+            # 原始响应里有密钥材料，只在DEBUG级别记录
+            logger.debug(f"📥 服务器响应: {data}")
+            logger.info(f"📥 服务器响应: success={data.get('success')}，{len(response.content)} 字节")
         if not data.get("success"):
             error_msg = data.get("error", "Unknown server error")
             if logger:
@@ -159,6 +298,7 @@ def request_decryption_key(model_path: str, logger=None) -> str:
             logger.info(f"🔐 获取到异或结果: {xor_result[:16]}...")
             logger.info(f"⏰ 时间戳: {timestamp}")
         decryption_key = decode_xor_result(xor_result, timestamp, logger)
+        KEY_CACHE.put(API_KEY, cache_id, decryption_key)
         if logger:
             logger.info("✅ 成功获取解密密钥")
         return decryption_key
@@ -171,38 +311,184 @@ def request_decryption_key(model_path: str, logger=None) -> str:
             logger.error(f"❌ 请求解密密钥失败: {str(e)}")
         raise
 
+_key_client = None
+
+def get_key_client():
+    """全局异步密钥客户端，首次使用时创建"""
+    global _key_client
+    if _key_client is None:
+        _key_client = AsyncKeyClient(lambda model_path: request_decryption_key(model_path, get_logger()),
+                                     key_func=model_identity, max_concurrency=KEY_FETCH_CONCURRENCY)
+    return _key_client
+
+def prefetch_decryption_key(model_path):
+    """
+    后台发起密钥请求并立即返回 Future（同一模型的在途请求会合并），
+    调用方可以先做文件IO，需要密钥时再 .result()
+    """
+    return get_key_client().fetch_key(model_path)
+
 def decrypt_model(encrypted_data, key: str, logger=None):
     # 真实解密逻辑（xor为例）
     decrypted = xor_decrypt(encrypted_data, bytes.fromhex(key))
     return decrypted
 
-def xor_decrypt(data, key):
-    """XOR解密，与加密同理"""
-    return bytes([b ^ key[i % len(key)] for i, b in enumerate(data)])
+def xor_decrypt(data, key, workers=None):
+    """XOR解密，与加密同理；workers>1时按相位对齐分块多线程解密"""
+    return xor_bytes(data, key, workers=workers if workers is not None else DECRYPT_WORKERS)
+
+def read_payload_header(f):
+    """读取safetensors的8字节长度和header，返回 (metadata bytes, tensor数据起始偏移, tensor数据长度)"""
+    header = f.read(8)
+    meta_len = int.from_bytes(header, "little")
+    metadata = f.read(meta_len)
+    data_start = 8 + meta_len
+    data_len = max(0, os.fstat(f.fileno()).st_size - data_start)
+    return metadata, data_start, data_len
+
+def _decrypt_workers():
+    return DECRYPT_WORKERS or os.cpu_count() or 1
+
+def _decrypt_range(src, dst, key_bytes, offset=0, hasher=None, chunk_check=None, chunk_size=HASH_CHUNK_SIZE):
+    """需要校验时走解密+hash融合的单遍流程，否则多线程解密"""
+    if hasher is None and chunk_check is None:
+        xor_into_parallel(src, dst, key_bytes, offset, workers=DECRYPT_WORKERS)
+    else:
+        xor_into_hashed(src, dst, key_bytes, offset, hasher=hasher, chunk_check=chunk_check, chunk_size=chunk_size,
+                        workers=_decrypt_workers())
+
+def _hash_plain(view, hasher=None, chunk_check=None, chunk_size=HASH_CHUNK_SIZE):
+    """部分加密时明文是解密后再整体校验的，按与融合路径相同的块切分喂给 hasher / chunk_check"""
+    if hasher is None and chunk_check is None:
+        return
+    starts = range(0, len(view), chunk_size)
+    if hasher is None:
+        # 只有逐块校验时各块互不依赖，多线程并行
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=_decrypt_workers()) as pool:
+            list(pool.map(lambda index: chunk_check(index, view[starts[index]:starts[index] + chunk_size]),
+                          range(len(starts))))
+        return
+    for index, pos in enumerate(starts):
+        chunk = view[pos:pos + chunk_size]
+        hasher.update(chunk)
+        if chunk_check is not None and not chunk_check(index, chunk):
+            return
+
+def decrypt_payload_mmap(model_path, key_bytes, buffer=None, hasher=None, chunk_check=None,
+                         chunk_size=HASH_CHUNK_SIZE):
+    """
+    mmap映射加密文件，把tensor数据直接解密到一块预分配的可写buffer，
+    不再先读一份密文再生成一份明文，额外内存只有一个模型大小
+    传入hasher / chunk_check 时边解密边校验（chunk_check 按 chunk_size 切块），不再单独遍历一遍明文
+    部分加密的文件（header 里有 encrypted_ranges）只解密记录的范围；不指定 buffer 时
+    用写时复制映射原地解密，范围外的字节直接是文件页，不拷贝
+    返回 (metadata bytes, 明文memoryview)
+    """
+    with open(model_path, "rb") as f:
+        metadata, data_start, data_len = read_payload_header(f)
+        ranges = ranges_from_header(metadata)
+        if ranges is not None and buffer is None:
+            if not data_len:
+                return metadata, memoryview(b"")
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            out = memoryview(mm)[data_start:data_start + data_len]
+            xor_ranges_into(out, out, key_bytes, ranges, workers=DECRYPT_WORKERS)
+            _hash_plain(out, hasher, chunk_check, chunk_size)
+            return metadata, out
+        if buffer is None:
+            buffer = bytearray(data_len)
+        out = memoryview(buffer)[:data_len]
+        if data_len:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                src = memoryview(mm)
+                try:
+                    if ranges is None:
+                        _decrypt_range(src[data_start:data_start + data_len], out, key_bytes,
+                                       hasher=hasher, chunk_check=chunk_check, chunk_size=chunk_size)
+                    else:
+                        xor_ranges_into(src[data_start:data_start + data_len], out, key_bytes, ranges,
+                                        workers=DECRYPT_WORKERS)
+                        _hash_plain(out, hasher, chunk_check, chunk_size)
+                finally:
+                    src.release()
+    return metadata, out
+
+def iter_decrypted_payload(model_path, key_bytes, window_size, hasher=None):
+    """
+    按 window_size 分窗口解密tensor数据，复用同一块buffer，峰值额外内存为一个窗口
+    依次yield每个窗口的明文memoryview（下一次迭代会被覆盖），传入hasher时边解密边hash
+    """
+    buf = bytearray(window_size)
+    view = memoryview(buf)
+    with open(model_path, "rb") as f:
+        metadata, data_start, data_len = read_payload_header(f)
+        ranges = ranges_from_header(metadata)
+        if not data_len:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            src = memoryview(mm)
+            try:
+                for pos in range(0, data_len, window_size):
+                    n = min(window_size, data_len - pos)
+                    if ranges is None:
+                        _decrypt_range(src[data_start + pos:data_start + pos + n], view[:n], key_bytes, pos,
+                                       hasher=hasher)
+                    else:
+                        xor_ranges_into(src[data_start + pos:data_start + pos + n], view[:n], key_bytes, ranges,
+                                        pos, workers=DECRYPT_WORKERS)
+                        _hash_plain(view[:n], hasher)
+                    yield view[:n]
+            finally:
+                src.release()
+
+def map_plain_payload(model_path):
+    """
+    写时复制mmap一个明文safetensors，返回 (metadata bytes, tensor数据memoryview)，不拷贝；
+    tensor 被原地修改时只复制改到的页，不会写回缓存文件
+    """
+    with open(model_path, "rb") as f:
+        metadata, data_start, data_len = read_payload_header(f)
+        if not data_len:
+            return metadata, memoryview(bytearray())
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    return metadata, memoryview(mm)[data_start:data_start + data_len]
+
+def open_encrypted_safetensors(model_path, logger=None):
+    """
+    请求解密密钥并返回按需解密的读取器，只加载UNet/文本编码器或查看大模型时
+    不必解密整个文件：
+        with open_encrypted_safetensors(path) as f:
+            te = {k: f.get_tensor(k) for k in f.keys() if k.startswith("cond_stage_model.")}
+    """
+    decryption_key = request_decryption_key(model_path, logger)
+    return LazyEncryptedSafetensors(model_path, bytes.fromhex(decryption_key), workers=DECRYPT_WORKERS)
 
 def print_model_metadata(model_path, logger=None):
+    """
+    打印模型metadata和tensor概况：safetensors只读header，ckpt/pt只读torch zip里的data.pkl，
+    都不读取权重数据（见 checkpoint_info.py）
+    """
     try:
         path = str(model_path)
-        if path.endswith('.safetensors'):
-            metadata = read_safetensors_metadata(path, logger)
-            print(f"【SecureModelLoader】safetensors模型metadata: {metadata}")
-            if logger:
-                logger.info(f"safetensors模型metadata: {metadata}")
-        else:
-            model_data = torch.load(path, map_location="cpu")
-            if isinstance(model_data, dict):
-                metadata = model_data.get('metadata', {})
-                print(f"【SecureModelLoader】torch模型metadata: {metadata}")
-                if logger:
-                    logger.info(f"torch模型metadata: {metadata}")
-            else:
-                print(f"【SecureModelLoader】模型数据格式异常: {type(model_data)}")
-                if logger:
-                    logger.warning(f"模型数据格式异常: {type(model_data)}")
+        start = time.perf_counter()
+        info = read_checkpoint_info(path)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        kind = "safetensors" if info["format"] == "safetensors" else "torch"
+        dtypes = sorted({t["dtype"] for t in info["tensors"].values() if t["dtype"]})
+        print(f"【SecureModelLoader】{kind}模型metadata: {info['metadata']}")
+        print(f"【SecureModelLoader】{len(info['tensors'])} 个tensor，dtype {dtypes}，"
+              f"格式 {info['format']}，读取耗时 {elapsed_ms:.1f}ms")
+        if logger:
+            logger.info(f"{kind}模型metadata: {info['metadata']}")
+            logger.info(f"{len(info['tensors'])} 个tensor，dtype {dtypes}，格式 {info['format']}，"
+                        f"读取耗时 {elapsed_ms:.1f}ms")
+        return info
     except Exception as e:
         print(f"【SecureModelLoader】读取模型metadata失败: {str(e)}")
         if logger:
             logger.error(f"读取模型metadata失败: {str(e)}")
+        return None
 
 def decrypt_safetensors_file(enc_path, out_path, key, logger=None):
     """
@@ -212,71 +498,382 @@ def decrypt_safetensors_file(enc_path, out_path, key, logger=None):
     3. xor解密
     4. 还原为原始safetensors文件
     """
-    with open(enc_path, "rb") as f:
-        header = f.read(8)
-        meta_len = int.from_bytes(header, "little")
-        metadata = f.read(meta_len)
-        encrypted_tensor = f.read()
-    decrypted_tensor = xor_decrypt(encrypted_tensor, bytes.fromhex(key))
-    # 写回原始safetensors文件
-    with open(out_path, "wb") as f:
-        f.write(header)
-        f.write(metadata)
-        f.write(decrypted_tensor)
+    metrics = LoadMetrics(enc_path, kind="decrypt_file")
+    with metrics.phase("payload_read") as phase:
+        with open(enc_path, "rb") as f:
+            header = f.read(8)
+            meta_len = int.from_bytes(header, "little")
+            metadata = f.read(meta_len)
+            encrypted_tensor = f.read()
+        phase["bytes"] = 8 + meta_len + len(encrypted_tensor)
+    with metrics.phase("decrypt", nbytes=len(encrypted_tensor)):
+        ranges = ranges_from_header(metadata)
+        if ranges is None:
+            decrypted_tensor = xor_decrypt(encrypted_tensor, bytes.fromhex(key))
+        else:
+            decrypted_tensor = bytearray(len(encrypted_tensor))
+            xor_ranges_into(encrypted_tensor, decrypted_tensor, bytes.fromhex(key), ranges, workers=DECRYPT_WORKERS)
+    # 写回原始safetensors文件，去掉加密标记和范围记录，否则还原出的明文会被当成加密模型
+    metadata = header_without_encryption(metadata)
+    with metrics.phase("write", nbytes=8 + len(metadata) + len(decrypted_tensor)):
+        with open(out_path, "wb") as f:
+            f.write(len(metadata).to_bytes(8, "little"))
+            f.write(metadata)
+            f.write(decrypted_tensor)
+    metrics.finish("ok", get_metrics_logger(), METRICS_PROMETHEUS_FILE)
     if logger:
         logger.info(f"解密完成，输出文件: {out_path}")
     print(f"解密完成，输出文件: {out_path}")
 
+def _decrypt_and_verify(model_path, key_bytes, metadata, data_len, manifest, md5_expected, metrics, logger,
+                        windowed=False, buffer=None):
+    """解密tensor数据并做完整性校验，返回 (状态 ok / corrupt, 明文memoryview；分窗口或清单校验中途失败时为None)"""
+    import hashlib
+    md5 = hashlib.md5() if md5_expected and not manifest else None
+    builder = checker = None
+    bad_chunks = []
+    status = "ok"
+    if windowed and manifest:
+        builder = ManifestBuilder(manifest["chunk_size"])
+    elif manifest:
+        checker = ManifestChecker(manifest)
+        if not checker.matches_length(data_len):
+            # 块数都对不上，逐块比对没有意义，解密后整体按损坏处理
+            bad_chunks = list(range(len(manifest["chunks"])))
+            checker = None
+    # md5 / 清单在解密的同一遍里计算，计入 decrypt 阶段（fused_hash=True）
+    with metrics.phase("decrypt", nbytes=data_len, fused_hash=bool(md5 or builder or checker)):
+        if windowed:
+            # 超过buffer上限：分窗口解密，边解边校验，不保留完整明文
+            decrypted_tensor = None
+            for _ in iter_decrypted_payload(model_path, key_bytes, DECRYPT_BUFFER_LIMIT, hasher=builder or md5):
+                pass
+        else:
+            # mmap直接解密到一块buffer（边解密边算md5 / 逐块校验），后续步骤通过memoryview零拷贝使用
+            _, decrypted_tensor = decrypt_payload_mmap(
+                model_path, key_bytes, buffer=buffer, hasher=md5, chunk_check=checker,
+                chunk_size=manifest["chunk_size"] if checker is not None else HASH_CHUNK_SIZE)
+            if checker is not None and checker.bad_chunks:
+                # 遇到坏块就停止了解密，明文不完整，不返回
+                bad_chunks, decrypted_tensor = sorted(checker.bad_chunks), None
+    if manifest:
+        if builder is not None:
+            with metrics.phase("hash", nbytes=0):
+                bad_chunks = verify_manifest_stream(builder, manifest)
+        if not bad_chunks:
+            VERIFIED_CACHE.add(model_path, key_bytes)
+            logger.info(f"✅ 分块完整性校验通过: {len(manifest['chunks'])} 块")
+            print(f"✅ 分块完整性校验通过: {len(manifest['chunks'])} 块")
+        else:
+            status = "corrupt"
+            tensors = corrupt_tensors(metadata, bad_chunks, manifest["chunk_size"])
+            logger.error(f"❌ 分块完整性校验失败: 坏块 {bad_chunks[:20]}，涉及tensor {tensors[:20]}")
+            print(f"❌ 分块完整性校验失败: 坏块 {bad_chunks[:20]}，涉及tensor {tensors[:20]}")
+    # 校验md5（如果metadata里有model_md5字段）
+    if md5 is not None:
+        md5_actual = md5.hexdigest()
+        if md5_actual == md5_expected:
+            VERIFIED_CACHE.add(model_path, key_bytes)
+            logger.info(f"✅ 解密后模型md5校验通过: {md5_actual}")
+            print(f"✅ 解密后模型md5校验通过: {md5_actual}")
+        else:
+            status = "corrupt"
+            logger.error(f"❌ 解密后模型md5校验失败: {md5_actual} ≠ {md5_expected}")
+            print(f"❌ 解密后模型md5校验失败: {md5_actual} ≠ {md5_expected}")
+    return status, decrypted_tensor
+
+# ========== 跨进程共享的解密模型 ==========
+SHARED_STORE = None
+_shared_handles = {}
+
+def _load_shared(model_path, key_bytes, metadata, data_len, manifest, md5_expected, metrics, logger):
+    """
+    从共享内存取解密后的模型：已有其他进程发布的就只读映射，否则在共享内存里解密、
+    校验通过后发布。本进程只保留当前模型的引用：切换到别的模型或文件变化时释放旧引用，
+    校验失败的段立即释放，不留给后续加载
+    """
+    global SHARED_STORE
+    if SHARED_STORE is None:
+        SHARED_STORE = SharedModelStore(SHARED_STORE_DIR)
+    model_id = model_identity(model_path)
+    held = _shared_handles.get(model_path)
+    if held is not None and held[0] == model_id:
+        logger.info("🔗 本进程已持有该模型的共享内存引用")
+        return "shared", held[1].buffer
+    # WebUI 同时只使用一个 checkpoint，换模型后旧模型的引用不再需要
+    release_shared_models()
+    result = {"status": "shared"}
+
+    def build(buffer):
+        result["status"], _ = _decrypt_and_verify(model_path, key_bytes, metadata, data_len, manifest,
+                                                  md5_expected, metrics, logger, buffer=buffer)
+        return result["status"] == "ok"
+
+    with metrics.phase("shared_acquire", nbytes=data_len) as phase:
+        handle = SHARED_STORE.acquire(model_id, key_bytes, data_len, build)
+        phase["created"] = handle.created
+    if result["status"] == "corrupt":
+        handle.release()
+        return "corrupt", None
+    _shared_handles[model_path] = (model_id, handle)
+    if not handle.created:
+        logger.info(f"🔗 已映射其他进程解密好的共享模型，跳过解密: {handle.name}")
+        print(f"🔗 已映射其他进程解密好的共享模型，跳过解密: {handle.name}")
+    return result["status"], handle.buffer
+
+def release_shared_models(model_path=None):
+    """释放本进程持有的共享模型引用（指定 model_path 时只释放这一个），最后一个使用者释放时删除共享内存"""
+    paths = [model_path] if model_path is not None else list(_shared_handles)
+    for path in paths:
+        held = _shared_handles.pop(path, None)
+        if held is not None:
+            held[1].release()
+
+atexit.register(release_shared_models)
+
 # ========== 模型加载回调 ==========
 def on_model_loaded(sd_model):
     logger = get_logger()
     print("【SecureModelLoader】模型加载回调被调用")
     logger.info("【SecureModelLoader】模型加载回调被调用")
+    model_path = getattr(sd_model, 'sd_checkpoint_info', None)
+    if model_path is not None and hasattr(model_path, 'filename'):
+        model_path = model_path.filename
+    else:
+        logger.warning("⚠️ 无法获取模型文件路径，跳过自定义校验/解密逻辑")
+        print("⚠️ 无法获取模型文件路径，跳过自定义校验/解密逻辑")
+        return
+    if _preloaded.pop(model_identity(model_path), None) is not None:
+        logger.info(f"✅ 加密模型已在读取state dict时解密，跳过重复处理: {model_path}")
+        print(f"✅ 加密模型已在读取state dict时解密，跳过重复处理: {model_path}")
+        return
+    metrics = LoadMetrics(model_path)
+    status = "error"
     try:
-        model_path = getattr(sd_model, 'sd_checkpoint_info', None)
-        if model_path is not None and hasattr(model_path, 'filename'):
-            model_path = model_path.filename
-        else:
-            logger.warning("⚠️ 无法获取模型文件路径，跳过自定义校验/解密逻辑")
-            print("⚠️ 无法获取模型文件路径，跳过自定义校验/解密逻辑")
-            return
-        logger.info(f"🔔 检测到模型加载: {model_path}")
-        print(f"🔔 检测到模型加载: {model_path}")
-        # 判断是否加密（flag）
-        if not is_my_model(model_path, logger):
-            logger.info(f"🟢 非加密模型，跳过自定义处理: {model_path}")
-            print(f"🟢 非加密模型，跳过自定义处理: {model_path}")
-            return
-        logger.info(f"🔒 检测到加密模型，开始自定义处理: {model_path}")
-        print(f"🔒 检测到加密模型，开始自定义处理: {model_path}")
-        # ========== 新xor safetensors解密流程 ==========
-        with open(model_path, "rb") as f:
-            header = f.read(8)
-            meta_len = int.from_bytes(header, "little")
-            metadata = f.read(meta_len)
-            encrypted_tensor = f.read()
-        decryption_key = request_decryption_key(model_path, logger)
-        decrypted_tensor = xor_decrypt(encrypted_tensor, bytes.fromhex(decryption_key))
-        # 校验md5（如果metadata里有model_md5字段）
-        import json, hashlib
-        try:
-            meta_obj = json.loads(metadata)
-            md5_expected = meta_obj.get("model_md5", None)
-            if md5_expected:
-                md5_actual = hashlib.md5(decrypted_tensor).hexdigest()
-                if md5_actual == md5_expected:
-                    logger.info(f"✅ 解密后模型md5校验通过: {md5_actual}")
-                    print(f"✅ 解密后模型md5校验通过: {md5_actual}")
-                else:
-                    logger.error(f"❌ 解密后模型md5校验失败: {md5_actual} ≠ {md5_expected}")
-                    print(f"❌ 解密后模型md5校验失败: {md5_actual} ≠ {md5_expected}")
-        except Exception as e:
-            logger.warning(f"⚠️ metadata校验异常: {str(e)}")
-        logger.info(f"✅ 加密模型处理流程结束: {model_path}")
-        print(f"✅ 加密模型处理流程结束: {model_path}")
+        with maybe_profile(PROFILE_DIR, logger):
+            status, _ = _secure_load(model_path, logger, metrics)
     except Exception as e:
         logger.error(f"❌ 模型加载回调处理失败: {str(e)}")
         print(f"❌ 模型加载回调处理失败: {str(e)}")
+    finally:
+        metrics.finish(status, get_metrics_logger(), METRICS_PROMETHEUS_FILE)
+
+def _secure_load(model_path, logger, metrics, windowed_ok=True):
+    """
+    加密模型处理流程，各阶段记录到 metrics，返回 (状态, 明文memoryview)
+    windowed_ok=False 时不论 DECRYPT_BUFFER_LIMIT 都整块解密（调用方要用到完整明文）
+    状态为 plain / container / memory / cached / shared / ok / corrupt；非加密、hybrid容器或分窗口解密时明文为 None
+    """
+    logger.info(f"🔔 检测到模型加载: {model_path}")
+    print(f"🔔 检测到模型加载: {model_path}")
+    # 判断是否加密（flag / __metadata__ 标记）
+    with metrics.phase("flag_check"):
+        scheme = encryption_scheme(model_path, logger)
+    if scheme is None:
+        logger.info(f"🟢 非加密模型，跳过自定义处理: {model_path}")
+        print(f"🟢 非加密模型，跳过自定义处理: {model_path}")
+        return "plain", None
+    if scheme == CONTAINER_SCHEME:
+        # hybrid容器需要RSA私钥，只能用 tools/model_decryptor.py 离线解密，客户端不直接加载
+        logger.error(f"❌ hybrid加密容器不能直接加载，请先用 model_decryptor.py 解密: {model_path}")
+        print(f"❌ hybrid加密容器不能直接加载，请先用 model_decryptor.py 解密: {model_path}")
+        return "container", None
+    logger.info(f"🔒 检测到加密模型，开始自定义处理: {model_path}")
+    print(f"🔒 检测到加密模型，开始自定义处理: {model_path}")
+    load_start = time.perf_counter()
+    model_id = model_identity(model_path)
+    # ========== 进程内明文缓存命中：最近解密过且文件未变化，不取密钥也不再解密 ==========
+    if PAYLOAD_CACHE.budget_bytes > 0:
+        with metrics.phase("memory_cache") as phase:
+            decrypted_tensor = PAYLOAD_CACHE.get(model_id)
+            phase["hit"] = decrypted_tensor is not None
+            if decrypted_tensor is not None:
+                phase["bytes"] = len(decrypted_tensor)
+        if decrypted_tensor is not None:
+            stats = PAYLOAD_CACHE.stats()
+            logger.info(f"⚡ 命中内存明文缓存，跳过解密: 命中率 {stats['hit_rate']:.0%}，"
+                        f"缓存 {stats['entries']} 个模型 {stats['bytes'] / 1024**2:.0f}MB")
+            print(f"⚡ 命中内存明文缓存，跳过解密: {model_path}")
+            _record_first_encrypted_load(time.perf_counter() - load_start)
+            logger.info(f"✅ 加密模型处理流程结束: {model_path}")
+            print(f"✅ 加密模型处理流程结束: {model_path}")
+            return "memory", decrypted_tensor
+    # ========== 预解密缓存命中：直接使用缓存里已校验过的明文 ==========
+    cached_path = PREDECRYPT_CACHE.lookup(model_id) if PREDECRYPT_CACHE else None
+    if cached_path:
+        with metrics.phase("cache_map") as phase:
+            _, decrypted_tensor = map_plain_payload(cached_path)
+            phase["bytes"] = len(decrypted_tensor)
+        logger.info(f"🗂️ 命中预解密缓存，跳过解密: {cached_path}")
+        print(f"🗂️ 命中预解密缓存，跳过解密: {cached_path}")
+        _record_first_encrypted_load(time.perf_counter() - load_start)
+        logger.info(f"✅ 加密模型处理流程结束: {model_path}")
+        print(f"✅ 加密模型处理流程结束: {model_path}")
+        return "cached", decrypted_tensor
+    # ========== 新xor safetensors解密流程 ==========
+    # 先在后台发起密钥请求，同时读header并让内核预读tensor数据，网络延迟与IO重叠
+    key_future = prefetch_decryption_key(model_path)
+    import json
+    with metrics.phase("payload_read") as phase:
+        with open(model_path, "rb") as f:
+            metadata, data_start, data_len = read_payload_header(f)
+            if hasattr(os, "posix_fadvise") and data_len:
+                os.posix_fadvise(f.fileno(), data_start, data_len, os.POSIX_FADV_WILLNEED)
+        phase["bytes"] = 8 + len(metadata)
+    # key_fetch 只统计读完header之后还需要等待的时间
+    with metrics.phase("key_fetch"):
+        decryption_key = key_future.result()
+    key_bytes = bytes.fromhex(decryption_key)
+    md5_expected = None
+    try:
+        md5_expected = json.loads(metadata).get("model_md5", None)
+    except Exception as e:
+        logger.warning(f"⚠️ metadata校验异常: {str(e)}")
+    # 有分块清单时用清单（可并行、能定位坏块），否则退回整体md5
+    manifest = manifest_from_header(metadata)
+    if (manifest or md5_expected) and VERIFIED_CACHE.contains(model_path, key_bytes):
+        logger.info("✅ 文件未变化且已校验过，跳过完整性校验")
+        manifest = md5_expected = None
+    windowed = bool(windowed_ok and DECRYPT_BUFFER_LIMIT and data_len > DECRYPT_BUFFER_LIMIT)
+    if SHARED_STORE_ENABLED and not windowed:
+        status, decrypted_tensor = _load_shared(model_path, key_bytes, metadata, data_len, manifest, md5_expected,
+                                                metrics, logger)
+    else:
+        status, decrypted_tensor = _decrypt_and_verify(model_path, key_bytes, metadata, data_len, manifest,
+                                                       md5_expected, metrics, logger, windowed=windowed)
+        # 只缓存校验通过的完整明文（分窗口解密不保留明文；共享内存本身已在进程间复用）。
+        # 缓存保留自己的拷贝，之后改用它返回的写时复制 buffer，state dict 被原地修改不会污染缓存
+        if status == "ok" and decrypted_tensor is not None and PAYLOAD_CACHE.budget_bytes > 0:
+            cached_view = PAYLOAD_CACHE.put(model_id, decrypted_tensor)
+            if cached_view is not None:
+                decrypted_tensor = cached_view
+                stats = PAYLOAD_CACHE.stats()
+                logger.info(f"⚡ 明文已放入内存缓存: 缓存 {stats['entries']} 个模型 {stats['bytes'] / 1024**2:.0f}MB"
+                            f"/{stats['budget_bytes'] / 1024**2:.0f}MB，淘汰 {stats['evictions']} 次")
+    _record_first_encrypted_load(time.perf_counter() - load_start)
+    logger.info(f"✅ 加密模型处理流程结束: {model_path}")
+    print(f"✅ 加密模型处理流程结束: {model_path}")
+    return status, decrypted_tensor
+
+# ========== 加载前解密钩子 ==========
+# 已由钩子解密、等待 on_model_loaded 跳过的模型：模型标识 -> 状态
+_preloaded = {}
+
+def load_encrypted_state_dict(model_path, logger=None):
+    """
+    加密模型返回解密后的 state dict（tensor 直接包装明文buffer，不落盘、不再反序列化文件），
+    非加密模型返回 None；完整性校验失败时抛出异常，不让WebUI加载损坏的权重
+    """
+    logger = logger or get_logger()
+    metrics = LoadMetrics(model_path, kind="preload")
+    status = "error"
+    try:
+        # state dict 本来就要持有全部 tensor，分窗口省不下内存，反而要先解一遍校验、再解一遍建 tensor，
+        # 这里始终整块解密，校验在同一遍里完成
+        with maybe_profile(PROFILE_DIR, logger):
+            status, decrypted_tensor = _secure_load(model_path, logger, metrics, windowed_ok=False)
+        if status == "plain":
+            return None
+        if status == "container":
+            raise RuntimeError(f"hybrid加密容器不能直接加载，请先用 model_decryptor.py 解密: {model_path}")
+        if status == "corrupt":
+            raise RuntimeError(f"加密模型完整性校验失败: {model_path}")
+        with metrics.phase("state_dict") as phase:
+            with open(model_path, "rb") as f:
+                metadata, _, _ = read_payload_header(f)
+            state_dict = state_dict_from_buffer(metadata, decrypted_tensor)
+            phase["tensors"] = len(state_dict)
+        _preloaded[model_identity(model_path)] = status
+        logger.info(f"🔓 已从内存提供解密后的state dict: {len(state_dict)} 个tensor")
+        print(f"🔓 已从内存提供解密后的state dict: {len(state_dict)} 个tensor")
+        return state_dict
+    finally:
+        metrics.finish(status, get_metrics_logger(), METRICS_PROMETHEUS_FILE)
+
+def install_preload_hook():
+    """
+    包装 modules.sd_models.read_state_dict：加密模型在WebUI读取文件之前解密，直接返回
+    state dict；非加密模型交给原函数。返回是否安装成功
+    """
+    logger = get_logger()
+    try:
+        from modules import sd_models
+    except ImportError:
+        logger.warning("⚠️ 未找到 modules.sd_models，加载前解密钩子未安装")
+        return False
+    original = sd_models.read_state_dict
+    if getattr(original, "_secure_loader_original", None) is not None:
+        return True
+    # 按原函数签名取 map_location，不同版本的 read_state_dict 参数位置不一样
+    signature = inspect.signature(original)
+
+    @functools.wraps(original)
+    def read_state_dict(checkpoint_file, *args, **kwargs):
+        bound = signature.bind(checkpoint_file, *args, **kwargs)
+        state_dict = load_encrypted_state_dict(checkpoint_file, logger)
+        if state_dict is None:
+            return original(checkpoint_file, *args, **kwargs)
+        map_location = bound.arguments.get("map_location")
+        if map_location not in (None, "cpu"):
+            state_dict = {name: tensor.to(map_location) for name, tensor in state_dict.items()}
+        # 与原函数一致：去掉 state_dict 外层并做 key 替换
+        convert = getattr(sd_models, "get_state_dict_from_checkpoint", None)
+        return convert(state_dict) if convert is not None else state_dict
+
+    read_state_dict._secure_loader_original = original
+    sd_models.read_state_dict = read_state_dict
+    logger.info("🪝 已安装加载前解密钩子: modules.sd_models.read_state_dict")
+    return True
+
+VERIFIED_CACHE = VerifiedCache(VERIFIED_CACHE_FILE)
+
+# ========== 后台预解密 ==========
+PREDECRYPT_CACHE = None
+
+def start_predecrypt_worker():
+    global PREDECRYPT_CACHE
+    logger = get_logger()
+    models_dir = PREDECRYPT_MODELS_DIR
+    if models_dir is None:
+        from modules import paths
+        models_dir = paths.models_path
+    PREDECRYPT_CACHE = PredecryptCache(PREDECRYPT_CACHE_DIR, PREDECRYPT_CACHE_BYTES)
+    worker = PredecryptWorker(
+        PREDECRYPT_CACHE,
+        models_dir,
+        MODEL_EXTENSIONS,
+        is_encrypted=lambda path: encryption_scheme(path) == XOR_SCHEME,
+        get_key=lambda path: get_key_client().get_key_sync(path),
+        model_id=model_identity,
+        logger=logger,
+        index=get_model_index(),
+    )
+    worker.start()
+    logger.info(f"🗂️ 后台预解密已启动，模型目录: {models_dir}，缓存目录: {PREDECRYPT_CACHE_DIR}")
+    return worker
+
+# ========== 启动耗时统计 ==========
+STARTUP_TIMINGS = {}
+
+def startup_timing_report():
+    """扩展注册耗时和首次加密模型加载耗时（毫秒）"""
+    return dict(STARTUP_TIMINGS)
+
+def _record_first_encrypted_load(elapsed):
+    if "first_encrypted_load_ms" in STARTUP_TIMINGS:
+        return
+    STARTUP_TIMINGS["first_encrypted_load_ms"] = elapsed * 1000
+    get_logger().info(f"⏱️ 启动耗时统计: {startup_timing_report()}")
+
+if PREDECRYPT_ENABLED:
+    start_predecrypt_worker()
+
+if PRELOAD_HOOK_ENABLED:
+    install_preload_hook()
 
 script_callbacks.on_model_loaded(on_model_loaded)
-print("🎯 SecureModelLoader 扩展已注册模型加载回调，仅在模型加载时执行自定义逻辑")
\ No newline at end of file
+STARTUP_TIMINGS["register_ms"] = (time.perf_counter() - _IMPORT_START) * 1000
+if STARTUP_TIMINGS["register_ms"] > IMPORT_BUDGET_MS:
+    get_logger().warning(f"⚠️ 扩展注册耗时 {STARTUP_TIMINGS['register_ms']:.0f}ms，超出预算 {IMPORT_BUDGET_MS}ms")
+print(f"🎯 SecureModelLoader 扩展已注册模型加载回调，仅在模型加载时执行自定义逻辑"
+      f"（注册耗时 {STARTUP_TIMINGS['register_ms']:.0f}ms）")
\ No newline at end of file
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+跨进程共享的解密模型存储
+
+同一台推理机上跑多个 WebUI / API worker 时，每个进程都各自解密同一个加密模型并持有一份
+明文，N 个进程就是 N 倍的 CPU 和内存。SharedModelStore 用 multiprocessing.shared_memory
+（Linux 上即 /dev/shm）按 (模型标识, key id) 存一份解密后的 tensor 数据：
+- 第一个进程在文件锁内创建共享内存并解密进去（build 回调），完成后标记为就绪
+- 其他进程在同一把锁上等待，之后直接映射，不拷贝、不再解密。Linux 上用写时复制映射
+  /dev/shm 下的段：各进程读的是同一份物理页，某个进程原地修改 tensor 只会复制改到的页
+- 引用计数按 pid 记录在 <store_dir>/<name>.refs 里，每次加锁时清理已退出的进程，
+  进程崩溃也不会让计数泄漏；最后一个使用者释放时删除共享内存和 .refs 文件
+  （.lock 文件保留，删除正被别的进程等待的锁文件会让两个进程拿到两把不同的锁）
+
+注意：共享内存里是明文模型，store_dir 和 /dev/shm 只应对运行 worker 的用户可见。
+文件锁依赖 fcntl，仅支持 POSIX 系统。
+"""
+
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+MAGIC = b"SMLSHM01"
+# 段头: [8字节magic][1字节状态][7字节保留][8字节数据长度]，数据从 HEADER_SIZE 开始（页对齐）
+HEADER_SIZE = 4096
+STATE_BUILDING = 0
+STATE_READY = 1
+DEFAULT_STORE_DIR = os.path.join(tempfile.gettempdir(), "secure_loader_shm")
+
+def _untrack(name):
+    """
+    不让 multiprocessing 的 resource_tracker 管这个段：否则创建它的进程退出时会把段删掉，
+    而其他进程可能还在用；段的生命周期由引用计数决定
+    """
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(f"/{name}", "shared_memory")
+    except Exception:
+        pass
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class SharedModelHandle:
+    """
+    一个进程对共享模型的一次引用，用完调用 release()。buffer 在 Linux 上是写时复制映射，
+    其他平台上是只读 memoryview
+    """
+
+    def __init__(self, store, name, buffer, closer, created):
+        self.store = store
+        self.name = name
+        self.buffer = buffer
+        self.created = created
+        self._closer = closer
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        try:
+            self.buffer.release()
+            self._closer()
+        except BufferError:
+            # 调用方还有基于 buffer 的视图（如 torch.frombuffer）：映射留给垃圾回收，引用照常释放
+            pass
+        self.store._detach(self.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class SharedModelStore:
+    def __init__(self, store_dir=DEFAULT_STORE_DIR):
+        self.store_dir = store_dir
+        self._thread_lock = threading.Lock()
+        os.makedirs(store_dir, mode=0o700, exist_ok=True)
+
+    @staticmethod
+    def entry_name(model_id, key_bytes):
+        """共享内存段名：模型标识 + key 的 sha256，不暴露路径和 key"""
+        digest = hashlib.sha256(model_id.encode("utf-8") + b"\0" + key_bytes).hexdigest()
+        return f"smls_{digest[:24]}"
+
+    def _path(self, name, suffix):
+        return os.path.join(self.store_dir, name + suffix)
+
+    @contextmanager
+    def _locked(self, name):
+        """跨进程（flock）+ 进程内（线程锁）互斥"""
+        with self._thread_lock:
+            with open(self._path(name, ".lock"), "a+") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_refs(self, name):
+        try:
+            with open(self._path(name, ".refs"), "r", encoding="utf-8") as f:
+                refs = {int(pid): n for pid, n in json.load(f).items()}
+        except (OSError, ValueError):
+            return {}
+        return {pid: n for pid, n in refs.items() if n > 0 and _pid_alive(pid)}
+
+    def _save_refs(self, name, refs):
+        path = self._path(name, ".refs")
+        if not refs:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({str(pid): n for pid, n in refs.items()}, f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _unlink(name):
+        # attach 时登记到 resource_tracker、unlink 时注销，两者正好抵消
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            return
+        shm.close()
+        shm.unlink()
+
+    def _open_ready(self, name):
+        """已就绪时映射数据区，返回 (memoryview, closer)；不存在或未就绪返回 None"""
+        dev_path = os.path.join("/dev/shm", name)
+        if os.path.exists(dev_path):
+            # Linux：写时复制 mmap，明文页在各进程间共享，本进程的修改不会写回共享段
+            with open(dev_path, "rb") as f:
+                if os.fstat(f.fileno()).st_size < HEADER_SIZE:
+                    return None
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            if mm[:8] != MAGIC or mm[8] != STATE_READY:
+                mm.close()
+                return None
+            data_len = int.from_bytes(mm[16:24], "little")
+            base = memoryview(mm)
+            view = base[HEADER_SIZE:HEADER_SIZE + data_len]
+            base.release()
+            return view, mm.close
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            return None
+        _untrack(name)
+        buf = shm.buf
+        if bytes(buf[:8]) != MAGIC or buf[8] != STATE_READY:
+            buf.release()
+            shm.close()
+            return None
+        data_len = int.from_bytes(buf[16:24], "little")
+        view = buf[HEADER_SIZE:HEADER_SIZE + data_len].toreadonly()
+        buf.release()
+        return view, shm.close
+
+    def acquire(self, model_id, key_bytes, size, build):
+        """
+        取得共享模型的只读引用。没有就绪的段时创建 size 字节的段并调用 build(可写memoryview)
+        解密进去：build 返回真值才标记为就绪供其他进程使用，返回假值（如校验失败）时
+        只有本进程持有，其他进程下次会重新构建
+        """
+        name = self.entry_name(model_id, key_bytes)
+        with self._locked(name):
+            opened = self._open_ready(name)
+            created = False
+            if opened is None:
+                self._unlink(name)  # 清掉没构建完的残留段
+                shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + max(size, 1))
+                _untrack(name)
+                buf = shm.buf
+                data = buf[HEADER_SIZE:HEADER_SIZE + size]
+                try:
+                    buf[:8] = MAGIC
+                    buf[8] = STATE_BUILDING
+                    buf[16:24] = size.to_bytes(8, "little")
+                    ok = build(data)
+                    if ok:
+                        buf[8] = STATE_READY
+                    view = data.toreadonly()
+                    data.release()
+                except BaseException:
+                    try:
+                        data.release()
+                        shm.close()
+                    except BufferError:
+                        pass  # build 留下了视图，映射交给垃圾回收，段照样删除
+                    self._unlink(name)
+                    raise
+                finally:
+                    buf.release()
+                opened = self._open_ready(name) if ok else None
+                if opened is None:
+                    opened = (view, shm.close)
+                else:
+                    # 构建用的是可写的共享映射，换成与其他进程相同的映射方式，本进程改写 tensor 不影响别人
+                    view.release()
+                    shm.close()
+                created = True
+            refs = self._load_refs(name)
+            refs[os.getpid()] = refs.get(os.getpid(), 0) + 1
+            self._save_refs(name, refs)
+        view, closer = opened
+        return SharedModelHandle(self, name, view, closer, created)
+
+    def _detach(self, name):
+        with self._locked(name):
+            refs = self._load_refs(name)
+            pid = os.getpid()
+            if refs.get(pid, 0) > 1:
+                refs[pid] -= 1
+            else:
+                refs.pop(pid, None)
+            self._save_refs(name, refs)
+            if not refs:
+                self._unlink(name)
+
+    def refcount(self, model_id, key_bytes):
+        name = self.entry_name(model_id, key_bytes)
+        with self._locked(name):
+            return sum(self._load_refs(name).values())
+
+    def cleanup_stale(self):
+        """删除所有使用者都已退出的段（例如 worker 被 kill -9 后），返回删除数量"""
+        removed = 0
+        for entry in os.listdir(self.store_dir):
+            if not entry.endswith(".lock"):
+                continue
+            name = entry[:-len(".lock")]
+            with self._locked(name):
+                refs = self._load_refs(name)
+                self._save_refs(name, refs)
+                if not refs:
+                    self._unlink(name)
+                    removed += 1
+        return removed
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+不加载权重的模型信息读取测试脚本
+用 torch.save 写 zip 格式和旧格式（非zip）checkpoint，校验读出的 metadata、tensor 名称、
+shape、dtype，以及 pickle 里引用的不在白名单的全局对象不会被导入执行：
+结构读取时换成占位对象，退回 torch.load(weights_only=True) 时直接拒绝
+"""
+
+import os
+import pickle
+
+import torch
+
+from checkpoint_info import read_checkpoint_info
+from test_helpers import make_work_dir, write_safetensors
+
+WORK_DIR = make_work_dir("checkpoint_info_test_")
+MARKER = os.path.join(WORK_DIR, "executed")
+TENSORS = {
+    "model.a.weight": torch.randn(5, 3, dtype=torch.float16),
+    "model.b.bias": torch.arange(7, dtype=torch.int64),
+    "model.c.weight": torch.zeros(2, 2, 2, dtype=torch.bfloat16),
+}
+EXPECTED = {
+    "model.a.weight": {"dtype": "F16", "shape": [5, 3]},
+    "model.b.bias": {"dtype": "I64", "shape": [7]},
+    "model.c.weight": {"dtype": "BF16", "shape": [2, 2, 2]},
+}
+
+class Payload:
+    """反序列化时调用 open(MARKER, "w")：真的执行了就会留下 MARKER 文件"""
+
+    def __reduce__(self):
+        return open, (MARKER, "w")
+
+def save_checkpoint(name, legacy=False):
+    path = os.path.join(WORK_DIR, name)
+    torch.save({"state_dict": dict(TENSORS), "metadata": {"title": "测试"}, "payload": Payload()}, path,
+               _use_new_zipfile_serialization=not legacy)
+    return path
+
+def test_torch_formats():
+    """zip 格式和旧格式都只读结构：tensor 信息和 metadata 正确，Payload 没有被执行"""
+    for name, legacy, fmt in (("zip.ckpt", False, "torch-zip"), ("legacy.ckpt", True, "torch-legacy")):
+        info = read_checkpoint_info(save_checkpoint(name, legacy))
+        assert info["format"] == fmt, info["format"]
+        assert info["tensors"] == EXPECTED
+        assert info["metadata"] == {"title": "测试"}
+        assert info["keys"] == ["state_dict", "metadata", "payload"]
+        assert not os.path.exists(MARKER)
+
+def test_forbidden_global_rejected():
+    """不是 torch checkpoint 结构的普通 pickle 退回 torch.load(weights_only=True)，引用 open 被拒绝"""
+    path = os.path.join(WORK_DIR, "plain.pt")
+    with open(path, "wb") as f:
+        pickle.dump({"weight": Payload()}, f, protocol=2)
+    try:
+        read_checkpoint_info(path)
+    except pickle.UnpicklingError:
+        pass
+    else:
+        raise AssertionError("引用了白名单外全局对象的 pickle 应当被拒绝")
+    assert not os.path.exists(MARKER)
+
+def test_safetensors_header_only():
+    """safetensors 只读 header"""
+    path = write_safetensors(os.path.join(WORK_DIR, "model.safetensors"), TENSORS, {"format": "pt"})
+    info = read_checkpoint_info(path)
+    assert info["format"] == "safetensors"
+    assert info["tensors"] == EXPECTED and info["metadata"] == {"format": "pt"}
+
+def main():
+    """主函数"""
+    print("🚀 模型信息读取测试")
+    print("=" * 50)
+    for test in (test_torch_formats, test_forbidden_global_rejected, test_safetensors_header_only):
+        test()
+        print(f"✅ {test.__name__} 通过")
+    print("\n🎉 所有测试通过！")
+
+if __name__ == "__main__":
+    main()
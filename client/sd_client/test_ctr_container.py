@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+AES-CTR hybrid 容器测试脚本
+用 tools/model_encryptor.py 的 encrypt_hybrid 加密一个小模型（chunk 大小不是 16 字节的整数倍），
+校验多进程 / 多线程 decrypt_container 逐字节还原且 md5 与元数据一致、read_plain_range 在
+任意不对齐的偏移上与明文一致，以及加密中途失败不留下输出文件
+"""
+
+import contextlib
+import hashlib
+import io
+import os
+import random
+
+import torch
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from test_helpers import make_work_dir, write_safetensors
+import ctr_container
+import model_encryptor
+from model_decryptor import extract_meta_from_file, unwrap_aes_key
+
+WORK_DIR = make_work_dir("ctr_container_test_")
+CHUNK_SIZE = 5000
+TENSORS = {
+    "model.a.weight": torch.randn(123, 45, dtype=torch.float32),
+    "model.b.bias": torch.randn(77, dtype=torch.float16),
+}
+PLAIN_PATH = write_safetensors(os.path.join(WORK_DIR, "plain.safetensors"), TENSORS)
+
+def write_rsa_keys():
+    """生成一对 RSA 密钥写到 WORK_DIR，返回 (公钥路径, 私钥路径)"""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pub_path = os.path.join(WORK_DIR, "public.pem")
+    priv_path = os.path.join(WORK_DIR, "private.pem")
+    with open(pub_path, "wb") as f:
+        f.write(private_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                      serialization.PublicFormat.SubjectPublicKeyInfo))
+    with open(priv_path, "wb") as f:
+        f.write(private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                          serialization.NoEncryption()))
+    return pub_path, priv_path
+
+PUB_PATH, PRIV_PATH = write_rsa_keys()
+
+def encrypt(name):
+    """加密 PLAIN_PATH 到 WORK_DIR/name，返回 (容器路径, 元数据, AES key, 密文长度)"""
+    out_dir = os.path.join(WORK_DIR, name)
+    os.makedirs(out_dir, exist_ok=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        enc_path, _ = model_encryptor.encrypt_hybrid(PLAIN_PATH, out_dir, PUB_PATH, chunk_size=CHUNK_SIZE)
+    meta, meta_len = extract_meta_from_file(enc_path)
+    data_len = os.path.getsize(enc_path) - meta["data_offset"] - meta_len
+    return enc_path, meta, unwrap_aes_key(meta, PRIV_PATH), data_len
+
+def read_plain():
+    with open(PLAIN_PATH, "rb") as f:
+        return f.read()
+
+def test_roundtrip_parallel():
+    """多进程和多线程按 chunk 解密都逐字节还原明文，hasher 的 md5 与元数据记录一致"""
+    plain = read_plain()
+    enc_path, meta, key, data_len = encrypt("roundtrip")
+    assert ctr_container.is_ctr_container(meta)
+    assert data_len == len(plain) and data_len > 4 * CHUNK_SIZE
+    assert meta["tensor_data_offset"] == ctr_container.tensor_data_offset(PLAIN_PATH) > 8
+    for use_processes in (True, False):
+        out_path = os.path.join(WORK_DIR, f"decrypted_{use_processes}.safetensors")
+        md5 = hashlib.md5()
+        ctr_container.decrypt_container(enc_path, out_path, key, meta, data_len, workers=3, hasher=md5,
+                                        use_processes=use_processes)
+        with open(out_path, "rb") as f:
+            assert f.read() == plain
+        assert md5.hexdigest() == meta["model_md5"]
+
+def test_read_plain_range_unaligned():
+    """read_plain_range 在不按 16 字节 / chunk 对齐的随机区间上与明文切片一致"""
+    plain = read_plain()
+    enc_path, meta, key, data_len = encrypt("range")
+    rng = random.Random(20250720)
+    ranges = [(0, 1), (15, 17), (CHUNK_SIZE - 3, CHUNK_SIZE + 5), (data_len - 7, data_len), (33, 33)]
+    for _ in range(50):
+        start = rng.randint(0, data_len - 1)
+        ranges.append((start, rng.randint(start, min(data_len, start + 3 * CHUNK_SIZE))))
+    for start, end in ranges:
+        assert ctr_container.read_plain_range(enc_path, key, meta, start, end) == plain[start:end], (start, end)
+
+def test_failed_encrypt_leaves_no_output():
+    """加密中途出错时不留下 .enc 文件（也不留临时文件）"""
+    out_dir = os.path.join(WORK_DIR, "failed")
+    os.makedirs(out_dir, exist_ok=True)
+    original = ctr_container.encrypt_to_container
+
+    def broken(model_path, fout, *args, **kwargs):
+        fout.write(b"\0" * 100)
+        raise OSError("磁盘已满")
+
+    ctr_container.encrypt_to_container = broken
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            model_encryptor.encrypt_hybrid(PLAIN_PATH, out_dir, PUB_PATH, chunk_size=CHUNK_SIZE)
+    except OSError:
+        pass
+    else:
+        raise AssertionError("encrypt_to_container 的异常应当抛出")
+    finally:
+        ctr_container.encrypt_to_container = original
+    assert os.listdir(out_dir) == []
+
+def main():
+    """主函数"""
+    print("🚀 AES-CTR hybrid 容器测试")
+    print("=" * 50)
+    for test in (test_roundtrip_parallel, test_read_plain_range_unaligned, test_failed_encrypt_leaves_no_output):
+        test()
+        print(f"✅ {test.__name__} 通过")
+    print("\n🎉 所有测试通过！")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+测试脚本共用的夹具
+测试 key、进程退出时自动删除的临时目录、按 torch tensor 写明文 safetensors，
+以及静默调用 tools/tensor_encryptor.py 加密（tools 目录在这里加进 sys.path）
+"""
+
+import atexit
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+import tensor_encryptor
+from lazy_safetensors import TORCH_DTYPES
+
+KEY_HEX = "00112233445566778899aabbccddeeff"
+
+def make_work_dir(prefix):
+    """临时工作目录，进程退出时删除"""
+    path = tempfile.mkdtemp(prefix=prefix)
+    atexit.register(shutil.rmtree, path, True)
+    return path
+
+def safetensors_dtype(tensor):
+    return TORCH_DTYPES[str(tensor.dtype).replace("torch.", "")]
+
+def tensor_bytes(tensor):
+    return tensor.contiguous().reshape(-1).view(torch.uint8).numpy().tobytes()
+
+def write_safetensors(path, tensors, metadata=None):
+    """按顺序写出 tensors（name -> torch tensor）的明文 safetensors，返回 path"""
+    header = {"__metadata__": dict(metadata or {"format": "pt"})}
+    offset = 0
+    blobs = []
+    for name, tensor in tensors.items():
+        data = tensor_bytes(tensor)
+        header[name] = {"dtype": safetensors_dtype(tensor), "shape": list(tensor.shape),
+                        "data_offsets": [offset, offset + len(data)]}
+        offset += len(data)
+        blobs.append(data)
+    header_bytes = json.dumps(header).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(len(header_bytes).to_bytes(8, "little"))
+        f.write(header_bytes)
+        f.write(b"".join(blobs))
+    return path
+
+def read_payload(path):
+    """safetensors 文件 header 之后的 tensor 数据区"""
+    with open(path, "rb") as f:
+        header_len = int.from_bytes(f.read(8), "little")
+        f.seek(8 + header_len)
+        return f.read()
+
+def encrypt_safetensors(plain_path, out_dir, **kwargs):
+    """用 tensor_encryptor 以 KEY_HEX 加密到 out_dir，不打印，返回输出路径"""
+    os.makedirs(out_dir, exist_ok=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return tensor_encryptor.encrypt_safetensors(plain_path, out_dir, KEY_HEX, **kwargs)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+分块完整性清单测试脚本
+校验 ManifestBuilder 任意切分喂入结果一致、占位清单与真实清单写进 header 后等长、
+清单在 header 中往返、整块 / 流式 / 解密时逐块三种校验能找出同一个坏块，
+以及坏块到 tensor 名称的映射
+"""
+
+import json
+import os
+import random
+
+from integrity import (ManifestBuilder, ManifestChecker, corrupt_tensors, header_with_manifest,
+                       manifest_from_header, placeholder_manifest, verify_manifest, verify_manifest_stream)
+from xor_cipher import xor_bytes, xor_into_hashed
+
+KEY = bytes.fromhex("00112233445566778899aabbccddeeff")
+CHUNK_SIZE = 1000
+
+def build_manifest(data, chunk_size=CHUNK_SIZE, split_seed=None):
+    """按随机切分（split_seed 为 None 时一次性）喂入 ManifestBuilder"""
+    builder = ManifestBuilder(chunk_size)
+    if split_seed is None:
+        builder.update(data)
+        return builder.finish()
+    rng = random.Random(split_seed)
+    pos = 0
+    while pos < len(data):
+        step = rng.randint(1, 3 * chunk_size)
+        builder.update(data[pos:pos + step])
+        pos += step
+    return builder.finish()
+
+def test_builder_splits():
+    """任意切分喂入得到相同清单，块数为向上取整"""
+    data = os.urandom(10 * CHUNK_SIZE + 123)
+    manifest = build_manifest(data)
+    assert len(manifest["chunks"]) == 11
+    assert manifest["chunk_size"] == CHUNK_SIZE
+    for seed in range(5):
+        assert build_manifest(data, split_seed=seed) == manifest
+    assert build_manifest(data[:-123])["chunks"] == manifest["chunks"][:10]
+    assert build_manifest(b"")["chunks"] == []
+
+def test_header_round_trip():
+    """清单写进 header 后可取回，原有 metadata 保留；占位清单与真实清单写出的 header 等长"""
+    header_bytes = json.dumps({"__metadata__": {"format": "pt"},
+                               "a": {"dtype": "U8", "shape": [5], "data_offsets": [0, 5]}}).encode("utf-8")
+    assert manifest_from_header(header_bytes) is None
+    for payload_len in (0, 1, CHUNK_SIZE, 7 * CHUNK_SIZE + 1):
+        manifest = build_manifest(os.urandom(payload_len))
+        with_manifest = header_with_manifest(header_bytes, manifest)
+        assert manifest_from_header(with_manifest) == manifest
+        assert json.loads(with_manifest)["__metadata__"]["format"] == "pt"
+        placeholder = header_with_manifest(header_bytes, placeholder_manifest(payload_len, CHUNK_SIZE))
+        assert len(placeholder) == len(with_manifest)
+
+def test_detects_corrupt_chunk():
+    """整块、流式、解密时逐块校验都能找出被改动的块，长度不符时全部判坏"""
+    plain = os.urandom(8 * CHUNK_SIZE + 456)
+    manifest = build_manifest(plain)
+    assert verify_manifest(plain, manifest, workers=4) == []
+    corrupted = bytearray(plain)
+    corrupted[5 * CHUNK_SIZE + 17] ^= 0xFF
+    assert verify_manifest(corrupted, manifest, workers=4) == [5]
+    assert verify_manifest(plain[:-1000], manifest) == list(range(9))
+
+    builder = ManifestBuilder(CHUNK_SIZE)
+    builder.update(corrupted)
+    assert verify_manifest_stream(builder, manifest) == [5]
+
+    cipher = xor_bytes(bytes(corrupted), KEY)
+    for workers in (1, 4):
+        checker = ManifestChecker(manifest)
+        assert checker.matches_length(len(cipher))
+        xor_into_hashed(cipher, bytearray(len(cipher)), KEY, chunk_check=checker, chunk_size=CHUNK_SIZE,
+                        workers=workers)
+        assert checker.bad_chunks == [5], checker.bad_chunks
+    assert not ManifestChecker(manifest).matches_length(len(cipher) + CHUNK_SIZE)
+
+def test_corrupt_tensors():
+    """坏块映射到与之重叠的 tensor，空 tensor 和 model_md5 这类非 tensor 条目不会被报告"""
+    header_bytes = json.dumps({
+        "__metadata__": {"format": "pt"},
+        "model_md5": "0" * 32,
+        "a": {"dtype": "U8", "shape": [1500], "data_offsets": [0, 1500]},
+        "b": {"dtype": "U8", "shape": [500], "data_offsets": [1500, 2000]},
+        "empty": {"dtype": "U8", "shape": [0], "data_offsets": [2000, 2000]},
+        "c": {"dtype": "U8", "shape": [2500], "data_offsets": [2000, 4500]},
+        "extra": {"note": "没有 data_offsets"},
+    }).encode("utf-8")
+    assert corrupt_tensors(header_bytes, [], CHUNK_SIZE) == []
+    assert corrupt_tensors(header_bytes, [0], CHUNK_SIZE) == ["a"]
+    assert corrupt_tensors(header_bytes, [1], CHUNK_SIZE) == ["a", "b"]
+    assert corrupt_tensors(header_bytes, [2], CHUNK_SIZE) == ["c"]
+    assert corrupt_tensors(header_bytes, [4], CHUNK_SIZE) == ["c"]
+
+def main():
+    """主函数"""
+    print("🚀 分块完整性清单测试")
+    print("=" * 50)
+    for test in (test_builder_splits, test_header_round_trip, test_detects_corrupt_chunk, test_corrupt_tensors):
+        test()
+        print(f"✅ {test.__name__} 通过")
+    print("\n🎉 所有测试通过！")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+解密密钥缓存测试脚本
+校验进程内缓存按 TTL 过期、磁盘缓存经 AES-GCM 加密后可被新进程（新实例）读回，
+文件里没有明文 key / API key，换设备密钥或过期后当作未命中，以及按条目失效
+"""
+
+import os
+
+import key_cache
+from key_cache import KeyCache
+from test_helpers import make_work_dir
+
+WORK_DIR = make_work_dir("key_cache_test_")
+API_KEY = "APIKEY_wk_test"
+MODEL_ID = "/models/a.safetensors|1024|1"
+KEY_HEX = "00112233445566778899aabbccddeeff"
+
+class FakeClock:
+    """替换 key_cache 里的 time 模块，手动拨动时间"""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+def with_clock(test):
+    """运行期间把 key_cache.time 换成 FakeClock，作为第一个参数传给测试"""
+    def wrapper():
+        clock = FakeClock()
+        original = key_cache.time
+        key_cache.time = clock
+        try:
+            test(clock)
+        finally:
+            key_cache.time = original
+    wrapper.__name__ = test.__name__
+    wrapper.__doc__ = test.__doc__
+    return wrapper
+
+@with_clock
+def test_memory_ttl(clock):
+    """TTL 内命中，过期后未命中并移出缓存；ttl<=0 不缓存"""
+    cache = KeyCache(ttl=60)
+    assert cache.get(API_KEY, MODEL_ID) is None
+    cache.put(API_KEY, MODEL_ID, KEY_HEX)
+    clock.now += 59
+    assert cache.get(API_KEY, MODEL_ID) == KEY_HEX
+    assert cache.get("APIKEY_other", MODEL_ID) is None
+    clock.now += 1
+    assert cache.get(API_KEY, MODEL_ID) is None
+    assert cache.stats() == {"hits": 1, "misses": 3, "size": 0}
+    disabled = KeyCache(ttl=0)
+    disabled.put(API_KEY, MODEL_ID, KEY_HEX)
+    assert disabled.get(API_KEY, MODEL_ID) is None
+
+@with_clock
+def test_disk_round_trip(clock):
+    """新实例用同一设备密钥从磁盘读回；换设备密钥、过期都是未命中；文件里没有明文"""
+    disk_path = os.path.join(WORK_DIR, "round_trip.json")
+    KeyCache(ttl=60, disk_path=disk_path, device_secret=b"device-a").put(API_KEY, MODEL_ID, KEY_HEX)
+    with open(disk_path, "r", encoding="utf-8") as f:
+        content = f.read()
+    assert KEY_HEX not in content and API_KEY not in content and MODEL_ID not in content
+    clock.now += 30
+    # device_secret 可以是可调用对象，只在第一次读写磁盘时求值
+    fresh = KeyCache(ttl=60, disk_path=disk_path, device_secret=lambda: "device-a")
+    assert fresh.get(API_KEY, MODEL_ID) == KEY_HEX
+    assert fresh.stats()["hits"] == 1
+    assert KeyCache(ttl=60, disk_path=disk_path, device_secret=b"device-b").get(API_KEY, MODEL_ID) is None
+    clock.now += 30
+    assert KeyCache(ttl=60, disk_path=disk_path, device_secret=b"device-a").get(API_KEY, MODEL_ID) is None
+
+@with_clock
+def test_disk_tampered_or_invalidated(clock):
+    """磁盘记录被篡改当作未命中；invalidate 单条只删这一条，不带参数删除整个文件"""
+    disk_path = os.path.join(WORK_DIR, "invalidate.json")
+    cache = KeyCache(ttl=60, disk_path=disk_path, device_secret=b"device-a")
+    cache.put(API_KEY, MODEL_ID, KEY_HEX)
+    cache.put(API_KEY, "other", "ffeeddccbbaa99887766554433221100")
+    entries = cache._load_disk()
+    entry_id = KeyCache._entry_id(API_KEY, MODEL_ID)
+    record = dict(entries[entry_id])
+    entries[entry_id]["data"] = entries[KeyCache._entry_id(API_KEY, "other")]["data"]
+    cache._save_disk(entries)
+    assert KeyCache(ttl=60, disk_path=disk_path, device_secret=b"device-a").get(API_KEY, MODEL_ID) is None
+    entries[entry_id] = record
+    cache._save_disk(entries)
+    cache.invalidate(API_KEY, MODEL_ID)
+    reader = KeyCache(ttl=60, disk_path=disk_path, device_secret=b"device-a")
+    assert reader.get(API_KEY, MODEL_ID) is None
+    assert reader.get(API_KEY, "other") == "ffeeddccbbaa99887766554433221100"
+    cache.invalidate()
+    assert not os.path.exists(disk_path)
+    assert cache.get(API_KEY, "other") is None
+
+def main():
+    """主函数"""
+    print("🚀 解密密钥缓存测试")
+    print("=" * 50)
+    for test in (test_memory_ttl, test_disk_round_trip, test_disk_tampered_or_invalidated):
+        test()
+        print(f"✅ {test.__name__} 通过")
+    print("\n🎉 所有测试通过！")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+按需解密读取器测试脚本
+用 tools/tensor_encryptor.py 整块 / 部分加密一个小模型，校验 LazyEncryptedSafetensors 的
+get_tensor、get_slice（行切片、步长、整数下标、其余维度索引）与原 tensor 一致，
+部分加密时加密范围切在 tensor 和行的中间
+"""
+
+import os
+
+import torch
+
+from encryption_policy import EncryptionPolicy
+from lazy_safetensors import LazyEncryptedSafetensors
+from test_helpers import KEY_HEX, encrypt_safetensors, make_work_dir, safetensors_dtype, write_safetensors
+
+WORK_DIR = make_work_dir("lazy_safetensors_test_")
+TENSORS = {
+    "model.embed.weight": torch.randn(37, 24, dtype=torch.float16),
+    "model.proj.weight": torch.randn(50, 7, 3, dtype=torch.float32),
+    "model.norm.bias": torch.randn(24, dtype=torch.bfloat16),
+    "model.scale": torch.tensor(3.5, dtype=torch.float32),
+}
+POLICIES = {
+    "full": None,
+    # 块大小不是行大小的整数倍，加密范围的边界落在行中间
+    "fraction": EncryptionPolicy(fraction=0.4, block_size=333),
+    "pattern": EncryptionPolicy(patterns=["*.proj.weight"]),
+}
+
+PLAIN_PATH = write_safetensors(os.path.join(WORK_DIR, "plain.safetensors"), TENSORS)
+
+def encrypted_models():
+    """依次返回 (策略名, 加密文件路径)"""
+    for name, policy in POLICIES.items():
+        yield name, encrypt_safetensors(PLAIN_PATH, os.path.join(WORK_DIR, name), policy=policy)
+
+def test_get_tensor():
+    """整块读取每个 tensor 与原值一致，部分加密的文件带有加密范围"""
+    for name, path in encrypted_models():
+        with LazyEncryptedSafetensors(path, bytes.fromhex(KEY_HEX), workers=2) as reader:
+            assert sorted(reader.keys()) == sorted(TENSORS)
+            if name != "full":
+                assert "encrypted_ranges" in reader.metadata()
+            for key, tensor in TENSORS.items():
+                assert torch.equal(reader.get_tensor(key), tensor), (name, key)
+
+def test_get_slice():
+    """get_slice 的各种下标只解密涉及的行，结果与在原 tensor 上索引一致"""
+    indexes = [
+        slice(None), slice(3, 17), slice(5, 6), slice(0, 0), slice(2, None, 3), slice(-9, -2),
+        (slice(4, 20), 1), (slice(1, 30, 4), slice(2, 5)), 0, -1, 11, (7, slice(None, 3)),
+    ]
+    for name, path in encrypted_models():
+        with LazyEncryptedSafetensors(path, bytes.fromhex(KEY_HEX)) as reader:
+            for key in ("model.embed.weight", "model.proj.weight"):
+                tensor_slice = reader.get_slice(key)
+                assert tensor_slice.get_shape() == list(TENSORS[key].shape)
+                assert tensor_slice.get_dtype() == safetensors_dtype(TENSORS[key])
+                for index in indexes:
+                    assert torch.equal(tensor_slice[index], TENSORS[key][index]), (name, key, index)
+            assert torch.equal(reader.get_slice("model.norm.bias")[3:9], TENSORS["model.norm.bias"][3:9])
+            assert torch.equal(reader.get_slice("model.scale")[()], TENSORS["model.scale"])
+
+def main():
+    """主函数"""
+    print("🚀 按需解密读取器测试")
+    print("=" * 50)
+    for test in (test_get_tensor, test_get_slice):
+        test()
+        print(f"✅ {test.__name__} 通过")
+    print("\n🎉 所有测试通过！")
+
+if __name__ == "__main__":
+    main()
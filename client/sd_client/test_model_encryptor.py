@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+tools/model_encryptor.py 输出与原整文件 xor 实现的对照测试脚本
+原实现一次读入整个 tensor 数据区逐字节异或，header 原样写出；现在流式分块加密并在
+__metadata__ 里加加密标记。校验不同 chunk 大小下 tensor 数据区与原实现逐字节相同，
+safetensors 写法的 header（紧凑、8字节对齐、__metadata__ 在最前）去掉标记后逐字节还原
+"""
+
+import contextlib
+import io
+import json
+import os
+import random
+
+# test_helpers 把 tools 目录加进 sys.path，要先于 model_encryptor 导入
+from test_helpers import KEY_HEX, make_work_dir
+import model_encryptor
+from encryption_policy import dump_header, header_without_encryption, is_encrypted_metadata
+
+WORK_DIR = make_work_dir("model_encryptor_test_")
+
+def baseline_encrypt(model_path):
+    """原实现：header 原样写出，整个 tensor 数据区逐字节异或"""
+    key = bytes.fromhex(KEY_HEX)
+    with open(model_path, "rb") as f:
+        header = f.read(8)
+        metadata = f.read(int.from_bytes(header, "little"))
+        tensor_data = f.read()
+    return header + metadata + bytes([b ^ key[i % len(key)] for i, b in enumerate(tensor_data)])
+
+def split_file(data):
+    """返回 (header bytes, tensor 数据区)"""
+    header_len = int.from_bytes(data[:8], "little")
+    return data[8:8 + header_len], data[8 + header_len:]
+
+def write_model(name, header_bytes, payload):
+    path = os.path.join(WORK_DIR, name)
+    with open(path, "wb") as f:
+        f.write(len(header_bytes).to_bytes(8, "little"))
+        f.write(header_bytes)
+        f.write(payload)
+    return path
+
+def random_header(rng, payload_len, with_metadata=True):
+    """tensor 按顺序铺满 payload_len 字节的 header dict"""
+    header = {"__metadata__": {"format": "pt", "ss_note": "中文说明"}} if with_metadata else {}
+    offset = 0
+    index = 0
+    while offset < payload_len:
+        size = min(payload_len - offset, rng.randint(1, 5000))
+        header[f"model.layer{index}.weight"] = {"dtype": "U8", "shape": [size],
+                                                "data_offsets": [offset, offset + size]}
+        offset += size
+        index += 1
+    return header
+
+def encrypt(path, name, **kwargs):
+    out_dir = os.path.join(WORK_DIR, name)
+    os.makedirs(out_dir, exist_ok=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        model_encryptor.encrypt_safetensors(path, out_dir, custom_key=KEY_HEX, **kwargs)
+    with open(os.path.join(out_dir, os.path.basename(path)), "rb") as f:
+        return f.read()
+
+def test_payload_matches_baseline():
+    """任意 payload 长度和 chunk 大小（含不是 key 长度整数倍的）下，tensor 数据区与原实现逐字节相同"""
+    rng = random.Random(20250721)
+    for case in range(12):
+        payload_len = rng.choice([0, 1, 15, 17, 4096, 4097, rng.randint(1, 40000)])
+        header = json.dumps(random_header(rng, payload_len)).encode("utf-8")
+        path = write_model(f"model{case}.safetensors", header, os.urandom(payload_len))
+        _, expected = split_file(baseline_encrypt(path))
+        chunk_size = rng.choice([7, 16, 1000, 4096, 1 << 20])
+        for manifest in (False, True):
+            output = encrypt(path, f"out{case}_{manifest}", chunk_size=chunk_size, manifest=manifest)
+            out_header, payload = split_file(output)
+            assert payload == expected, (case, payload_len, chunk_size, manifest)
+            assert is_encrypted_metadata(json.loads(out_header)["__metadata__"])
+
+def test_safetensors_header_round_trip():
+    """safetensors 写法的 header（有无 __metadata__）加标记后去掉标记与原 header 逐字节相同"""
+    rng = random.Random(20250722)
+    for with_metadata in (True, False):
+        payload = os.urandom(9000)
+        original = dump_header(random_header(rng, len(payload), with_metadata))
+        path = write_model(f"aligned_{with_metadata}.safetensors", original, payload)
+        out_header, out_payload = split_file(encrypt(path, f"aligned_{with_metadata}", chunk_size=4096))
+        assert len(out_header) % 8 == 0
+        assert list(json.loads(out_header))[0] == "__metadata__"
+        assert header_without_encryption(out_header) == original
+        assert out_payload == split_file(baseline_encrypt(path))[1]
+
+def main():
+    """主函数"""
+    print("🚀 model_encryptor 与原实现对照测试")
+    print("=" * 50)
+    for test in (test_payload_matches_baseline, test_safetensors_header_round_trip):
+        test()
+        print(f"✅ {test.__name__} 通过")
+    print("\n🎉 所有测试通过！")
+
+if __name__ == "__main__":
+    main()
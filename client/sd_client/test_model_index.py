@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+模型库持久化索引测试脚本
+校验文件没变时直接查库不重新解析、大小或 mtime 变化后 refresh / get 重新探测，
+删除的文件从索引移除，以及打开旧版本（user_version 不同）的索引时丢弃旧记录
+"""
+
+import os
+import sqlite3
+
+import torch
+
+import model_index
+from encryption_policy import header_with_marker
+from model_index import ModelIndex, SCHEMA_VERSION
+from test_helpers import make_work_dir, write_safetensors
+
+WORK_DIR = make_work_dir("model_index_test_")
+EXTENSIONS = [".safetensors"]
+
+class ProbeCounter:
+    """包一层 model_index.probe_file，记录被重新解析的文件"""
+
+    def __init__(self):
+        self.original = model_index.probe_file
+        self.paths = []
+
+    def __call__(self, path, *args, **kwargs):
+        self.paths.append(path)
+        return self.original(path, *args, **kwargs)
+
+    def __enter__(self):
+        model_index.probe_file = self
+        return self
+
+    def __exit__(self, *exc):
+        model_index.probe_file = self.original
+
+def mark_encrypted(path):
+    """只改 header 加上加密标记（tensor 数据不动），模拟文件被替换成加密版本"""
+    with open(path, "rb") as f:
+        header_len = int.from_bytes(f.read(8), "little")
+        header = header_with_marker(f.read(header_len))
+        payload = f.read()
+    with open(path, "wb") as f:
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        f.write(payload)
+
+def bump_mtime(path):
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+def test_refresh_tracks_changes():
+    """没变的文件不重新解析；大小变化、只有 mtime 变化都重新探测；删掉的文件移出索引"""
+    root = os.path.join(WORK_DIR, "models")
+    os.makedirs(os.path.join(root, "lora"))
+    a = write_safetensors(os.path.join(root, "a.safetensors"), {"w": torch.zeros(4, 4)})
+    b = write_safetensors(os.path.join(root, "lora", "b.safetensors"), {"w": torch.zeros(8), "v": torch.ones(2)})
+    with open(os.path.join(root, "notes.txt"), "w") as f:
+        f.write("不是模型")
+    index = ModelIndex(os.path.join(WORK_DIR, "refresh.sqlite"))
+    with ProbeCounter() as probes:
+        records = {r["path"]: r for r in index.refresh(root, EXTENSIONS)}
+        assert sorted(records) == [a, b] and sorted(probes.paths) == [a, b]
+        assert records[b]["tensor_count"] == 2 and not records[a]["encrypted"]
+        probes.paths.clear()
+        index.refresh(root, EXTENSIONS)
+        assert index.get(a)["payload_size"] == 64
+        assert probes.paths == []
+
+        mark_encrypted(a)
+        write_safetensors(b, {"w": torch.zeros(8)})
+        records = {r["path"]: r for r in index.refresh(root, EXTENSIONS)}
+        assert sorted(probes.paths) == [a, b]
+        assert records[a]["encrypted"] and records[a]["scheme"] == "xor"
+        assert records[b]["tensor_count"] == 1
+
+        # 大小不变、只有 mtime 变化也要重新探测
+        probes.paths.clear()
+        size = os.path.getsize(b)
+        with open(b, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"\x00")
+        bump_mtime(b)
+        assert os.path.getsize(b) == size
+        assert index.get(b)["mtime_ns"] == os.stat(b).st_mtime_ns
+        assert probes.paths == [b]
+
+    os.remove(b)
+    assert [r["path"] for r in index.refresh(root, EXTENSIONS)] == [a]
+    assert index._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0] == 1
+    index.close()
+
+def test_schema_version_bump():
+    """user_version 与 SCHEMA_VERSION 不同的旧索引打开时清空并重建，之后按新版本重新探测"""
+    db_path = os.path.join(WORK_DIR, "old.sqlite")
+    path = write_safetensors(os.path.join(WORK_DIR, "model.safetensors"), {"w": torch.zeros(3)})
+    st = os.stat(path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, encrypted INTEGER)")
+    conn.execute("INSERT INTO files VALUES (?, ?, ?, 1)", (path, st.st_size, st.st_mtime_ns))
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION - 1}")
+    conn.commit()
+    conn.close()
+
+    index = ModelIndex(db_path)
+    assert index._conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    assert index._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0] == 0
+    with ProbeCounter() as probes:
+        record = index.get(path)
+        assert probes.paths == [path]
+    assert not record["encrypted"] and record["tensor_count"] == 1
+    index.close()
+
+    # 版本一致时保留记录，不再探测
+    index = ModelIndex(db_path)
+    with ProbeCounter() as probes:
+        assert index.get(path) == record
+        assert probes.paths == []
+    index.close()
+
+def main():
+    """主函数"""
+    print("🚀 模型库持久化索引测试")
+    print("=" * 50)
+    for test in (test_refresh_tracks_changes, test_schema_version_bump):
+        test()
+        print(f"✅ {test.__name__} 通过")
+    print("\n🎉 所有测试通过！")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+进程内明文缓存测试脚本
+校验调用方拿到的 buffer 与缓存隔离（原地修改不污染下一次命中）、字节预算下的 LRU 淘汰，
+以及内存压力下淘汰不释放内存时不会清空缓存、刚放入的条目保留
+"""
+
+import os
+
+from payload_cache import PayloadCache
+
+MB = 1024 * 1024
+
+def test_buffers_are_private():
+    """put 返回的 buffer 和每次 get 的结果都可写，修改后下一次命中仍是原始明文"""
+    cache = PayloadCache(10 * MB)
+    plain = os.urandom(MB + 3)
+    view = cache.put("a", bytearray(plain))
+    assert view is not None
+    view[0:5] = b"Jello"
+    for _ in range(2):
+        hit = cache.get("a")
+        assert bytes(hit) == plain
+        hit[0] ^= 0xFF
+    assert cache.stats()["hits"] == 2
+
+def test_budget_lru():
+    """超出预算按 LRU 淘汰，单个超出预算的不缓存"""
+    cache = PayloadCache(3 * MB)
+    for name in "abc":
+        assert cache.put(name, bytearray(MB)) is not None
+    cache.get("a")
+    cache.put("d", bytearray(MB))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("d") is not None
+    assert cache.put("big", bytearray(4 * MB)) is None
+    assert cache.stats()["bytes"] == 3 * MB
+    cache.invalidate()
+    assert cache.stats()["entries"] == 0 and cache.stats()["bytes"] == 0
+
+def test_pressure_stops_when_nothing_is_freed():
+    """可用内存一直低于阈值（明文仍被引用）时每次检查只淘汰一个就停止，刚放入的条目保留"""
+    cache = PayloadCache(10 * MB, min_available_bytes=MB, available_memory=lambda: 0)
+    assert cache.put("a", bytearray(MB)) is not None
+    assert cache.put("b", bytearray(MB)) is not None
+    assert cache.put("c", bytearray(MB)) is not None
+    stats = cache.stats()
+    assert stats["entries"] == 1 and stats["pressure_evictions"] == 2
+    assert cache.get("c") is not None
+    assert cache.stats()["entries"] == 1
+
+def test_pressure_evicts_while_memory_is_freed():
+    """淘汰能释放内存时一直淘汰到可用内存回到阈值以上"""
+    state = {"available": 0}
+
+    def available_memory():
+        return state["available"]
+
+    cache = PayloadCache(10 * MB, available_memory=available_memory)
+    for name in "abcd":
+        cache.put(name, bytearray(MB))
+    cache.min_available_bytes = 2 * MB
+    original_remove = cache._remove
+
+    def remove(model_id):
+        freed = original_remove(model_id)
+        state["available"] += freed
+        return freed
+
+    cache._remove = remove
+    assert cache.get("d") is not None
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["pressure_evictions"] == 2
+    assert cache.get("a") is None and cache.get("b") is None
+
+def main():
+    """主函数"""
+    print("🚀 进程内明文缓存测试")
+    print("=" * 50)
+    for test in (test_buffers_are_private, test_budget_lru, test_pressure_stops_when_nothing_is_freed,
+                 test_pressure_evicts_while_memory_is_freed):
+        test()
+        print(f"✅ {test.__name__} 通过")
+    print("\n🎉 所有测试通过！")
+
+if __name__ == "__main__":
+    main()
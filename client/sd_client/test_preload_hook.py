@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+加载前解密钩子端到端测试脚本
+用 tools/tensor_encryptor.py 加密一个小模型，经 modules.sd_models.read_state_dict 钩子加载，
+不替换 is_my_model：校验加密识别（标记 / 容器flag）、整块和部分加密的解密结果、
+非加密模型交给原函数、hybrid容器拒绝加载、解密还原出的明文不再被识别为加密模型，
+以及加标记后的 header 布局和给旧版无标记文件补标记（tools/mark_encrypted.py）
+"""
+
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import types
+
+import torch
+
+# test_helpers 把 tools 目录加进 sys.path，要先于 mark_encrypted 导入
+from test_helpers import KEY_HEX, encrypt_safetensors, make_work_dir, read_payload, write_safetensors
+import mark_encrypted
+from encryption_policy import EncryptionPolicy, dump_header, header_with_marker, header_without_encryption
+from xor_cipher import xor_stream
+
+WORK_DIR = make_work_dir("secure_loader_test_")
+TENSORS = {
+    "model.a.weight": torch.randn(64, 32, dtype=torch.float16),
+    "model.b.bias": torch.arange(10, dtype=torch.int64),
+    "model.c.weight": torch.randn(300, dtype=torch.bfloat16),
+}
+
+def install_webui_stubs():
+    """替换 WebUI 的 modules.script_callbacks / modules.sd_models，原 read_state_dict 只记录调用"""
+    modules = types.ModuleType("modules")
+    callbacks = types.ModuleType("modules.script_callbacks")
+    callbacks.on_model_loaded = lambda fn: None
+    sd_models = types.ModuleType("modules.sd_models")
+    sd_models.calls = []
+
+    def read_state_dict(checkpoint_file, print_global_state=False, map_location=None):
+        sd_models.calls.append(checkpoint_file)
+        return {"original": checkpoint_file}
+
+    sd_models.read_state_dict = read_state_dict
+    sd_models.get_state_dict_from_checkpoint = lambda pl_sd: pl_sd.pop("state_dict", pl_sd)
+    modules.script_callbacks = callbacks
+    modules.sd_models = sd_models
+    sys.modules["modules"] = modules
+    sys.modules["modules.script_callbacks"] = callbacks
+    sys.modules["modules.sd_models"] = sd_models
+    logging.getLogger("SecureModelLoader").addHandler(logging.NullHandler())
+    return sd_models
+
+SD_MODELS = install_webui_stubs()
+with contextlib.redirect_stdout(io.StringIO()):
+    import secure_loader
+secure_loader.MODEL_INDEX_FILE = os.path.join(WORK_DIR, "model_index.sqlite")
+secure_loader.METRICS_LOG_FILE = None
+# 没有许可证服务器，只替换取密钥这一步
+secure_loader.request_decryption_key = lambda model_path, logger=None, force_refresh=False: KEY_HEX
+
+def encrypt(name, policy=None):
+    return encrypt_safetensors(PLAIN_PATH, os.path.join(WORK_DIR, name), manifest=True, policy=policy)
+
+def write_container():
+    """开头带 ENCRYPT_FLAG（补\0到16字节）的 hybrid 容器，内容不需要能解密"""
+    path = os.path.join(WORK_DIR, "model.safetensors.enc")
+    with open(path, "wb") as f:
+        f.write(secure_loader.ENCRYPT_FLAG.ljust(16, b"\0") + os.urandom(256))
+    return path
+
+PLAIN_PATH = write_safetensors(os.path.join(WORK_DIR, "plain.safetensors"), TENSORS)
+
+def read_state_dict(path, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return SD_MODELS.read_state_dict(path, *args, **kwargs)
+
+def test_detects_encrypted_files():
+    """加密工具写出的文件、容器flag都能识别，有无模型索引结果一致"""
+    container = write_container()
+    encrypted = encrypt("detect")
+    for index_file in (secure_loader.MODEL_INDEX_FILE, None):
+        secure_loader.MODEL_INDEX_FILE = index_file
+        secure_loader._model_index = None
+        assert secure_loader.is_my_model(encrypted)
+        assert secure_loader.encryption_scheme(encrypted) == "xor"
+        assert secure_loader.encryption_scheme(container) == "container"
+        assert not secure_loader.is_my_model(PLAIN_PATH)
+    secure_loader.MODEL_INDEX_FILE = os.path.join(WORK_DIR, "model_index.sqlite")
+    secure_loader._model_index = None
+
+def test_hook_loads_encrypted_model():
+    """整块和部分加密的模型经钩子解密后与原tensor一致，且不调用原 read_state_dict"""
+    for name, policy in (("full", None), ("partial", EncryptionPolicy(fraction=0.5, block_size=512))):
+        SD_MODELS.calls.clear()
+        state_dict = read_state_dict(encrypt(name, policy))
+        assert SD_MODELS.calls == []
+        assert sorted(state_dict) == sorted(TENSORS)
+        for key, tensor in TENSORS.items():
+            assert torch.equal(state_dict[key], tensor)
+
+def test_hook_ignores_buffer_limit():
+    """设置了解密buffer上限时钩子仍整块解密，结果正确"""
+    secure_loader.DECRYPT_BUFFER_LIMIT = 1000
+    try:
+        state_dict = read_state_dict(encrypt("windowed"))
+    finally:
+        secure_loader.DECRYPT_BUFFER_LIMIT = 0
+    for key, tensor in TENSORS.items():
+        assert torch.equal(state_dict[key], tensor)
+
+def test_hook_passes_through_other_files():
+    """非加密模型交给原函数，hybrid容器拒绝加载"""
+    SD_MODELS.calls.clear()
+    assert read_state_dict(PLAIN_PATH, False, None) == {"original": PLAIN_PATH}
+    assert SD_MODELS.calls == [PLAIN_PATH]
+    container = write_container()
+    try:
+        read_state_dict(container)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("hybrid容器不应被钩子加载")
+
+def test_decrypted_file_is_plain():
+    """解密还原出的明文文件去掉了加密标记，不会再被当成加密模型"""
+    out_path = os.path.join(WORK_DIR, "decrypted.safetensors")
+    with contextlib.redirect_stdout(io.StringIO()):
+        secure_loader.decrypt_safetensors_file(encrypt("decrypt", EncryptionPolicy(fraction=0.5, block_size=512)),
+                                               out_path, KEY_HEX)
+    assert not secure_loader.is_my_model(out_path)
+    assert read_state_dict(out_path) == {"original": out_path}
+    assert read_payload(out_path) == read_payload(PLAIN_PATH)
+
+def test_marker_keeps_header_layout():
+    """加标记后 header 保持 key 顺序和 8 字节对齐，safetensors 写法的 header 去掉标记后逐字节还原"""
+    tensors = {"b": {"dtype": "U8", "shape": [3], "data_offsets": [0, 3]},
+               "a": {"dtype": "U8", "shape": [5], "data_offsets": [3, 8]}}
+    for header in ({"__metadata__": {"format": "pt"}, **tensors}, tensors):
+        original = dump_header(header)
+        marked = header_with_marker(original)
+        assert len(original) % 8 == 0 and len(marked) % 8 == 0
+        assert list(json.loads(marked)) == ["__metadata__", "b", "a"]
+        assert header_without_encryption(marked) == original
+        assert header_without_encryption(original) is original
+
+def test_marks_legacy_files():
+    """旧工具写出的无标记文件不被识别；mark_encrypted 补标记后经钩子解密正确，重复运行跳过"""
+    legacy = os.path.join(WORK_DIR, "legacy.safetensors")
+    with open(PLAIN_PATH, "rb") as fin, open(legacy, "wb") as fout:
+        header = fin.read(8)
+        fout.write(header)
+        fout.write(fin.read(int.from_bytes(header, "little")))
+        xor_stream(fin, fout, bytes.fromhex(KEY_HEX))
+    assert not secure_loader.is_my_model(legacy)
+    assert mark_encrypted.mark_file(legacy) == "marked"
+    assert mark_encrypted.mark_file(legacy) == "already"
+    assert mark_encrypted.mark_file(write_container()) == "container"
+    assert read_payload(legacy) == bytes(secure_loader.xor_bytes(read_payload(PLAIN_PATH), bytes.fromhex(KEY_HEX)))
+    assert secure_loader.is_my_model(legacy)
+    state_dict = read_state_dict(legacy)
+    for key, tensor in TENSORS.items():
+        assert torch.equal(state_dict[key], tensor)
+
+def main():
+    """主函数"""
+    print("🚀 加载前解密钩子端到端测试")
+    print("=" * 50)
+    for test in (test_detects_encrypted_files, test_hook_loads_encrypted_model, test_hook_ignores_buffer_limit,
+                 test_hook_passes_through_other_files, test_decrypted_file_is_plain, test_marker_keeps_header_layout,
+                 test_marks_legacy_files):
+        test()
+        print(f"✅ {test.__name__} 通过")
+    print("\n🎉 所有测试通过！")
+
+if __name__ == "__main__":
+    main()
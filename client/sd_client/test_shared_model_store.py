@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+跨进程共享模型存储测试脚本
+两个进程 acquire 同一个模型：只有第一个调用 build，第二个直接映射到相同数据、引用计数为 2，
+先释放的一方不删除共享内存段，最后一个释放时删除；持有引用的进程崩溃后计数不泄漏
+"""
+
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import shared_model_store
+from shared_model_store import SharedModelStore
+from test_helpers import make_work_dir
+
+WORK_DIR = make_work_dir("shared_model_store_test_")
+KEY = bytes.fromhex("00112233445566778899aabbccddeeff")
+SIZE = 3 * 4096 + 123
+PLAIN = bytes(i % 251 for i in range(SIZE))
+
+def fill(buffer):
+    """build 回调：写入可校验的字节模式"""
+    buffer[:] = PLAIN
+    return True
+
+def segment_exists(name):
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    shared_model_store._untrack(name)
+    shm.close()
+    return True
+
+def hold_model(store_dir, model_id, conn, release, crash):
+    """子进程：acquire 后报告结果，等待通知再释放；crash=True 时不释放直接退出"""
+    store = SharedModelStore(store_dir)
+    built = []
+
+    def build(buffer):
+        built.append(True)
+        return fill(buffer)
+
+    handle = store.acquire(model_id, KEY, SIZE, build)
+    conn.send((handle.created, bool(built), bytes(handle.buffer) == PLAIN))
+    if crash:
+        os._exit(0)
+    release.wait(30)
+    handle.release()
+
+def start_holder(store_dir, model_id, crash=False):
+    """启动持有模型的子进程，等它 acquire 完成，返回 (进程, 结果, 释放事件)"""
+    # Pipe 的 send 是同步写入，子进程紧接着 os._exit 也不会丢结果（Queue 靠后台线程发送）
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    release = multiprocessing.Event()
+    process = multiprocessing.Process(target=hold_model, args=(store_dir, model_id, sender, release, crash))
+    process.start()
+    if not receiver.poll(60):
+        raise AssertionError("子进程 acquire 超时")
+    return process, receiver.recv(), release
+
+def test_two_processes_share_one_segment():
+    """子进程构建并持有，本进程直接映射；计数随释放递减，最后一个释放时删除段和 .refs"""
+    store_dir = os.path.join(WORK_DIR, "share")
+    store = SharedModelStore(store_dir)
+    model_id = "model.safetensors|1|1"
+    name = store.entry_name(model_id, KEY)
+    process, child, release = start_holder(store_dir, model_id)
+    assert child == (True, True, True)
+
+    def build(buffer):
+        raise AssertionError("段已就绪，不应再次构建")
+
+    handle = store.acquire(model_id, KEY, SIZE, build)
+    assert not handle.created
+    assert bytes(handle.buffer) == PLAIN
+    assert store.refcount(model_id, KEY) == 2
+
+    release.set()
+    process.join(30)
+    assert process.exitcode == 0
+    assert store.refcount(model_id, KEY) == 1
+    assert segment_exists(name)
+
+    handle.release()
+    assert store.refcount(model_id, KEY) == 0
+    assert not segment_exists(name)
+    assert not os.path.exists(os.path.join(store_dir, name + ".refs"))
+
+def test_crashed_holder_does_not_leak():
+    """持有引用的进程没释放就退出：计数里不再算它，cleanup_stale 删除段"""
+    store_dir = os.path.join(WORK_DIR, "crash")
+    store = SharedModelStore(store_dir)
+    model_id = "crash.safetensors|1|1"
+    name = store.entry_name(model_id, KEY)
+    process, child, _ = start_holder(store_dir, model_id, crash=True)
+    assert child[0] and child[2]
+    process.join(30)
+    assert segment_exists(name)
+    assert store.refcount(model_id, KEY) == 0
+    assert store.cleanup_stale() == 1
+    assert not segment_exists(name)
+
+def main():
+    """主函数"""
+    print("🚀 跨进程共享模型存储测试")
+    print("=" * 50)
+    for test in (test_two_processes_share_one_segment, test_crashed_holder_does_not_leak):
+        test()
+        print(f"✅ {test.__name__} 通过")
+    print("\n🎉 所有测试通过！")
+
+if __name__ == "__main__":
+    main()
@@ -12,10 +12,15 @@ import platform
 import subprocess
 from typing import Dict, Any
 
+from license_client import LicenseClient
+
 # 测试配置
-SERVER_URL = "https://vercel-model-manager.vercel.app/api/verify-key"
+# 设置 LICENSE_SERVER_URL 可改为测试本地服务器（tools/fake_license_server.py）
+SERVER_URL = os.environ.get("LICENSE_SERVER_URL", "https://vercel-model-manager.vercel.app/api/verify-key")
 TEST_API_KEY = "APIKEY_wk_test_model_1_lv3s2cc4"  # 请填入测试用的API密钥
 TIMEOUT = 15
+CONNECT_TIMEOUT = 5
+MAX_RETRIES = 3
 
 def get_cpu_info() -> str:
     """获取CPU信息，支持Windows和Linux"""
@@ -125,17 +130,16 @@ def test_api_connection():
     try:
         # 发送请求
         print("⏳ 正在发送请求...")
-        response = requests.post(
-            SERVER_URL,
-            json=request_data,
-            timeout=TIMEOUT,
-            headers={
-                "Content-Type": "application/json",
-                "User-Agent": "SecureModelLoader-Test/1.0"
-            }
+        client = LicenseClient(
+            connect_timeout=CONNECT_TIMEOUT,
+            read_timeout=TIMEOUT,
+            max_retries=MAX_RETRIES,
+            user_agent="SecureModelLoader-Test/1.0"
         )
+        response = client.post_json(SERVER_URL, request_data)
         
         print(f"📥 响应状态码: {response.status_code}")
+        print(f"⏱️ 请求统计: {client.metrics()}")
         print(f"📋 响应头: {dict(response.headers)}")
         
         # 检查响应
@@ -180,7 +184,7 @@ def test_server_health():
     try:
         # 尝试访问根路径
         response = requests.get(
-            "https://vercel-model-manager.vercel.app/",
+            SERVER_URL.split("/api/")[0] + "/",
             timeout=10
         )
         print(f"✅ 服务器可访问，状态码: {response.status_code}")
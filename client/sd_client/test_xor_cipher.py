@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+xor_cipher 并行解密压力测试脚本
+校验多线程分块解密与逐字节参考实现结果完全一致，覆盖奇数长度尾块、块边界和任意起始偏移；
+部分加密（xor_ranges_into / xor_stream(ranges=...)）只异或范围内的字节
+"""
+
+import io
+import os
+import random
+
+import xor_cipher
+
+def reference_xor(data, key, offset=0):
+    """原逐字节实现，作为参考结果"""
+    return bytes([b ^ key[(i + offset) % len(key)] for i, b in enumerate(data)])
+
+def reference_xor_ranges(data, key, ranges, offset=0):
+    """逐字节参考实现：只异或流偏移落在 ranges 里的字节"""
+    return bytes([b ^ key[(i + offset) % len(key)] if any(s <= i + offset < e for s, e in ranges) else b
+                  for i, b in enumerate(data)])
+
+def random_ranges(rng, stream_len):
+    """stream_len 内升序、不重叠的随机范围，有时贴着流的起点"""
+    points = sorted(rng.sample(range(stream_len + 1), min(stream_len + 1, 2 * rng.randint(1, 6))))
+    ranges = [[points[i], points[i + 1]] for i in range(0, len(points) - 1, 2)]
+    if ranges and rng.random() < 0.3:
+        ranges[0][0] = 0
+    return ranges
+
+def test_parallel_matches_serial():
+    """随机长度/偏移/key长度下，并行结果与串行、参考实现一致"""
+    rng = random.Random(20250711)
+    chunk_size = 4096
+    for _ in range(200):
+        key = os.urandom(rng.choice([1, 3, 7, 16, 32, 33]))
+        # 围绕块边界取长度：整块、差一字节、多一字节以及随机奇数尾块
+        blocks = rng.randint(0, 6)
+        size = max(0, blocks * chunk_size + rng.choice([-1, 0, 1, rng.randint(1, chunk_size - 1)]))
+        offset = rng.randint(0, 10 ** 6)
+        data = os.urandom(size)
+        expected = reference_xor(data, key, offset)
+        serial = bytearray(size)
+        xor_cipher.xor_into(data, serial, key, offset)
+        parallel = bytearray(size)
+        xor_cipher.xor_into_parallel(data, parallel, key, offset,
+                                     workers=rng.randint(2, 8), chunk_size=chunk_size)
+        assert bytes(serial) == expected
+        assert bytes(parallel) == expected
+
+def test_parallel_inplace_roundtrip():
+    """原地并行加密再解密能还原明文"""
+    key = os.urandom(16)
+    data = os.urandom(3 * xor_cipher.PARALLEL_CHUNK_SIZE + 12345)
+    buf = bytearray(data)
+    xor_cipher.xor_inplace(buf, key, workers=4)
+    assert bytes(buf) != data
+    xor_cipher.xor_inplace(buf, key, workers=3)
+    assert bytes(buf) == data
+
+def test_ranges_match_reference():
+    """xor_ranges_into 原地/非原地、任意偏移和并行度下与参考实现一致，ranges=None 等同整段异或"""
+    rng = random.Random(20250712)
+    for _ in range(100):
+        key = os.urandom(rng.choice([1, 7, 16, 33]))
+        stream_len = rng.randint(1, 20000)
+        offset = rng.randint(0, stream_len - 1)
+        data = os.urandom(rng.randint(0, stream_len - offset))
+        ranges = random_ranges(rng, stream_len)
+        expected = reference_xor_ranges(data, key, ranges, offset)
+        out = bytearray(len(data))
+        xor_cipher.xor_ranges_into(data, out, key, ranges, offset, workers=rng.randint(1, 4))
+        assert bytes(out) == expected
+        buf = bytearray(data)
+        xor_cipher.xor_ranges_into(buf, buf, key, ranges, offset)
+        assert bytes(buf) == expected
+        full = bytearray(len(data))
+        xor_cipher.xor_ranges_into(data, full, key, None, offset)
+        assert bytes(full) == reference_xor(data, key, offset)
+
+def test_stream_ranges_match_reference():
+    """xor_stream(ranges=...) 跨 chunk 保持相位，范围外字节原样写出，hasher 拿到的是输出"""
+    import hashlib
+    rng = random.Random(20250713)
+    for _ in range(30):
+        key = os.urandom(16)
+        data = os.urandom(rng.randint(0, 30000))
+        offset = rng.randint(0, 100)
+        ranges = [[s + offset, e + offset] for s, e in random_ranges(rng, max(1, len(data)))]
+        fout = io.BytesIO()
+        md5 = hashlib.md5()
+        done = xor_cipher.xor_stream(io.BytesIO(data), fout, key, offset=offset,
+                                     chunk_size=rng.choice([1000, 4096, 7777]), hasher=md5, ranges=ranges)
+        expected = reference_xor_ranges(data, key, ranges, offset)
+        assert done == len(data)
+        assert fout.getvalue() == expected
+        assert md5.hexdigest() == hashlib.md5(expected).hexdigest()
+
+def test_stream_workers_match_reference():
+    """xor_stream 多线程异或（有无 hasher、有无 ranges、截断 length）与串行参考实现一致"""
+    import hashlib
+    rng = random.Random(20250714)
+    for _ in range(30):
+        key = os.urandom(rng.choice([7, 16]))
+        data = os.urandom(rng.randint(0, 30000))
+        offset = rng.randint(0, 100)
+        length = rng.choice([None, rng.randint(0, len(data))])
+        ranges = rng.choice([None, [[s + offset, e + offset] for s, e in random_ranges(rng, max(1, len(data)))]])
+        md5 = rng.choice([None, hashlib.md5()])
+        fout = io.BytesIO()
+        done = xor_cipher.xor_stream(io.BytesIO(data), fout, key, length=length, offset=offset,
+                                     chunk_size=rng.choice([1000, 4096]), hasher=md5, ranges=ranges,
+                                     workers=rng.randint(2, 4))
+        data = data if length is None else data[:length]
+        expected = reference_xor_ranges(data, key, ranges, offset) if ranges else reference_xor(data, key, offset)
+        assert done == len(data)
+        assert fout.getvalue() == expected
+        if md5 is not None:
+            assert md5.hexdigest() == hashlib.md5(expected).hexdigest()
+
+def test_keystream_cache_bounded():
+    """不断换 key 时 keystream 缓存不超过 KEYSTREAM_CACHE_KEYS 个，被淘汰的 key 重新生成后结果不变"""
+    keys = [os.urandom(16) for _ in range(3 * xor_cipher.KEYSTREAM_CACHE_KEYS)]
+    data = os.urandom(5000)
+    for _ in range(2):
+        for key in keys:
+            assert bytes(xor_cipher.xor_bytes(data, key, offset=7)) == reference_xor(data, key, 7)
+            assert len(xor_cipher._keystream_cache) <= xor_cipher.KEYSTREAM_CACHE_KEYS
+    assert list(xor_cipher._keystream_cache)[-1] == keys[-1]
+
+def test_empty_key_rejected():
+    """空 key 在串行和并行路径上都抛 ValueError"""
+    data = os.urandom(3 * 4096 + 5)
+    for workers in (1, 4):
+        try:
+            xor_cipher.xor_into_parallel(data, bytearray(len(data)), b"", workers=workers, chunk_size=4096)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("空 key 应当抛 ValueError")
+
+def main():
+    """主函数"""
+    print("🚀 xor_cipher 并行解密压力测试")
+    print("=" * 50)
+    for test in (test_parallel_matches_serial, test_parallel_inplace_roundtrip, test_ranges_match_reference,
+                 test_stream_ranges_match_reference, test_stream_workers_match_reference,
+                 test_keystream_cache_bounded, test_empty_key_rejected):
+        test()
+        print(f"✅ {test.__name__} 通过")
+    print("\n🎉 所有测试通过！")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+XOR 加解密公共模块
+
+secure_loader 以及 tools 下的加/解密脚本共用这一份实现，结果与原来的逐字节写法
+bytes([b ^ key[i % len(key)] for i, b in enumerate(data)]) 完全一致。
+
+- 把 key 平铺成 keystream 块并缓存，按块整体异或，不再逐字节循环
+- 装了 numpy 时走 numpy 向量化路径，否则退化为 Python 大整数按字宽异或
+- offset 参数表示 data[0] 在整个密文流中的字节偏移，用于从任意位置开始加/解密
+- workers > 1 时按 key 相位对齐切块，在线程池上并行异或（numpy 运算会释放 GIL）
+- xor_into_hashed 把解密和 hash / 逐块校验合成一遍：每块解密完趁还在 CPU 缓存里立即 hash
+- xor_ranges_into 只异或指定的字节范围（部分加密，见 encryption_policy.py）
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# numpy 在第一次加/解密时才导入，不拖慢 WebUI 扩展注册
+np = None
+_numpy_loaded = False
+
+def _load_numpy():
+    global np, _numpy_loaded
+    if not _numpy_loaded:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            np = None
+        _numpy_loaded = True
+    return np
+
+# keystream 块大小（会向下对齐到 key 长度的整数倍）
+KEYSTREAM_BLOCK = 1024 * 1024
+# 流式加/解密时每次读写的块大小
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+# 并行解密时每个任务处理的块大小
+PARALLEL_CHUNK_SIZE = 4 * 1024 * 1024
+# 解密+hash 融合时每块大小，尽量落在 CPU 缓存内
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# 最多缓存几个 key 的 keystream（每个约 KEYSTREAM_BLOCK 字节），超出时淘汰最久未用的
+KEYSTREAM_CACHE_KEYS = 4
+
+# key -> (块长度, keystream bytes, keystream numpy数组)，按最近使用排序
+_keystream_cache = OrderedDict()
+_keystream_lock = threading.Lock()
+
+def _keystream(key):
+    """
+    取 key 对应的 keystream 块：长度为 block + len(key)，
+    这样任意相位 phase 都能直接切 ks[phase:phase+block]
+    """
+    key = bytes(key)
+    with _keystream_lock:
+        cached = _keystream_cache.get(key)
+        if cached is not None:
+            _keystream_cache.move_to_end(key)
+            return cached
+    _load_numpy()
+    if not key:
+        raise ValueError("XOR key 不能为空")
+    klen = len(key)
+    block = max(klen, KEYSTREAM_BLOCK // klen * klen)
+    stream = key * (block // klen + 1)
+    stream_np = np.frombuffer(stream, dtype=np.uint8) if np is not None else None
+    cached = (block, stream, stream_np)
+    with _keystream_lock:
+        _keystream_cache[key] = cached
+        while len(_keystream_cache) > KEYSTREAM_CACHE_KEYS:
+            _keystream_cache.popitem(last=False)
+    return cached
+
+def clear_keystream_cache():
+    with _keystream_lock:
+        _keystream_cache.clear()
+
+def key_phase(offset, key):
+    """返回流中偏移 offset 处对应的 key 下标"""
+    return offset % len(key)
+
+def xor_into(src, dst, key, offset=0):
+    """
+    把 src 与 keystream 异或后写入 dst（二者长度相同，可以是同一块内存）
+    src: 任意 bytes-like；dst: 可写 buffer（bytearray / mmap / memoryview）
+    offset: src[0] 在整个密文流中的字节偏移
+    """
+    src = memoryview(src).cast("B")
+    dst = memoryview(dst).cast("B")
+    total = len(src)
+    if len(dst) != total:
+        raise ValueError(f"输出buffer长度不一致: {len(dst)} != {total}")
+    if total == 0:
+        return dst
+    block, stream, stream_np = _keystream(key)
+    phase = key_phase(offset, key)
+    pos = 0
+    while pos < total:
+        n = min(block, total - pos)
+        if stream_np is not None:
+            np.bitwise_xor(
+                np.frombuffer(src[pos:pos + n], dtype=np.uint8),
+                stream_np[phase:phase + n],
+                out=np.frombuffer(dst[pos:pos + n], dtype=np.uint8),
+            )
+        else:
+            value = int.from_bytes(src[pos:pos + n], "little") ^ int.from_bytes(stream[phase:phase + n], "little")
+            dst[pos:pos + n] = value.to_bytes(n, "little")
+        pos += n
+    return dst
+
+def xor_into_parallel(src, dst, key, offset=0, workers=None, chunk_size=PARALLEL_CHUNK_SIZE):
+    """
+    多线程版 xor_into：按 key 长度对齐切成 chunk_size 的区间，每个区间按自己的偏移算相位，
+    结果与串行完全一致。workers 为 None 时取 CPU 核数；没装 numpy 时虽然结果正确，
+    但大整数运算不释放 GIL，不会有加速
+    """
+    src = memoryview(src).cast("B")
+    dst = memoryview(dst).cast("B")
+    total = len(src)
+    if len(dst) != total:
+        raise ValueError(f"输出buffer长度不一致: {len(dst)} != {total}")
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or total <= chunk_size:
+        return xor_into(src, dst, key, offset)
+    if not key:
+        # 与串行版一致；不先检查的话下面 chunk_size // klen 会抛 ZeroDivisionError
+        raise ValueError("XOR key 不能为空")
+    klen = len(key)
+    step = max(klen, chunk_size // klen * klen)
+    _keystream(key)  # 先建好keystream缓存，避免各线程重复生成
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(xor_into, src[pos:pos + step], dst[pos:pos + step], key, offset + pos)
+            for pos in range(0, total, step)
+        ]
+        for future in futures:
+            future.result()
+    return dst
+
+def xor_into_hashed(src, dst, key, offset=0, hasher=None, chunk_check=None, chunk_size=HASH_CHUNK_SIZE,
+                    workers=1):
+    """
+    解密与校验合成一遍：按 chunk_size 逐块异或到 dst，每块写完立即喂给 hasher，
+    不再等整块解密完成后重新遍历一次内存。
+    hash 在单独的线程上按顺序执行（hashlib 对大块数据会释放 GIL），与下一块的异或重叠。
+    chunk_check(index, chunk): 可选的逐块校验回调（第 index 块，按 chunk_size 切分），
+    返回假值表示该块校验失败，之后的块不再解密（dst 里剩下的部分未定义）。
+    只有 chunk_check、没有 hasher 时各块互不依赖：workers > 1 时每块的异或+校验作为一个任务并行执行
+    """
+    src = memoryview(src).cast("B")
+    dst = memoryview(dst).cast("B")
+    total = len(src)
+    if len(dst) != total:
+        raise ValueError(f"输出buffer长度不一致: {len(dst)} != {total}")
+    if hasher is None and chunk_check is None:
+        return xor_into(src, dst, key, offset)
+    if hasher is None and workers > 1:
+        return _xor_into_checked_parallel(src, dst, key, offset, chunk_check, chunk_size, workers)
+
+    def consume(index, chunk):
+        if hasher is not None:
+            hasher.update(chunk)
+        return chunk_check is None or chunk_check(index, chunk)
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = None
+        for index, pos in enumerate(range(0, total, chunk_size)):
+            chunk = dst[pos:pos + chunk_size]
+            xor_into(src[pos:pos + chunk_size], chunk, key, offset + pos)
+            if pending is not None and not pending.result():
+                pending = None
+                break
+            pending = pool.submit(consume, index, chunk)
+        if pending is not None:
+            pending.result()
+    return dst
+
+def _xor_into_checked_parallel(src, dst, key, offset, chunk_check, chunk_size, workers):
+    failed = threading.Event()
+
+    def task(index, pos):
+        if failed.is_set():
+            return  # 已有块校验失败，剩下的块不再解密
+        chunk = dst[pos:pos + chunk_size]
+        xor_into(src[pos:pos + chunk_size], chunk, key, offset + pos)
+        if not chunk_check(index, chunk):
+            failed.set()
+
+    _keystream(key)  # 先建好keystream缓存，避免各线程重复生成
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(task, index, pos) for index, pos in enumerate(range(0, len(src), chunk_size))]
+        for future in futures:
+            future.result()
+    return dst
+
+def xor_ranges_into(src, dst, key, ranges, offset=0, workers=1):
+    """
+    只异或 ranges 覆盖的字节：src/dst 对应流中 [offset, offset + len) 这一段，
+    ranges 为流偏移的 [start, end) 列表（升序、不重叠），None 表示整段异或。
+    src 和 dst 不是同一个对象时，范围外的字节原样拷贝到 dst
+    """
+    inplace = src is dst
+    src = memoryview(src).cast("B")
+    dst = src if inplace else memoryview(dst).cast("B")
+    total = len(src)
+    if len(dst) != total:
+        raise ValueError(f"输出buffer长度不一致: {len(dst)} != {total}")
+    if ranges is None:
+        return xor_into_parallel(src, dst, key, offset, workers)
+    if not inplace:
+        dst[:] = src
+    end_offset = offset + total
+    for start, end in ranges:
+        if end <= offset:
+            continue
+        if start >= end_offset:
+            break
+        lo, hi = max(start, offset) - offset, min(end, end_offset) - offset
+        xor_into_parallel(dst[lo:hi], dst[lo:hi], key, offset + lo, workers)
+    return dst
+
+def xor_inplace(buf, key, offset=0, workers=1):
+    """原地异或可写 buffer"""
+    if workers == 1:
+        return xor_into(buf, buf, key, offset)
+    return xor_into_parallel(buf, buf, key, offset, workers)
+
+def xor_bytes(data, key, offset=0, workers=1):
+    """
+    异或并返回新的 bytearray，兼容原 xor_encrypt / xor_decrypt 的用法
+    （返回 bytearray 而不是 bytes，省掉一次整块拷贝）
+    """
+    out = bytearray(len(data))
+    if workers == 1:
+        xor_into(data, out, key, offset)
+    else:
+        xor_into_parallel(data, out, key, offset, workers)
+    return out
+
+def xor_stream(fin, fout, key, length=None, offset=0, chunk_size=DEFAULT_CHUNK_SIZE, hasher=None, input_hasher=None,
+               ranges=None, workers=1):
+    """
+    从 fin 读取、异或后写入 fout，内存占用恒定为一个 chunk（workers > 1 且有 hasher 时为两个）
+    length: 最多处理的字节数，None 表示读到文件末尾
+    offset: 第一个字节在密文流中的偏移，跨 chunk 自动保持 key 相位
+    hasher: 可选，对输出数据边解密边 hash
+    input_hasher: 可选，对异或前的输入数据 hash（加密时用于对明文建清单）
+    ranges: 可选，只异或这些流偏移范围（部分加密），其余字节原样写出
+    workers: 每个 chunk 的异或线程数；> 1 且有 hasher 时两个 buffer 轮换，hasher 在单独线程上
+             处理上一个 chunk，与下一个 chunk 的读取和异或重叠
+    返回实际处理的字节数
+    """
+    if workers > 1 and hasher is not None:
+        return _xor_stream_pipelined(fin, fout, key, length, offset, chunk_size, hasher, input_hasher, ranges,
+                                     workers)
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    done = 0
+    while length is None or done < length:
+        want = chunk_size if length is None else min(chunk_size, length - done)
+        n = fin.readinto(view[:want])
+        if not n:
+            break
+        if input_hasher is not None:
+            input_hasher.update(view[:n])
+        if ranges is not None:
+            chunk = view[:n]
+            xor_ranges_into(chunk, chunk, key, ranges, offset + done, workers)
+            if hasher is not None:
+                hasher.update(chunk)
+        elif hasher is None:
+            xor_inplace(view[:n], key, offset + done, workers)
+        else:
+            xor_into_hashed(view[:n], view[:n], key, offset + done, hasher=hasher)
+        fout.write(view[:n])
+        done += n
+    return done
+
+def _xor_stream_pipelined(fin, fout, key, length, offset, chunk_size, hasher, input_hasher, ranges, workers):
+    """xor_stream 的多线程版：每个 chunk 多线程异或，hash 上一个 chunk 与之重叠"""
+    views = [memoryview(bytearray(chunk_size)), memoryview(bytearray(chunk_size))]
+    done = 0
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = None
+        while length is None or done < length:
+            want = chunk_size if length is None else min(chunk_size, length - done)
+            # pending 在另一个 buffer 上，这里可以直接覆盖当前 buffer
+            chunk = views[0][:fin.readinto(views[0][:want])]
+            if not chunk:
+                break
+            if input_hasher is not None:
+                input_hasher.update(chunk)
+            xor_ranges_into(chunk, chunk, key, ranges, offset + done, workers)
+            if pending is not None:
+                pending.result()
+            pending = pool.submit(hasher.update, chunk)
+            fout.write(chunk)
+            done += len(chunk)
+            views.reverse()
+        if pending is not None:
+            pending.result()
+    return done
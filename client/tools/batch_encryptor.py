@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+批量加密工具
+
+发布一个模型包时不用再写脚本逐个串行调用 model_encryptor / tensor_encryptor：
+- 输入可以是目录（递归）或 glob，多个文件用进程池并发加密
+- 输出目录下保持相对目录结构，并写 batch_manifest.json 记录每个文件的输出、key、hash、吞吐
+- 每完成一个文件就原子地重写一次清单；中途崩溃后重新运行同一命令会跳过已完成且校验通过的输出
+- 打印每个文件和整体的 MB/s
+
+注意：xor 模式下清单里有明文 key，和 key 一样妥善保管。
+
+用法:
+    python batch_encryptor.py <输入目录或glob>... -o <输出目录> [--mode xor|hybrid] [--workers N]
+"""
+
+import argparse
+import contextlib
+import glob
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sd_client"))
+import model_encryptor
+import tensor_encryptor
+from xor_cipher import DEFAULT_CHUNK_SIZE
+from encryption_policy import is_encrypted_metadata
+
+# ========== 配置 ========== #
+MANIFEST_NAME = "batch_manifest.json"
+MODEL_EXTENSIONS = (".safetensors", ".ckpt", ".pt")
+# 默认并发数上限：单块盘上同时读写的流太多反而更慢，SSD/阵列可用 --workers 调大
+DEFAULT_MAX_WORKERS = 4
+
+# ========== 工具函数 ========== #
+def file_sha256(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def is_encrypted_file(path):
+    """开头带 ENCRYPT_FLAG 的 hybrid 容器，或 __metadata__ 带加密标记的 xor safetensors"""
+    flag = model_encryptor.ENCRYPT_FLAG
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(flag)) == flag:
+                return True
+            if not path.lower().endswith(".safetensors"):
+                return False
+            f.seek(0)
+            header = json.loads(f.read(int.from_bytes(f.read(8), "little")))
+    except (OSError, ValueError):
+        return False
+    return isinstance(header, dict) and is_encrypted_metadata(header.get("__metadata__"))
+
+def _is_under(path, directory):
+    path, directory = os.path.realpath(path), os.path.realpath(directory)
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+def collect_inputs(patterns, extensions=MODEL_EXTENSIONS, exclude_dir=None):
+    """
+    展开目录（递归）和 glob，返回去重排序后的模型文件绝对路径。
+    exclude_dir（输出目录）下的文件和已经加密过的文件不收集：输出目录放在输入目录下面时
+    （models/ -> models/encrypted/），重新运行不会把上次的输出再加密一遍
+    """
+    files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, names in os.walk(pattern):
+                if exclude_dir:
+                    dirs[:] = [d for d in dirs if not _is_under(os.path.join(root, d), exclude_dir)]
+                files.update(os.path.join(root, n) for n in names if n.lower().endswith(extensions))
+        else:
+            files.update(p for p in glob.glob(pattern, recursive=True)
+                         if os.path.isfile(p) and p.lower().endswith(extensions))
+    if exclude_dir:
+        files = {p for p in files if not _is_under(p, exclude_dir)}
+    return sorted(os.path.abspath(p) for p in files if not is_encrypted_file(p))
+
+def default_workers(jobs):
+    return max(1, min(jobs, os.cpu_count() or 1, DEFAULT_MAX_WORKERS))
+
+def load_manifest(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"files": {}}
+
+def save_manifest(path, manifest):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def is_complete(entry, source, verify=True):
+    """清单条目对应的源文件没变、输出存在且（verify时）sha256一致，才算已完成"""
+    if not entry or entry.get("status") != "ok":
+        return False
+    try:
+        st = os.stat(source)
+        if (st.st_size, st.st_mtime_ns) != (entry["source_size"], entry["source_mtime_ns"]):
+            return False
+        if os.path.getsize(entry["output"]) != entry["output_size"]:
+            return False
+    except (OSError, KeyError):
+        return False
+    return not verify or file_sha256(entry["output"]) == entry["output_sha256"]
+
+# ========== 单文件任务（子进程中执行） ========== #
+def encrypt_one(job):
+    """
+    加密一个文件，返回清单条目；加密工具自己的打印输出收集到 log 字段，避免多进程输出交错
+    """
+    source, out_dir = job["source"], job["out_dir"]
+    os.makedirs(out_dir, exist_ok=True)
+    st = os.stat(source)
+    entry = {"source": source, "source_size": st.st_size, "source_mtime_ns": st.st_mtime_ns, "mode": job["mode"]}
+    log = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(log):
+        ext = os.path.splitext(source)[1].lower()
+        if job["mode"] == "hybrid":
+            output, meta = model_encryptor.encrypt_hybrid(source, out_dir, job["pub"], chunk_size=job["chunk_size"])
+            entry["container_version"] = meta["version"]
+        elif ext == ".safetensors":
+            entry["key"], _, _, _ = model_encryptor.encrypt_safetensors(
+                source, out_dir, custom_key=job["key"], chunk_size=job["chunk_size"], manifest=job["manifest"])
+            output = os.path.join(out_dir, os.path.basename(source))
+        else:
+            entry["key"] = job["key"] or tensor_encryptor.random_key(16)
+            output = tensor_encryptor.encrypt_model(source, out_dir, entry["key"], chunk_size=job["chunk_size"],
+                                                    manifest=job["manifest"], to_safetensors=job["to_safetensors"])
+    elapsed = time.perf_counter() - start
+    entry.update({
+        "output": output,
+        "output_size": os.path.getsize(output),
+        "output_sha256": file_sha256(output, job["chunk_size"]),
+        "seconds": round(elapsed, 3),
+        "mb_s": round(st.st_size / 1024**2 / max(elapsed, 1e-9), 1),
+        "status": "ok",
+        "log": log.getvalue().strip(),
+    })
+    return entry
+
+# ========== 主流程 ========== #
+def run_batch(inputs, output_dir, mode="xor", key=None, pub=model_encryptor.RSA_PUBLIC_KEY_PATH,
+              workers=None, chunk_size=DEFAULT_CHUNK_SIZE, manifest=False, to_safetensors=False, verify=True):
+    """批量加密，返回清单 dict；单个文件失败不影响其他文件，失败记录在清单里"""
+    sources = collect_inputs(inputs, exclude_dir=output_dir)
+    if not sources:
+        print("没有找到模型文件")
+        return {"files": {}}
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    batch = load_manifest(manifest_path)
+    entries = batch.setdefault("files", {})
+    root = os.path.commonpath([os.path.dirname(p) for p in sources])
+
+    jobs = []
+    for source in sources:
+        rel = os.path.relpath(source, root)
+        if is_complete(entries.get(rel), source, verify):
+            print(f"⏭️ 已完成，跳过: {rel}")
+            continue
+        jobs.append({
+            "rel": rel, "source": source, "out_dir": os.path.join(output_dir, os.path.dirname(rel)),
+            "mode": mode, "key": key, "pub": pub, "chunk_size": chunk_size,
+            "manifest": manifest, "to_safetensors": to_safetensors,
+        })
+    if not jobs:
+        print("全部文件已完成")
+        return batch
+
+    workers = workers or default_workers(len(jobs))
+    print(f"🚀 开始批量加密: {len(jobs)} 个文件（跳过 {len(sources) - len(jobs)} 个），{workers} 个进程")
+    start = time.perf_counter()
+    done_bytes = 0
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(encrypt_one, job): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                entry = future.result()
+                done_bytes += entry["source_size"]
+                print(f"✅ {job['rel']}: {entry['source_size'] / 1024**2:.1f} MB, "
+                      f"{entry['seconds']:.2f}s, {entry['mb_s']:.1f} MB/s")
+            except Exception as e:
+                failed += 1
+                entry = {"source": job["source"], "mode": mode, "status": "failed", "error": str(e)}
+                print(f"❌ {job['rel']}: {str(e)}")
+            entries[job["rel"]] = entry
+            save_manifest(manifest_path, batch)
+    elapsed = time.perf_counter() - start
+    print(f"📊 完成 {len(jobs) - failed}/{len(jobs)} 个文件，共 {done_bytes / 1024**2:.1f} MB，"
+          f"耗时 {elapsed:.2f}s，整体 {done_bytes / 1024**2 / max(elapsed, 1e-9):.1f} MB/s")
+    print(f"清单: {manifest_path}")
+    return batch
+
+def main():
+    parser = argparse.ArgumentParser(description="批量并发加密模型目录，支持断点续跑")
+    parser.add_argument("inputs", nargs="+", help="模型目录（递归）或glob")
+    parser.add_argument("-o", "--output", required=True, help="输出目录（保持相对目录结构）")
+    parser.add_argument("--mode", choices=["xor", "hybrid"], default="xor", help="xor: 每个文件随机key; hybrid: AES-CTR容器")
+    parser.add_argument("--key", type=str, help="所有文件使用同一个32位hex key（仅xor模式，默认每个文件随机）")
+    parser.add_argument("--pub", type=str, default=model_encryptor.RSA_PUBLIC_KEY_PATH, help="RSA公钥路径（仅hybrid模式）")
+    parser.add_argument("--workers", type=int, default=None, help=f"并发进程数（默认 min(CPU核数, {DEFAULT_MAX_WORKERS})）")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE // 1024**2, help="流式加密块大小（MB）")
+    parser.add_argument("--manifest", action="store_true", help="写入分块完整性清单（xor模式）")
+    parser.add_argument("--to-safetensors", action="store_true", help="ckpt/pt 转换为加密safetensors")
+    parser.add_argument("--no-verify", action="store_true", help="续跑时只比较大小，不重新计算已完成输出的sha256")
+    args = parser.parse_args()
+
+    if args.key and len(args.key) != 32:
+        print("自定义key必须是32位hex字符串（16字节）")
+        sys.exit(1)
+    batch = run_batch(args.inputs, args.output, mode=args.mode, key=args.key, pub=args.pub, workers=args.workers,
+                      chunk_size=args.chunk_size * 1024**2, manifest=args.manifest,
+                      to_safetensors=args.to_safetensors, verify=not args.no_verify)
+    if any(e.get("status") != "ok" for e in batch["files"].values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+"""
+离线基准测试：加密/解密/加载吞吐与峰值内存
+
+不访问许可证服务器，也不需要 WebUI：
+- 自动生成合成的 safetensors / ckpt 文件（默认 10MB、100MB，可用 --sizes 指定到 GB 级）
+- modules.script_callbacks 用桩模块替换，sd_model 用假对象，request_decryption_key 直接返回测试 key
+- 每个用例在独立的 spawn 子进程里跑，记录准备完成后的基线 RSS 和运行期间的峰值 RSS（VmHWM / ru_maxrss）
+- partial_load 按 --coverages 里的每个覆盖率生成部分加密文件（EncryptionPolicy 均匀选块），
+  分别记为 partial_load_<百分比>，比较 on_model_loaded 的耗时和内存
+  （这些文件不带 model_md5，只统计解密本身；范围外的明文页由使用方按需读取，不计入）
+- 结果写成 JSON；--compare 与旧结果比较，吞吐下降或峰值内存增长超过 --tolerance 时返回非0
+
+用法:
+    python benchmark.py [--sizes 10,100,1024] [--cases xor_encrypt,on_model_loaded] [--repeat 3]
+                        [--coverages 1,0.5,0.25,0.1] [--output bench.json] [--compare baseline.json]
+                        [--tolerance 0.15]
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+SD_CLIENT_DIR = os.path.join(TOOLS_DIR, "..", "sd_client")
+sys.path.insert(0, TOOLS_DIR)
+sys.path.insert(0, SD_CLIENT_DIR)
+from load_metrics import current_rss_mb, peak_rss_mb, reset_peak_rss
+
+# ========== 配置 ========== #
+DEFAULT_SIZES_MB = [10, 100]
+DEFAULT_REPEAT = 3
+TENSOR_MB = 16  # 合成文件里每个tensor的大小
+METADATA_CALLS = 1000  # read_safetensors_metadata 每轮调用次数
+DEFAULT_COVERAGES = [1.0, 0.5, 0.25, 0.1]  # partial_load 的加密覆盖率
+XOR_KEY = bytes.fromhex("3f40bba6a0444dcd887f6e7c5afa3dee")
+ENCRYPT_FLAG = b'WK_ENCRYPTED_v1'
+FLAG_SIZE = 16
+
+# ========== 合成数据 ========== #
+def write_random(f, size, chunk_size=16 * 1024**2):
+    left = size
+    while left > 0:
+        n = min(chunk_size, left)
+        f.write(os.urandom(n))
+        left -= n
+
+def make_safetensors(path, size):
+    """F16 tensor 组成的 safetensors，数据为随机字节"""
+    tensor_bytes = TENSOR_MB * 1024**2
+    header = {"__metadata__": {"format": "pt", "modelspec.title": "benchmark"}}
+    offset = 0
+    index = 0
+    while offset < size:
+        n = min(tensor_bytes, size - offset) // 2 * 2 or 2
+        header[f"model.layer{index}.weight"] = {"dtype": "F16", "shape": [n // 2], "data_offsets": [offset, offset + n]}
+        offset += n
+        index += 1
+    header_bytes = json.dumps(header).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(len(header_bytes).to_bytes(8, "little"))
+        f.write(header_bytes)
+        write_random(f, offset)
+    return offset
+
+def make_encrypted_safetensors(plain_path, path):
+    """与 tensor_encryptor 相同的格式（含加密标记），header 里带 model_md5 以覆盖加载时的校验"""
+    from xor_cipher import xor_stream
+    from encryption_policy import header_with_marker
+    with open(plain_path, "rb") as fin:
+        header_len = int.from_bytes(fin.read(8), "little")
+        header = json.loads(fin.read(header_len))
+        md5 = hashlib.md5()
+        for chunk in iter(lambda: fin.read(16 * 1024**2), b""):
+            md5.update(chunk)
+        header["model_md5"] = md5.hexdigest()
+        header_bytes = header_with_marker(json.dumps(header).encode("utf-8"))
+        fin.seek(8 + header_len)
+        with open(path, "wb") as fout:
+            fout.write(len(header_bytes).to_bytes(8, "little"))
+            fout.write(header_bytes)
+            xor_stream(fin, fout, XOR_KEY)
+
+def make_partial_encrypted(plain_path, out_dir, coverage):
+    """用 tensor_encryptor 的部分加密策略均匀加密 coverage 比例的块"""
+    import tensor_encryptor
+    from encryption_policy import EncryptionPolicy
+    os.makedirs(out_dir, exist_ok=True)
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        return tensor_encryptor.encrypt_safetensors(plain_path, out_dir, XOR_KEY.hex(),
+                                                    policy=EncryptionPolicy(fraction=coverage))
+
+def coverage_case(coverage):
+    return f"partial_load_{round(coverage * 100)}"
+
+def make_ckpt(path, size):
+    import torch
+    tensor_elems = TENSOR_MB * 1024**2 // 2
+    state_dict = {}
+    left = size // 2
+    index = 0
+    while left > 0:
+        n = min(tensor_elems, left)
+        state_dict[f"model.layer{index}.weight"] = torch.randn(n, dtype=torch.float16)
+        left -= n
+        index += 1
+    torch.save({"state_dict": state_dict, "epoch": 0}, path)
+
+def make_cfb_container(plain_path, path):
+    """旧版 hybrid（AES-CFB）容器，返回 aes_decrypt_file 需要的参数"""
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    key, iv = os.urandom(32), os.urandom(16)
+    encryptor = Cipher(algorithms.AES(key), modes.CFB(iv)).encryptor()
+    with open(plain_path, "rb") as fin, open(path, "wb") as fout:
+        fout.write(ENCRYPT_FLAG.ljust(FLAG_SIZE, b"\0"))
+        for chunk in iter(lambda: fin.read(16 * 1024**2), b""):
+            fout.write(encryptor.update(chunk))
+        fout.write(encryptor.finalize())
+        meta = json.dumps({"mode": "hybrid"}).encode("utf-8")
+        fout.write(b"__META__")
+        fout.write(meta)
+    return {"key": key.hex(), "iv": iv.hex(), "meta_len": len(meta) + len(b"__META__")}
+
+def prepare_files(work_dir, size_mb, cases, coverages=DEFAULT_COVERAGES):
+    """按用例需要生成合成文件，返回文件信息 dict"""
+    size = size_mb * 1024**2
+    files = {"size": size, "work_dir": work_dir}
+    files["safetensors"] = os.path.join(work_dir, f"plain_{size_mb}mb.safetensors")
+    make_safetensors(files["safetensors"], size)
+    if {"on_model_loaded", "read_safetensors_metadata"} & set(cases):
+        files["encrypted"] = os.path.join(work_dir, f"enc_{size_mb}mb.safetensors")
+        make_encrypted_safetensors(files["safetensors"], files["encrypted"])
+    if "encrypt_ckpt_pt" in cases:
+        files["ckpt"] = os.path.join(work_dir, f"plain_{size_mb}mb.ckpt")
+        make_ckpt(files["ckpt"], size)
+    if "aes_decrypt_file" in cases:
+        files["cfb"] = os.path.join(work_dir, f"cfb_{size_mb}mb.enc")
+        files["cfb_params"] = make_cfb_container(files["safetensors"], files["cfb"])
+    if any(case.startswith("partial_load") for case in cases):
+        files["partial"] = {coverage_case(c): make_partial_encrypted(
+            files["safetensors"], os.path.join(work_dir, coverage_case(c)), c) for c in coverages}
+    return files
+
+def cleanup_files(files):
+    """只删除本次生成的文件，--work-dir 里的其他内容不动"""
+    work_dir = files["work_dir"]
+    shutil.rmtree(os.path.join(work_dir, "out"), ignore_errors=True)
+    for case in files.get("partial", {}):
+        shutil.rmtree(os.path.join(work_dir, case), ignore_errors=True)
+    paths = [files.get(k) for k in ("safetensors", "encrypted", "ckpt", "cfb")]
+    paths += [os.path.join(work_dir, "model_index.sqlite" + suffix) for suffix in ("", "-wal", "-shm")]
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+# ========== 子进程中的用例 ========== #
+def install_webui_stubs():
+    """替换 WebUI 的 modules.script_callbacks，并让 secure_loader 的日志不落盘"""
+    modules = types.ModuleType("modules")
+    callbacks = types.ModuleType("modules.script_callbacks")
+    callbacks.on_model_loaded = lambda fn: None
+    modules.script_callbacks = callbacks
+    sys.modules.setdefault("modules", modules)
+    sys.modules.setdefault("modules.script_callbacks", callbacks)
+    logging.getLogger("SecureModelLoader").addHandler(logging.NullHandler())
+
+def import_secure_loader(work_dir):
+    install_webui_stubs()
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        import secure_loader
+    secure_loader.MODEL_INDEX_FILE = os.path.join(work_dir, "model_index.sqlite")
+    secure_loader.request_decryption_key = lambda model_path, logger=None, force_refresh=False: XOR_KEY.hex()
+    return secure_loader
+
+def setup_case(case, files):
+    """导入依赖、准备输入，返回无参的被测函数和单轮处理字节数（None表示按次数统计）"""
+    size = files["size"]
+    out_dir = os.path.join(files["work_dir"], "out")
+    os.makedirs(out_dir, exist_ok=True)
+    if case == "xor_encrypt":
+        import model_encryptor
+        data = os.urandom(size)
+        return lambda: model_encryptor.xor_encrypt(data, XOR_KEY), size
+    if case == "xor_decrypt":
+        sl = import_secure_loader(files["work_dir"])
+        data = os.urandom(size)
+        return lambda: sl.xor_decrypt(data, XOR_KEY), size
+    if case == "encrypt_safetensors":
+        import model_encryptor
+        return lambda: model_encryptor.encrypt_safetensors(files["safetensors"], out_dir, custom_key=XOR_KEY.hex()), size
+    if case == "encrypt_ckpt_pt":
+        import tensor_encryptor
+        import torch  # noqa: F401  导入开销不计入
+        return lambda: tensor_encryptor.encrypt_ckpt_pt(files["ckpt"], out_dir, XOR_KEY.hex()), size
+    if case == "aes_decrypt_file":
+        import model_decryptor
+        params = files["cfb_params"]
+        out_path = os.path.join(out_dir, "cfb.safetensors")
+        return lambda: model_decryptor.aes_decrypt_file(
+            files["cfb"], out_path, bytes.fromhex(params["key"]), bytes.fromhex(params["iv"]),
+            params["meta_len"], data_offset=FLAG_SIZE), size
+    if case == "read_safetensors_metadata":
+        sl = import_secure_loader(files["work_dir"])
+
+        def run():
+            for _ in range(METADATA_CALLS):
+                sl.read_safetensors_metadata(files["encrypted"])
+        return run, None
+    if case == "on_model_loaded":
+        sl = import_secure_loader(files["work_dir"])
+        sd_model = types.SimpleNamespace(sd_checkpoint_info=types.SimpleNamespace(filename=files["encrypted"]))
+        return lambda: sl.on_model_loaded(sd_model), size
+    if case in files.get("partial", {}):
+        sl = import_secure_loader(files["work_dir"])
+        sd_model = types.SimpleNamespace(sd_checkpoint_info=types.SimpleNamespace(filename=files["partial"][case]))
+        return lambda: sl.on_model_loaded(sd_model), size
+    raise ValueError(f"未知用例: {case}")
+
+def run_case(case, files):
+    """子进程入口：准备完成后记录基线RSS，跑一轮被测函数，返回耗时和峰值RSS"""
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        fn, nbytes = setup_case(case, files)
+        reset_peak_rss()
+        baseline = current_rss_mb()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+    return {"seconds": elapsed, "bytes": nbytes, "baseline_rss_mb": baseline, "peak_rss_mb": peak_rss_mb()}
+
+# ========== 汇总 ========== #
+CASES = ["xor_encrypt", "xor_decrypt", "encrypt_safetensors", "encrypt_ckpt_pt",
+         "aes_decrypt_file", "read_safetensors_metadata", "on_model_loaded", "partial_load"]
+
+def environment_info():
+    info = {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count()}
+    for name in ("numpy", "torch", "cryptography"):
+        try:
+            info[name] = __import__(name).__version__
+        except ImportError:
+            info[name] = None
+    return info
+
+def expand_cases(cases, coverages):
+    """partial_load 展开为每个覆盖率一个用例"""
+    expanded = []
+    for case in cases:
+        expanded += [coverage_case(c) for c in coverages] if case == "partial_load" else [case]
+    return expanded
+
+def run_benchmarks(sizes_mb, cases, repeat=DEFAULT_REPEAT, work_dir=None, coverages=DEFAULT_COVERAGES):
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    own_dir = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="secure_loader_bench_")
+    try:
+        for size_mb in sizes_mb:
+            print(f"📦 生成 {size_mb} MB 合成模型...")
+            files = prepare_files(work_dir, size_mb, cases, coverages)
+            for case in expand_cases(cases, coverages):
+                runs = []
+                for _ in range(repeat):
+                    with ctx.Pool(1) as pool:
+                        runs.append(pool.apply(run_case, (case, files)))
+                best = min(runs, key=lambda r: r["seconds"])
+                result = {
+                    "case": case,
+                    "size_mb": size_mb,
+                    "seconds": round(best["seconds"], 4),
+                    "peak_rss_mb": round(max(r["peak_rss_mb"] for r in runs), 1),
+                    "rss_delta_mb": round(max(r["peak_rss_mb"] - r["baseline_rss_mb"] for r in runs), 1),
+                }
+                if best["bytes"]:
+                    result["mb_s"] = round(best["bytes"] / 1024**2 / max(best["seconds"], 1e-9), 1)
+                else:
+                    result["ops_s"] = round(METADATA_CALLS / max(best["seconds"], 1e-9), 1)
+                results.append(result)
+                speed = f"{result['mb_s']} MB/s" if "mb_s" in result else f"{result['ops_s']} ops/s"
+                print(f"  {case:<28} {result['seconds']:>8.3f}s  {speed:>16}  "
+                      f"peak {result['peak_rss_mb']:.0f} MB (+{result['rss_delta_mb']:.0f} MB)")
+            cleanup_files(files)
+    finally:
+        if own_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "environment": environment_info(),
+            "repeat": repeat, "results": results}
+
+def compare_results(current, baseline, tolerance):
+    """返回回归列表：吞吐下降或峰值内存增长超过 tolerance（比例）"""
+    old = {(r["case"], r["size_mb"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for r in current["results"]:
+        prev = old.get((r["case"], r["size_mb"]))
+        if prev is None:
+            continue
+        for metric in ("mb_s", "ops_s"):
+            if metric in r and prev.get(metric) and r[metric] < prev[metric] * (1 - tolerance):
+                regressions.append(f"{r['case']}@{r['size_mb']}MB {metric}: {prev[metric]} -> {r[metric]}")
+        if prev.get("rss_delta_mb", 0) > 1 and r["rss_delta_mb"] > prev["rss_delta_mb"] * (1 + tolerance):
+            regressions.append(f"{r['case']}@{r['size_mb']}MB rss_delta_mb: {prev['rss_delta_mb']} -> {r['rss_delta_mb']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="加密/解密/加载离线基准测试")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES_MB)), help="合成模型大小（MB），逗号分隔")
+    parser.add_argument("--cases", default=",".join(CASES), help="要跑的用例，逗号分隔")
+    parser.add_argument("--coverages", default=",".join(map(str, DEFAULT_COVERAGES)),
+                        help="partial_load 的加密覆盖率（0~1），逗号分隔")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="每个用例重复次数（取最快一次）")
+    parser.add_argument("--work-dir", default=None, help="合成文件目录（默认临时目录，跑完删除）")
+    parser.add_argument("--output", default=None, help="结果JSON路径")
+    parser.add_argument("--compare", default=None, help="基线结果JSON，发现回归时返回非0")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="允许的回归比例")
+    args = parser.parse_args()
+
+    cases = [c for c in args.cases.split(",") if c]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        print(f"未知用例: {', '.join(sorted(unknown))}，可选: {', '.join(CASES)}")
+        sys.exit(1)
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+    coverages = [float(c) for c in args.coverages.split(",") if c]
+    report = run_benchmarks([int(s) for s in args.sizes.split(",")], cases, args.repeat, args.work_dir, coverages)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"结果已写入: {args.output}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare_results(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"❌ 回归: {line}")
+        if regressions:
+            sys.exit(1)
+        print("✅ 与基线相比没有超过阈值的回归")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+可随机访问的 hybrid 容器（version 2，AES-256-CTR）
+
+旧的 hybrid 模式用 AES-CFB，解密每一块都依赖前一块密文，只能串行、不能跳读。
+version 2 改用计数器模式：第 i 个 16 字节分组的计数器 = nonce + i，任意字节偏移都能
+直接算出计数器，所以可以按 chunk 多进程并行解密，也可以只解密某一段字节。
+
+文件布局与旧格式一致：
+    [16字节flag][AES-CTR 密文][__META__][json 元数据]
+元数据新增字段:
+    version=2, cipher="aes-256-ctr", nonce, chunk_size,
+    data_offset（密文在文件中的起始偏移）, tensor_data_offset（明文中 tensor 数据起始偏移）
+旧 CFB 文件没有 version 字段，仍由 model_decryptor.aes_decrypt_file 解密。
+"""
+
+import os
+from base64 import b64decode
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+CONTAINER_VERSION = 2
+CIPHER_NAME = "aes-256-ctr"
+DEFAULT_CTR_CHUNK_SIZE = 4 * 1024 * 1024
+BLOCK = 16
+
+def is_ctr_container(meta):
+    return meta.get("mode") == "hybrid" and meta.get("version", 1) >= CONTAINER_VERSION
+
+def tensor_data_offset(model_path):
+    """明文safetensors的tensor数据起始偏移（8 + header长度）；不是safetensors时返回0"""
+    with open(model_path, "rb") as f:
+        header_len = int.from_bytes(f.read(8), "little")
+        if header_len <= 2 or f.read(2) not in (b'{"', b"{'"):
+            return 0
+    return 8 + header_len
+
+def ctr_context(key, nonce, offset):
+    """返回定位到流偏移 offset 的 CTR 上下文"""
+    nonce = b64decode(nonce) if isinstance(nonce, str) else nonce
+    counter = (int.from_bytes(nonce, "big") + offset // BLOCK) % (1 << 128)
+    ctx = Cipher(algorithms.AES(key), modes.CTR(counter.to_bytes(BLOCK, "big"))).encryptor()
+    skip = offset % BLOCK
+    if skip:
+        ctx.update(b"\0" * skip)
+    return ctx
+
+def ctr_transform(data, key, nonce, offset=0):
+    """CTR 加/解密（同一操作），data 在整个流中从 offset 开始"""
+    return ctr_context(key, nonce, offset).update(data)
+
+def _decrypt_chunk(path, key, nonce, data_offset, start, length):
+    """子进程/线程任务：读取并解密流中 [start, start+length) 这一段"""
+    with open(path, "rb") as f:
+        f.seek(data_offset + start)
+        data = f.read(length)
+    return ctr_transform(data, key, nonce, start)
+
+def read_plain_range(enc_path, key, meta, start, end):
+    """随机访问：只解密明文 [start, end) 这段字节"""
+    return _decrypt_chunk(enc_path, key, meta["nonce"], meta["data_offset"], start, end - start)
+
+def decrypt_container(enc_path, output_path, key, meta, data_len, workers=None, hasher=None, use_processes=True):
+    """
+    按 meta["chunk_size"] 切块并行解密整个容器写到 output_path。
+    子任务只负责解密，主线程按顺序写出并更新 hasher，同时在途的块数有上限，内存占用有界。
+    use_processes=False 时改用线程池（取决于 cryptography 版本是否释放 GIL）
+    """
+    chunk_size = meta.get("chunk_size", DEFAULT_CTR_CHUNK_SIZE)
+    workers = workers or os.cpu_count() or 1
+    pool_cls = ProcessPoolExecutor if use_processes and workers > 1 else ThreadPoolExecutor
+    ranges = deque((pos, min(chunk_size, data_len - pos)) for pos in range(0, data_len, chunk_size))
+    with pool_cls(max_workers=workers) as pool, open(output_path, "wb") as fout:
+        pending = deque()
+        while ranges or pending:
+            while ranges and len(pending) < workers * 2:
+                start, length = ranges.popleft()
+                pending.append(pool.submit(_decrypt_chunk, enc_path, key, meta["nonce"],
+                                           meta["data_offset"], start, length))
+            plain = pending.popleft().result()
+            if hasher is not None:
+                hasher.update(plain)
+            fout.write(plain)
+
+def encrypt_to_container(model_path, fout, key, nonce, chunk_size=DEFAULT_CTR_CHUNK_SIZE, hasher=None):
+    """流式 CTR 加密整个文件写入 fout（调用方负责先写 flag、后写 __META__），hasher 对明文做 hash"""
+    ctx = ctr_context(key, nonce, 0)
+    total = 0
+    with open(model_path, "rb") as fin:
+        for chunk in iter(lambda: fin.read(chunk_size), b""):
+            if hasher is not None:
+                hasher.update(chunk)
+            fout.write(ctx.update(chunk))
+            total += len(chunk)
+    return total
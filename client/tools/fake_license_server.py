@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+本地许可证服务器（verify-key 协议的离线替身）
+
+与线上 /api/verify-key（app/api/verify-key/route.ts）的约定一致：
+    请求      POST {"key": API key, "mac": MAC地址, "cpu": CPU/GPU信息}
+    成功      200 {"success": true, "xorResult": base64(密钥逐字节异或时间戳), "timestamp": 秒级时间戳}
+    缺少参数  400 {"error": "缺少参数"}
+    key无效   401 {"error": "无效或已停用的key"}
+    设备不符  403 {"error": "MAC 变更"}（--deny-rate 按概率注入）
+拒绝都是 4xx 状态码，客户端走 raise_for_status 的错误路径，线上不会返回 200 + success=false。
+xorResult 的编码与 secure_loader.decode_xor_result 互逆：密钥字符串第 i 个字符与
+时间戳低 32 位的第 (i % 4) 个字节（大端）异或。
+
+可以配置延迟（均值 + 抖动）、5xx 错误率、拒绝率和 API key -> 解密密钥 的映射，
+用来离线测试客户端的超时、重试和并发行为。把 secure_loader.SERVER_URL 或
+test_verify_key 的 LICENSE_SERVER_URL 环境变量指向 http://127.0.0.1:<端口>/api/verify-key 即可。
+
+用法:
+    python fake_license_server.py [--port 8787] [--latency-ms 50] [--jitter-ms 20]
+                                  [--error-rate 0.05] [--deny-rate 0] [--keys keys.json]
+keys.json: {"APIKEY_xxx": "32位hex解密密钥", ...}
+"""
+
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ========== 配置 ========== #
+DEFAULT_PORT = 8787
+VERIFY_PATH = "/api/verify-key"
+# 与 secure_loader.API_KEY / tensor_encryptor.DEFAULT_KEY 对应的测试数据
+DEFAULT_KEYS = {"APIKEY_wk_test_model_1_lv3s2cc4": "3f40bba6a0444dcd887f6e7c5afa3dee"}
+# 线上拒绝请求时的状态码：401 key无效、403 设备不符
+DENY_STATUS = (401, 403)
+
+# ========== 编解码 ========== #
+def _timestamp_bytes(timestamp):
+    return [(timestamp >> 24) & 0xff, (timestamp >> 16) & 0xff, (timestamp >> 8) & 0xff, timestamp & 0xff]
+
+def encode_xor_result(key, timestamp):
+    mask = _timestamp_bytes(timestamp)
+    return base64.b64encode(bytes(ord(c) ^ mask[i % 4] for i, c in enumerate(key))).decode()
+
+def decode_xor_result(xor_result, timestamp):
+    """与 secure_loader.decode_xor_result 相同的解码（不依赖 WebUI 环境）"""
+    mask = _timestamp_bytes(timestamp)
+    return "".join(chr(b ^ mask[i % 4]) for i, b in enumerate(base64.b64decode(xor_result)))
+
+# ========== 服务器 ========== #
+class LicenseServerConfig:
+    def __init__(self, keys=None, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, deny_rate=0.0, seed=None):
+        self.keys = dict(DEFAULT_KEYS if keys is None else keys)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.deny_rate = deny_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "ok": 0, "denied": 0, "errors": 0, "bad_request": 0}
+
+    def count(self, name):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats[name] += 1
+
+    def draw(self):
+        """一次请求的 (延迟秒数, 是否注入5xx, 是否注入拒绝)"""
+        with self.lock:
+            delay = max(0.0, self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            return delay, self.random.random() < self.error_rate, self.random.random() < self.deny_rate
+
+class VerifyKeyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive，与客户端连接池配合
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        # 健康检查（test_verify_key.test_server_health 访问根路径）
+        self._send_json(200, {"status": "ok"})
+
+    def do_POST(self):
+        config = self.server.config
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length)
+        if self.path.split("?")[0] != VERIFY_PATH:
+            config.count("bad_request")
+            self._send_json(404, {"error": "Not found"})
+            return
+        delay, inject_error, inject_deny = config.draw()
+        if delay:
+            time.sleep(delay)
+        if inject_error:
+            config.count("errors")
+            self._send_json(503, {"error": "Injected server error"})
+            return
+        try:
+            payload = json.loads(raw or b"{}")
+            api_key, mac, cpu = payload["key"], payload["mac"], payload["cpu"]
+        except (ValueError, KeyError, TypeError):
+            config.count("bad_request")
+            self._send_json(400, {"error": "缺少参数"})
+            return
+        if not api_key or not mac or not cpu:
+            config.count("bad_request")
+            self._send_json(400, {"error": "缺少参数"})
+            return
+        decryption_key = config.keys.get(api_key)
+        if decryption_key is None:
+            config.count("denied")
+            self._send_json(401, {"error": "无效或已停用的key"})
+            return
+        if inject_deny:
+            config.count("denied")
+            self._send_json(403, {"error": "MAC 变更"})
+            return
+        timestamp = int(time.time())  # 与线上一致：秒级时间戳
+        config.count("ok")
+        self._send_json(200, {"success": True, "xorResult": encode_xor_result(decryption_key, timestamp),
+                              "timestamp": timestamp})
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    """在后台线程启动服务器（port=0 自动分配），返回 (server, url)；用 server.shutdown() 停止"""
+    server = ThreadingHTTPServer((host, port), VerifyKeyHandler)
+    server.daemon_threads = True
+    server.config = config or LicenseServerConfig()
+    threading.Thread(target=server.serve_forever, name="fake-license-server", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}{VERIFY_PATH}"
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 verify-key 许可证服务器（测试用）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="平均响应延迟（毫秒）")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="延迟抖动范围（±毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回503的概率")
+    parser.add_argument("--deny-rate", type=float, default=0.0, help="返回403（设备不符）的概率")
+    parser.add_argument("--keys", default=None, help="API key -> 解密密钥 的JSON文件")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子（延迟/错误注入可复现）")
+    args = parser.parse_args()
+
+    keys = None
+    if args.keys:
+        with open(args.keys, "r", encoding="utf-8") as f:
+            keys = json.load(f)
+    config = LicenseServerConfig(keys, args.latency_ms, args.jitter_ms, args.error_rate, args.deny_rate, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), VerifyKeyHandler)
+    server.daemon_threads = True
+    server.config = config
+    print(f"🚀 本地许可证服务器: http://{args.host}:{server.server_address[1]}{VERIFY_PATH}")
+    print(f"   延迟 {args.latency_ms}±{args.jitter_ms}ms，错误率 {args.error_rate}，拒绝率 {args.deny_rate}，"
+          f"{len(config.keys)} 个API key")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"📊 请求统计: {config.stats}")
+
+if __name__ == "__main__":
+    main()
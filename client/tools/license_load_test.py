@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+verify-key 协议压测工具
+
+模拟多台客户端（每个客户端一个独立的 LicenseClient 连接池和随机 MAC）并发请求许可证服务器，
+统计端到端延迟分位数（含客户端重试）、吞吐和各类结果数量，并校验解码出的密钥。
+
+默认在进程内启动 fake_license_server 作为目标；--url 指定时改为压测已有服务器
+（不要对线上服务器做大规模压测）。
+
+用法:
+    python license_load_test.py [--clients 32] [--requests 50] [--latency-ms 30 --error-rate 0.05]
+    python license_load_test.py --url http://127.0.0.1:8787/api/verify-key --api-key APIKEY_xxx
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sd_client"))
+from fake_license_server import DEFAULT_KEYS, DENY_STATUS, LicenseServerConfig, decode_xor_result, start_server
+from license_client import LicenseClient
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+def random_mac(rng):
+    return ":".join(f"{rng.randrange(256):02x}" for _ in range(6))
+
+def run_client(url, api_key, expected_key, requests_per_client, results, lock, seed, max_retries):
+    rng = random.Random(seed)
+    client = LicenseClient(connect_timeout=5, read_timeout=15, max_retries=max_retries,
+                           backoff_base=0.05, backoff_max=1.0, pool_size=1,
+                           user_agent="SecureModelLoader-LoadTest/1.0")
+    payload = {"key": api_key, "mac": random_mac(rng), "cpu": "LoadTest GPU"}
+    local = {"latencies": [], "ok": 0, "denied": 0, "http_error": 0, "network_error": 0, "bad_key": 0}
+    for _ in range(requests_per_client):
+        start = time.perf_counter()
+        try:
+            response = client.post_json(url, payload)
+            elapsed = time.perf_counter() - start
+            if response.status_code in DENY_STATUS:
+                local["denied"] += 1
+            elif response.status_code >= 400:
+                local["http_error"] += 1
+            else:
+                data = response.json()
+                if not data.get("success") or (
+                        expected_key and decode_xor_result(data["xorResult"], data["timestamp"]) != expected_key):
+                    local["bad_key"] += 1
+                else:
+                    local["ok"] += 1
+        except Exception:
+            elapsed = time.perf_counter() - start
+            local["network_error"] += 1
+        local["latencies"].append(elapsed)
+    client_metrics = client.metrics()
+    client.close()
+    with lock:
+        results["latencies"].extend(local.pop("latencies"))
+        for name, count in local.items():
+            results[name] += count
+        results["retries"] += client_metrics["retries"]
+
+def run_load_test(url, api_key, expected_key, clients, requests_per_client, max_retries=3, seed=0):
+    results = {"latencies": [], "ok": 0, "denied": 0, "http_error": 0, "network_error": 0, "bad_key": 0, "retries": 0}
+    lock = threading.Lock()
+    threads = [threading.Thread(target=run_client,
+                                args=(url, api_key, expected_key, requests_per_client, results, lock, seed + i,
+                                      max_retries))
+               for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies = results.pop("latencies")
+    report = {
+        "url": url,
+        "clients": clients,
+        "requests": len(latencies),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / max(elapsed, 1e-9), 1),
+    }
+    for name, q in (("p50_ms", 0.5), ("p90_ms", 0.9), ("p99_ms", 0.99), ("max_ms", 1.0)):
+        value = percentile(latencies, q)
+        report[name] = round(value * 1000, 2) if value is not None else None
+    report.update(results)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="verify-key 协议并发压测")
+    parser.add_argument("--url", default=None, help="目标服务器地址（默认在进程内启动本地服务器）")
+    parser.add_argument("--api-key", default=next(iter(DEFAULT_KEYS)), help="请求使用的API key")
+    parser.add_argument("--expect-key", default=None, help="期望解码出的密钥（默认取本地服务器的配置）")
+    parser.add_argument("--clients", type=int, default=16, help="模拟客户端数（并发线程）")
+    parser.add_argument("--requests", type=int, default=20, help="每个客户端的请求数")
+    parser.add_argument("--max-retries", type=int, default=3, help="客户端重试次数")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="本地服务器平均延迟")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="本地服务器延迟抖动")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="本地服务器503概率")
+    parser.add_argument("--deny-rate", type=float, default=0.0, help="本地服务器返回403（设备不符）的概率")
+    parser.add_argument("--output", default=None, help="结果JSON路径")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    expected_key = args.expect_key
+    if url is None:
+        config = LicenseServerConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                     error_rate=args.error_rate, deny_rate=args.deny_rate, seed=0)
+        server, url = start_server(config)
+        expected_key = expected_key or config.keys.get(args.api_key)
+        print(f"🚀 已启动本地许可证服务器: {url}")
+    print(f"⏳ {args.clients} 个客户端 × {args.requests} 次请求...")
+    try:
+        report = run_load_test(url, args.api_key, expected_key, args.clients, args.requests, args.max_retries)
+    finally:
+        if server is not None:
+            report_server = dict(server.config.stats)
+            server.shutdown()
+            server.server_close()
+    if server is not None:
+        report["server"] = report_server
+    print(f"📊 吞吐 {report['throughput_rps']} req/s，p50 {report['p50_ms']}ms，p90 {report['p90_ms']}ms，"
+          f"p99 {report['p99_ms']}ms，max {report['max_ms']}ms")
+    print(f"   成功 {report['ok']}，拒绝 {report['denied']}，HTTP错误 {report['http_error']}，"
+          f"网络错误 {report['network_error']}，密钥不符 {report['bad_key']}，重试 {report['retries']}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"结果已写入: {args.output}")
+    if report["bad_key"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+给旧版加密工具写出的 xor safetensors 补加密标记
+
+客户端靠 __metadata__["wk_encrypted"] 识别 xor 加密模型。加标记之前的 model_encryptor /
+tensor_encryptor 原样保留 header，写出的文件在 header 上和明文模型无法区分，不补标记的话
+会被当成普通模型加载（拿到的是密文权重）。
+
+本工具只改 header：写入标记并补齐 8 字节对齐，tensor 数据原样拷贝。xor 的 key 相位按
+tensor 数据区内的偏移计算，header 变长不影响解密，所以不需要 key。
+已带标记 / 加密范围记录的文件和 hybrid 容器会跳过。只对确认由旧工具加密过的文件运行：
+给明文模型加上标记，客户端会把它当成加密模型去解密。
+
+用法:
+    python mark_encrypted.py <文件或目录>... [--dry-run]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sd_client"))
+from model_encryptor import ENCRYPT_FLAG
+from output_file import atomic_output
+from encryption_policy import header_with_marker, is_encrypted_metadata
+from xor_cipher import DEFAULT_CHUNK_SIZE
+
+def collect_inputs(paths):
+    """展开目录（递归），返回 .safetensors 文件列表"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, n) for n in sorted(names) if n.lower().endswith(".safetensors"))
+        else:
+            files.append(path)
+    return files
+
+def mark_file(path, dry_run=False):
+    """
+    给一个文件补标记，返回 "marked" / "already"（已有标记）/ "container"（hybrid 容器）；
+    不是 safetensors 时抛出 ValueError
+    """
+    with open(path, "rb") as f:
+        if f.read(len(ENCRYPT_FLAG)) == ENCRYPT_FLAG:
+            return "container"
+        f.seek(0)
+        header_len = int.from_bytes(f.read(8), "little")
+        header_bytes = f.read(header_len)
+    header = json.loads(header_bytes)
+    if not isinstance(header, dict):
+        raise ValueError("不是safetensors文件")
+    if is_encrypted_metadata(header.get("__metadata__")):
+        return "already"
+    if dry_run:
+        return "marked"
+    marked = header_with_marker(header_bytes)
+    with atomic_output(path) as tmp_path:
+        with open(path, "rb") as fin, open(tmp_path, "wb") as fout:
+            fin.seek(8 + header_len)
+            fout.write(len(marked).to_bytes(8, "little"))
+            fout.write(marked)
+            shutil.copyfileobj(fin, fout, DEFAULT_CHUNK_SIZE)
+    return "marked"
+
+def main():
+    parser = argparse.ArgumentParser(description="给旧版工具加密的 xor safetensors 补加密标记（只改header）")
+    parser.add_argument("paths", nargs="+", help="加密模型文件或目录（递归）")
+    parser.add_argument("--dry-run", action="store_true", help="只列出需要补标记的文件，不修改")
+    args = parser.parse_args()
+
+    failed = 0
+    for path in collect_inputs(args.paths):
+        try:
+            result = mark_file(path, args.dry_run)
+        except (OSError, ValueError) as e:
+            failed += 1
+            print(f"❌ {path}: {str(e)}")
+            continue
+        if result == "marked":
+            print(f"{'🔍 需要补标记' if args.dry_run else '✅ 已补标记'}: {path}")
+        elif result == "already":
+            print(f"⏭️ 已有标记，跳过: {path}")
+        else:
+            print(f"⏭️ hybrid容器，跳过: {path}")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -5,31 +5,55 @@ import json
 import hashlib
 from base64 import b64decode
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sd_client"))
+from xor_cipher import xor_bytes, xor_stream
+from output_file import atomic_output
+
 try:
     from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
     from cryptography.hazmat.primitives import serialization, hashes
     from cryptography.hazmat.primitives.asymmetric import padding
     from cryptography.hazmat.backends import default_backend
+    from ctr_container import is_ctr_container, decrypt_container
 except ImportError:
     print("请先安装依赖: pip install cryptography")
     sys.exit(1)
 
 RSA_PRIVATE_KEY_PATH = "model_private_key.pem"
 ENCRYPT_FLAG = b'WK_ENCRYPTED_v1'  # 16字节flag
+DECRYPT_WORKERS = os.cpu_count() or 1  # 并行解密线程/进程数（xor / AES-CTR），1表示串行
+FLAG_SIZE = 16  # 文件头flag占用的字节数，加密内容从这里开始
 
 # ========== 工具函数 ========== #
-def xor_decrypt(data, key):
-    return bytes([b ^ key[i % len(key)] for i, b in enumerate(data)])
+def xor_decrypt(data, key, workers=DECRYPT_WORKERS):
+    return xor_bytes(data, key, workers=workers)
 
 def load_rsa_private_key(priv_path=RSA_PRIVATE_KEY_PATH):
     with open(priv_path, "rb") as f:
         return serialization.load_pem_private_key(f.read(), password=None, backend=default_backend())
 
-def aes_decrypt_file(input_path, output_path, key, iv, meta_len, chunk_size=1024*1024):
+def unwrap_aes_key(meta, priv_path=RSA_PRIVATE_KEY_PATH):
+    """用RSA私钥解开元数据里的AES key"""
+    private_key = load_rsa_private_key(priv_path)
+    return private_key.decrypt(
+        b64decode(meta["aes_key_rsa"]),
+        padding.OAEP(
+            mgf=padding.MGF1(algorithm=hashes.SHA256()),
+            algorithm=hashes.SHA256(),
+            label=None
+        )
+    )
+
+def aes_decrypt_file(input_path, output_path, key, iv, meta_len, chunk_size=1024*1024, hasher=None, data_offset=0):
+    """
+    解密 [data_offset, 文件大小 - meta_len) 这段密文写入 output_path，
+    传入 hasher 时顺带对明文做 hash
+    """
     with open(input_path, "rb") as fin:
-        # 读取除去元数据的部分
+        # 读取除去flag和元数据的部分
         file_size = os.path.getsize(input_path)
-        data_len = file_size - meta_len
+        data_len = file_size - meta_len - data_offset
+        fin.seek(data_offset)
         iv = b64decode(iv) if isinstance(iv, str) else iv
         cipher = Cipher(algorithms.AES(key), modes.CFB(iv), backend=default_backend())
         decryptor = cipher.decryptor()
@@ -41,9 +65,14 @@ def aes_decrypt_file(input_path, output_path, key, iv, meta_len, chunk_size=1024
                 if not chunk:
                     break
                 dec_chunk = decryptor.update(chunk)
+                if hasher is not None:
+                    hasher.update(dec_chunk)
                 fout.write(dec_chunk)
                 read_bytes += len(chunk)
-            fout.write(decryptor.finalize())
+            dec_chunk = decryptor.finalize()
+            if hasher is not None:
+                hasher.update(dec_chunk)
+            fout.write(dec_chunk)
 
 # ========== 主流程 ========== #
 def extract_meta_from_file(enc_path):
@@ -66,7 +95,8 @@ def extract_meta_from_file(enc_path):
         meta_bytes = f.read()
         meta_str = meta_bytes.decode("utf-8")
         meta = json.loads(meta_str)
-        meta_len = len(meta_bytes) + idx + len(b"__META__")
+        # 尾部长度 = __META__标记 + json，文件大小减去它就是加密内容长度
+        meta_len = len(meta_bytes) + len(b"__META__")
         return meta, meta_len
 
 def main():
@@ -79,18 +109,13 @@ def main():
     # 检查flag
     with open(enc_path, "rb") as f:
         file_flag = f.read(16)
-    if file_flag != ENCRYPT_FLAG:
+    # flag常量只有15字节，写入时补\0到16字节，这里只比较前缀
+    if file_flag[:len(ENCRYPT_FLAG)] != ENCRYPT_FLAG:
         print("[!] 不是本工具加密的模型文件，终止解密。")
         sys.exit(1)
-    # 读取剩余内容
-    with open(enc_path, "rb") as f:
-        f.seek(16)
-        enc_data = f.read()
-    # 临时写入去除flag的文件，后续流程复用
-    tmp_enc_path = enc_path + ".tmp"
-    with open(tmp_enc_path, "wb") as f:
-        f.write(enc_data)
-    meta, meta_len = extract_meta_from_file(tmp_enc_path)
+    # 直接在原文件上按偏移区间处理：[FLAG_SIZE, 文件大小 - 尾部元数据) 为加密内容，不再写临时文件
+    meta, meta_len = extract_meta_from_file(enc_path)
+    content_len = os.path.getsize(enc_path) - FLAG_SIZE - meta_len
     mode = meta.get("mode", "xor")
     model_name = os.path.basename(enc_path).replace(".enc", "")
     out_file = os.path.join(output_dir, model_name)
@@ -98,18 +123,14 @@ def main():
     if mode == "xor":
         decrypt_key = key_or_priv or meta["decrypt_key"]
         key_bytes = bytes.fromhex(decrypt_key)
-        with open(tmp_enc_path, "rb") as f:
-            enc_data = f.read()
-        idx = enc_data.rfind(b"__META__")
-        if idx == -1:
-            raise ValueError("未找到元数据标记 __META__，无法解密")
-        enc_content = enc_data[:idx]
-        decrypted = xor_decrypt(enc_content, key_bytes)
-        with open(out_file, "wb") as f:
-            f.write(decrypted)
-        # 校验md5
-        import hashlib
-        md5_actual = hashlib.md5(decrypted).hexdigest()
+        # 解密、写出、md5 一遍完成：每个chunk多线程异或，md5 在单独线程上与下一个chunk重叠；
+        # 文件名没有 .enc 后缀且输出到原目录时 out_file 就是 enc_path，先写临时文件
+        md5 = hashlib.md5()
+        with atomic_output(out_file) as tmp_path:
+            with open(enc_path, "rb") as fin, open(tmp_path, "wb") as fout:
+                fin.seek(FLAG_SIZE)
+                xor_stream(fin, fout, key_bytes, length=content_len, hasher=md5, workers=DECRYPT_WORKERS)
+        md5_actual = md5.hexdigest()
         md5_expected = meta["model_md5"]
         if md5_actual == md5_expected:
             print(f"✅ 解密后模型md5校验通过: {md5_actual}")
@@ -117,23 +138,18 @@ def main():
             print(f"❌ 解密后模型md5校验失败: {md5_actual} ≠ {md5_expected}")
         print(f"解密完成，输出文件: {out_file}")
     elif mode == "hybrid":
-        priv_path = key_or_priv or RSA_PRIVATE_KEY_PATH
-        private_key = load_rsa_private_key(priv_path)
-        encrypted_aes_key = b64decode(meta["aes_key_rsa"])
-        aes_key = private_key.decrypt(
-            encrypted_aes_key,
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                algorithm=hashes.SHA256(),
-                label=None
-            )
-        )
-        aes_decrypt_file(tmp_enc_path, out_file, aes_key, meta["iv"], meta_len)
-        # 校验md5
-        import hashlib
-        with open(out_file, "rb") as f:
-            decrypted = f.read()
-        md5_actual = hashlib.md5(decrypted).hexdigest()
+        aes_key = unwrap_aes_key(meta, key_or_priv or RSA_PRIVATE_KEY_PATH)
+        # 解密时顺带计算md5，不再回读输出文件
+        md5 = hashlib.md5()
+        with atomic_output(out_file) as tmp_path:
+            if is_ctr_container(meta):
+                # version 2: AES-CTR，按chunk多进程并行解密
+                print(f"容器版本: v{meta['version']} ({meta.get('cipher')}), 并行度: {DECRYPT_WORKERS}")
+                decrypt_container(enc_path, tmp_path, aes_key, meta, content_len, workers=DECRYPT_WORKERS, hasher=md5)
+            else:
+                # 旧版 AES-CFB，只能串行解密
+                aes_decrypt_file(enc_path, tmp_path, aes_key, meta["iv"], meta_len, hasher=md5, data_offset=FLAG_SIZE)
+        md5_actual = md5.hexdigest()
         md5_expected = meta["model_md5"]
         if md5_actual == md5_expected:
             print(f"✅ 解密后模型md5校验通过: {md5_actual}")
@@ -142,8 +158,6 @@ def main():
         print(f"解密完成，输出文件: {out_file}")
     else:
         raise ValueError(f"不支持的加密模式: {mode}")
-    # 清理临时文件
-    os.remove(tmp_enc_path)
 
 if __name__ == "__main__":
     main()
@@ -9,8 +9,18 @@ import argparse
 import uuid
 import struct
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sd_client"))
+from xor_cipher import xor_bytes, xor_stream, DEFAULT_CHUNK_SIZE
+from output_file import atomic_output
+from encryption_policy import header_with_marker
+from integrity import (ManifestBuilder, DEFAULT_MANIFEST_CHUNK_SIZE, header_with_manifest,
+                       placeholder_manifest)
+
 # ========== 配置 ========== #
 API_URL = "http://localhost:3000/api/model-encrypt-register"  # 后台注册接口
+RSA_PUBLIC_KEY_PATH = "model_public_key.pem"
+ENCRYPT_FLAG = b'WK_ENCRYPTED_v1'  # 16字节flag，与 model_decryptor 保持一致
+FLAG_SIZE = 16
 
 # ========== 工具函数 ========== #
 def random_key(length=32):
@@ -19,17 +29,19 @@ def random_key(length=32):
 def calc_md5(filepath):
     hash_md5 = hashlib.md5()
     with open(filepath, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
             hash_md5.update(chunk)
     return hash_md5.hexdigest()
 
 def xor_encrypt(data, key):
-    return bytes([b ^ key[i % len(key)] for i, b in enumerate(data)])
+    return xor_bytes(data, key)
 
 # ========== 主流程 ========== #
-def encrypt_safetensors(model_path, output_path, meta=None, custom_key=None):
+def encrypt_safetensors(model_path, output_path, meta=None, custom_key=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                        manifest=False, manifest_chunk_size=DEFAULT_MANIFEST_CHUNK_SIZE):
     """
-    safetensors加密：完全不动头和metadata，只加密tensor数据部分，文件尾部追加b'wks'标记
+    safetensors加密：只加密tensor数据部分，header 只在 __metadata__ 里加一个加密标记
+    tensor数据按 chunk_size 分块流式加密；manifest=True 时在 __metadata__ 写入分块完整性清单
     """
     if custom_key:
         if len(custom_key) != 32:
@@ -39,33 +51,105 @@ def encrypt_safetensors(model_path, output_path, meta=None, custom_key=None):
     else:
         encrypt_key = random_key(16)  # 32 hex chars = 16 bytes
     key_bytes = bytes.fromhex(encrypt_key)
-    with open(model_path, "rb") as f:
-        header = f.read(8)
-        meta_len = int.from_bytes(header, "little")
-        metadata = f.read(meta_len)
-        tensor_data = f.read()
-    encrypted_tensor = xor_encrypt(tensor_data, key_bytes)
     out_file = os.path.join(output_path, os.path.basename(model_path))
-    with open(out_file, "wb") as f:
-        f.write(header)
-        f.write(metadata)
-        f.write(encrypted_tensor)
-        # f.write(b'wks')  # 文件尾部追加flag
+    start = time.perf_counter()
+    # 流式加密，内存占用恒定为一个chunk；先写临时文件再替换，输出目录就是源目录时不会截断源文件
+    with atomic_output(out_file) as tmp_path:
+        with open(model_path, "rb") as fin, open(tmp_path, "wb") as fout:
+            header = fin.read(8)
+            meta_len = int.from_bytes(header, "little")
+            # 文件开头没有flag，客户端靠 __metadata__ 里的标记识别加密模型
+            metadata = header_with_marker(fin.read(meta_len))
+            header = len(metadata).to_bytes(8, "little")
+            builder = None
+            if manifest:
+                # 先写等长的占位清单，加密完成后回写真实清单
+                raw_metadata = metadata
+                payload_len = os.fstat(fin.fileno()).st_size - 8 - meta_len
+                metadata = header_with_manifest(raw_metadata, placeholder_manifest(payload_len, manifest_chunk_size))
+                header = len(metadata).to_bytes(8, "little")
+                builder = ManifestBuilder(manifest_chunk_size)
+            fout.write(header)
+            fout.write(metadata)
+            tensor_bytes = xor_stream(fin, fout, key_bytes, chunk_size=chunk_size, input_hasher=builder)
+            if builder is not None:
+                fout.seek(8)
+                fout.write(header_with_manifest(raw_metadata, builder.finish()))
+            # fout.write(b'wks')  # 文件尾部追加flag
+    elapsed = time.perf_counter() - start
+    print(f"tensor数据加密: {tensor_bytes / 1024**2:.1f} MB, 耗时 {elapsed:.2f}s, "
+          f"吞吐 {tensor_bytes / 1024**2 / max(elapsed, 1e-9):.1f} MB/s")
     return encrypt_key, encrypt_key, None, None
 
 
+def encrypt_hybrid(model_path, output_path, pub_key_path=RSA_PUBLIC_KEY_PATH, chunk_size=None):
+    """
+    hybrid加密（容器 version 2）：随机AES-256 key + AES-CTR 加密整个文件，AES key 用RSA公钥加密后
+    写入尾部元数据。CTR 可按 chunk 并行解密、随机访问，见 ctr_container.py
+    输出: <output_path>/<文件名>.enc
+    """
+    from base64 import b64encode
+    from cryptography.hazmat.primitives import serialization, hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+    from ctr_container import (CONTAINER_VERSION, CIPHER_NAME, DEFAULT_CTR_CHUNK_SIZE,
+                               encrypt_to_container, tensor_data_offset)
+
+    chunk_size = chunk_size or DEFAULT_CTR_CHUNK_SIZE
+    with open(pub_key_path, "rb") as f:
+        public_key = serialization.load_pem_public_key(f.read())
+    aes_key = secrets.token_bytes(32)
+    nonce = secrets.token_bytes(16)
+    out_file = os.path.join(output_path, os.path.basename(model_path) + ".enc")
+    md5 = hashlib.md5()
+    start = time.perf_counter()
+    # 先写临时文件，中途失败不会留下带 flag、看起来完整的半个容器
+    with atomic_output(out_file) as tmp_path, open(tmp_path, "wb") as fout:
+        fout.write(ENCRYPT_FLAG.ljust(FLAG_SIZE, b"\0"))
+        total = encrypt_to_container(model_path, fout, aes_key, nonce, chunk_size=chunk_size, hasher=md5)
+        meta = {
+            "mode": "hybrid",
+            "version": CONTAINER_VERSION,
+            "cipher": CIPHER_NAME,
+            "aes_key_rsa": b64encode(public_key.encrypt(
+                aes_key,
+                padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+            )).decode(),
+            "nonce": b64encode(nonce).decode(),
+            "chunk_size": chunk_size,
+            "data_offset": FLAG_SIZE,
+            "tensor_data_offset": tensor_data_offset(model_path),
+            "model_md5": md5.hexdigest(),
+        }
+        fout.write(b"__META__")
+        fout.write(json.dumps(meta).encode("utf-8"))
+    elapsed = time.perf_counter() - start
+    print(f"hybrid加密: {total / 1024**2:.1f} MB, 耗时 {elapsed:.2f}s, "
+          f"吞吐 {total / 1024**2 / max(elapsed, 1e-9):.1f} MB/s")
+    return out_file, meta
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("model_path")
     parser.add_argument("output_path")
+    parser.add_argument("--mode", choices=["xor", "hybrid"], default="xor", help="xor: safetensors tensor数据xor; hybrid: AES-CTR容器")
     parser.add_argument("--key", type=str, help="自定义32位hex key（仅xor模式）")
+    parser.add_argument("--pub", type=str, default=RSA_PUBLIC_KEY_PATH, help="RSA公钥路径（仅hybrid模式）")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE // 1024**2, help="流式加密块大小（MB）")
+    parser.add_argument("--manifest", action="store_true", help="写入分块完整性清单（仅xor模式）")
     args = parser.parse_args()
 
     model_path = args.model_path
     output_path = args.output_path
     custom_key = args.key
 
-    encrypt_key, decrypt_key, _, _ = encrypt_safetensors(model_path, output_path, custom_key=custom_key)
+    if args.mode == "hybrid":
+        out_file, meta = encrypt_hybrid(model_path, output_path, args.pub, chunk_size=args.chunk_size * 1024**2)
+        print(f"加密完成！输出文件: {out_file}\n容器版本: v{meta['version']} ({meta['cipher']})")
+        return
+
+    encrypt_key, decrypt_key, _, _ = encrypt_safetensors(model_path, output_path, custom_key=custom_key,
+                                                         chunk_size=args.chunk_size * 1024**2,
+                                                         manifest=args.manifest)
     print(f"加密完成！加密key: {encrypt_key}\n解密key: {decrypt_key}")
 
 if __name__ == "__main__":
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+加/解密工具共用的输出文件处理
+
+流式加/解密是边读输入边写输出的。输出目录就是源目录、输出文件名与输入相同时
+（python tensor_encryptor.py m.safetensors .），直接 open(out_file, "wb") 会在读之前
+把源文件截断成 0 字节。这里统一先写到输出目录下的临时文件，成功后再 os.replace
+到目标路径：原地加/解密可以正常工作，中途失败也不会留下半个文件或毁掉源文件。
+"""
+
+import os
+from contextlib import contextmanager
+
+@contextmanager
+def atomic_output(out_file):
+    """
+    返回一个临时路径供调用方写入，with 块正常结束后替换到 out_file，异常时删除临时文件。
+    调用方需要在 with 块结束之前关闭输入/输出文件（Windows 下不能替换仍被打开的文件）
+    """
+    tmp_path = f"{out_file}.{os.getpid()}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, out_file)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
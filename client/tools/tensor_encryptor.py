@@ -3,6 +3,16 @@ import os
 import sys
 import argparse
 import secrets
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sd_client"))
+from xor_cipher import xor_bytes, xor_inplace, xor_into, xor_ranges_into, xor_stream, DEFAULT_CHUNK_SIZE
+from integrity import (ManifestBuilder, DEFAULT_MANIFEST_CHUNK_SIZE, header_with_manifest,
+                       placeholder_manifest)
+from output_file import atomic_output
+from lazy_safetensors import TORCH_DTYPES
+from encryption_policy import (DEFAULT_BLOCK_SIZE, EncryptionPolicy, covered_bytes, header_with_marker,
+                               header_with_ranges)
 
 # ========== 配置 ========== #
 # 写死的默认key（16字节hex字符串，32位）
@@ -13,58 +23,201 @@ def random_key(length=16):
     return secrets.token_hex(length)
 
 def xor_encrypt(data, key_bytes):
-    return bytes([b ^ key_bytes[i % len(key_bytes)] for i, b in enumerate(data)])
+    return xor_bytes(data, key_bytes)
 
 # ========== safetensors 加密 ========== #
-def encrypt_safetensors(model_path, output_path, key_hex):
+def print_coverage(ranges, payload_len):
+    if ranges is not None:
+        print(f"部分加密: {len(ranges)} 个范围, 覆盖 {covered_bytes(ranges) / 1024**2:.1f} MB "
+              f"({covered_bytes(ranges) / max(payload_len, 1):.1%})")
+
+def encrypt_safetensors(model_path, output_path, key_hex, chunk_size=DEFAULT_CHUNK_SIZE,
+                        manifest=False, manifest_chunk_size=DEFAULT_MANIFEST_CHUNK_SIZE, policy=None):
+    """
+    流式加密：8字节长度和header原样拷贝，tensor数据按 chunk_size 分块异或写出，
+    内存占用恒定为一个chunk，输出与整块读入加密完全一致
+    manifest=True 时在同一遍里对明文生成分块完整性清单，写入 __metadata__（见 integrity.py）
+    policy（EncryptionPolicy）指定部分加密时只异或选中的范围，范围记录写入 __metadata__
+    """
+    import json
     key_bytes = bytes.fromhex(key_hex)
-    with open(model_path, "rb") as f:
-        header = f.read(8)
-        meta_len = int.from_bytes(header, "little")
-        metadata = f.read(meta_len)
-        tensor_data = f.read()
-    encrypted_tensor = xor_encrypt(tensor_data, key_bytes)
     out_file = os.path.join(output_path, os.path.basename(model_path))
-    with open(out_file, "wb") as f:
-        f.write(header)
-        f.write(metadata)
-        f.write(encrypted_tensor)
+    start = time.perf_counter()
+    # 先写临时文件再替换：输出目录就是源目录时也不会在读之前截断源文件
+    with atomic_output(out_file) as tmp_path:
+        with open(model_path, "rb") as fin, open(tmp_path, "wb") as fout:
+            header = fin.read(8)
+            meta_len = int.from_bytes(header, "little")
+            metadata = fin.read(meta_len)
+            payload_len = os.fstat(fin.fileno()).st_size - 8 - meta_len
+            ranges = None
+            if policy is not None and not policy.is_full:
+                ranges = policy.select(json.loads(metadata), payload_len)
+            # 文件开头没有flag，客户端靠 __metadata__ 里的标记识别加密模型
+            metadata = header_with_ranges(header_with_marker(metadata), ranges)
+            header = len(metadata).to_bytes(8, "little")
+            builder = None
+            if manifest:
+                # 先写等长的占位清单，加密完成后回写真实清单
+                raw_metadata = metadata
+                metadata = header_with_manifest(raw_metadata, placeholder_manifest(payload_len, manifest_chunk_size))
+                header = len(metadata).to_bytes(8, "little")
+                builder = ManifestBuilder(manifest_chunk_size)
+            fout.write(header)
+            fout.write(metadata)
+            tensor_bytes = xor_stream(fin, fout, key_bytes, chunk_size=chunk_size, input_hasher=builder, ranges=ranges)
+            if builder is not None:
+                fout.seek(8)
+                fout.write(header_with_manifest(raw_metadata, builder.finish()))
+    elapsed = time.perf_counter() - start
+    print(f"tensor数据加密: {tensor_bytes / 1024**2:.1f} MB, 耗时 {elapsed:.2f}s, "
+          f"吞吐 {tensor_bytes / 1024**2 / max(elapsed, 1e-9):.1f} MB/s")
+    print_coverage(ranges, tensor_bytes)
     return out_file
 
 # ========== ckpt/pt 加密 ========== #
-def encrypt_ckpt_pt(model_path, output_path, key_hex):
+def load_checkpoint(model_path):
+    """
+    优先 torch.load(mmap=True)：tensor 直接映射文件（私有写时复制映射），不整体读进内存；
+    老格式（非zip）或老版本torch不支持mmap时退回普通加载
+    """
+    import torch
+    try:
+        return torch.load(model_path, map_location="cpu", mmap=True, weights_only=False)
+    except (RuntimeError, TypeError):
+        return torch.load(model_path, map_location="cpu", weights_only=False)
+
+def split_state(state):
+    """返回 (权重dict, 是否包在state_dict里)"""
+    if isinstance(state, dict) and "state_dict" in state:
+        return state["state_dict"], True
+    return state, False
+
+def storage_bytes(storage):
+    """把 UntypedStorage 零拷贝包装成可写的 uint8 numpy 数组"""
+    import torch
+    return torch.empty(0, dtype=torch.uint8).set_(storage).numpy()
+
+def tensor_byte_view(tensor):
+    """tensor 的连续字节视图（连续 tensor 零拷贝，非连续时只拷贝这一个 tensor）"""
+    if not tensor.is_contiguous():
+        tensor = tensor.contiguous()
+    itemsize = tensor.element_size()
+    start = tensor.storage_offset() * itemsize
+    return storage_bytes(tensor.untyped_storage())[start:start + tensor.numel() * itemsize]
+
+def encrypt_ckpt_pt(model_path, output_path, key_hex, workers=1):
+    """
+    ckpt/pt 原地加密：按 storage 去重（共享 storage 的 view 只加密一次），
+    对每个 storage 的 uint8 视图用完整 key 原地异或，key 相位从该 storage 起始字节算起。
+    不再经过 numpy 拷贝和 dtype 转换，bf16 等 numpy 不支持的 dtype 也能处理
+    """
     import torch
     key_bytes = bytes.fromhex(key_hex)
-    state = torch.load(model_path, map_location="cpu")
-    if "state_dict" in state:
-        weights = state["state_dict"]
-    else:
-        weights = state
-    encrypted_weights = {}
-    for k, v in weights.items():
-        if hasattr(v, 'numpy'):
-            arr = v.cpu().numpy().view('uint8')
-            flat = arr.flatten()
-            enc = (flat ^ key_bytes[0])  # 简单xor
-            enc = enc.reshape(arr.shape)
-            encrypted_weights[k] = torch.from_numpy(enc).to(v.dtype)
-        else:
-            encrypted_weights[k] = v  # 跳过非tensor
-    if "state_dict" in state:
-        state["state_dict"] = encrypted_weights
-        out_file = os.path.join(output_path, os.path.basename(model_path))
-        torch.save(state, out_file)
-    else:
-        out_file = os.path.join(output_path, os.path.basename(model_path))
-        torch.save(encrypted_weights, out_file)
+    start = time.perf_counter()
+    state = load_checkpoint(model_path)
+    weights, _ = split_state(state)
+    seen = set()
+    total = 0
+    for v in weights.values():
+        if not isinstance(v, torch.Tensor):
+            continue  # 跳过非tensor
+        storage = v.untyped_storage()
+        if storage.data_ptr() in seen or storage.nbytes() == 0:
+            continue
+        seen.add(storage.data_ptr())
+        xor_inplace(storage_bytes(storage), key_bytes, workers=workers)
+        total += storage.nbytes()
+    out_file = os.path.join(output_path, os.path.basename(model_path))
+    # state 里的 tensor 还映射着源文件，原地输出时必须先写临时文件
+    with atomic_output(out_file) as tmp_path:
+        torch.save(state, tmp_path)
+    elapsed = time.perf_counter() - start
+    print(f"tensor数据加密: {total / 1024**2:.1f} MB, 耗时 {elapsed:.2f}s, "
+          f"吞吐 {total / 1024**2 / max(elapsed, 1e-9):.1f} MB/s")
+    return out_file
+
+def convert_ckpt_to_safetensors(model_path, output_path, key_hex, chunk_size=DEFAULT_CHUNK_SIZE,
+                                manifest=False, manifest_chunk_size=DEFAULT_MANIFEST_CHUNK_SIZE, policy=None):
+    """
+    ckpt/pt 一遍转换为加密 safetensors：header 只由 shape/dtype 生成，tensor 数据从 mmap 视图
+    按 chunk 异或后直接写出（key 相位 = tensor 数据区偏移，与 encrypt_safetensors 输出一致），
+    转换后的模型可以走 secure_loader 的 mmap / 懒加载解密路径。
+    非 tensor 条目不写入；共享 storage 的 tensor 各自写一份；policy 与 encrypt_safetensors 相同
+    """
+    import json
+    import torch
+    key_bytes = bytes.fromhex(key_hex)
+    start = time.perf_counter()
+    weights, _ = split_state(load_checkpoint(model_path))
+    header = {"__metadata__": {"format": "pt", "source": os.path.basename(model_path)}}
+    tensors = []
+    offset = 0
+    skipped = 0
+    for name, v in weights.items():
+        if not isinstance(v, torch.Tensor):
+            skipped += 1
+            continue
+        dtype = TORCH_DTYPES.get(str(v.dtype).replace("torch.", ""))
+        if dtype is None:
+            raise ValueError(f"safetensors不支持的dtype: {name} {v.dtype}")
+        nbytes = v.numel() * v.element_size()
+        header[name] = {"dtype": dtype, "shape": list(v.shape), "data_offsets": [offset, offset + nbytes]}
+        tensors.append((v, offset))
+        offset += nbytes
+    header_bytes = header_with_marker(json.dumps(header, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+    ranges = None
+    if policy is not None and not policy.is_full:
+        ranges = policy.select(header, offset)
+        header_bytes = header_with_ranges(header_bytes, ranges)
+    builder = None
+    if manifest:
+        raw_header = header_bytes
+        header_bytes = header_with_manifest(raw_header, placeholder_manifest(offset, manifest_chunk_size))
+        builder = ManifestBuilder(manifest_chunk_size)
+    out_file = os.path.join(output_path, os.path.splitext(os.path.basename(model_path))[0] + ".safetensors")
+    buf = bytearray(chunk_size)
+    with atomic_output(out_file) as tmp_path:
+        with open(tmp_path, "wb") as fout:
+            fout.write(len(header_bytes).to_bytes(8, "little"))
+            fout.write(header_bytes)
+            for v, data_offset in tensors:
+                src = memoryview(tensor_byte_view(v)).cast("B")
+                for pos in range(0, len(src), chunk_size):
+                    piece = src[pos:pos + chunk_size]
+                    if builder is not None:
+                        builder.update(piece)
+                    out = memoryview(buf)[:len(piece)]
+                    if ranges is None:
+                        xor_into(piece, out, key_bytes, offset=data_offset + pos)
+                    else:
+                        xor_ranges_into(piece, out, key_bytes, ranges, offset=data_offset + pos)
+                    fout.write(out)
+            if builder is not None:
+                fout.seek(8)
+                fout.write(header_with_manifest(raw_header, builder.finish()))
+    elapsed = time.perf_counter() - start
+    if skipped:
+        print(f"跳过 {skipped} 个非tensor条目")
+    print(f"转换为加密safetensors: {len(tensors)} 个tensor, {offset / 1024**2:.1f} MB, 耗时 {elapsed:.2f}s, "
+          f"吞吐 {offset / 1024**2 / max(elapsed, 1e-9):.1f} MB/s")
+    print_coverage(ranges, offset)
     return out_file
 
 # ========== 主流程 ========== #
-def encrypt_model(model_path, output_path, key_hex):
+def encrypt_model(model_path, output_path, key_hex, chunk_size=DEFAULT_CHUNK_SIZE, manifest=False,
+                  to_safetensors=False, policy=None):
     ext = os.path.splitext(model_path)[1].lower()
     if ext == ".safetensors":
-        return encrypt_safetensors(model_path, output_path, key_hex)
+        return encrypt_safetensors(model_path, output_path, key_hex, chunk_size=chunk_size, manifest=manifest,
+                                   policy=policy)
     elif ext in [".ckpt", ".pt"]:
+        if to_safetensors:
+            return convert_ckpt_to_safetensors(model_path, output_path, key_hex, chunk_size=chunk_size,
+                                               manifest=manifest, policy=policy)
+        if policy is not None and not policy.is_full:
+            print("部分加密只支持safetensors输出，ckpt/pt请加 --to-safetensors")
+            sys.exit(1)
         return encrypt_ckpt_pt(model_path, output_path, key_hex)
     else:
         print(f"不支持的模型格式: {ext}")
@@ -75,6 +228,16 @@ def main():
     parser.add_argument("model_path", help="原始模型路径")
     parser.add_argument("output_path", help="加密模型输出目录")
     parser.add_argument("--key", type=str, help="自定义32位hex key（16字节）")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE // 1024**2, help="流式加密块大小（MB）")
+    parser.add_argument("--manifest", action="store_true", help="写入分块完整性清单（safetensors输出）")
+    parser.add_argument("--to-safetensors", action="store_true", help="ckpt/pt 直接转换为加密safetensors")
+    # 部分加密策略（可组合，取并集；都不指定时整块加密）
+    parser.add_argument("--encrypt-tensors", type=str, default=None,
+                        help="只加密名称匹配这些fnmatch模式的tensor，逗号分隔")
+    parser.add_argument("--encrypt-fraction", type=float, default=None, help="均匀加密数据区中这一比例的块（0~1）")
+    parser.add_argument("--encrypt-max-tensor-kb", type=int, default=None, help="加密不超过该大小（KB）的tensor")
+    parser.add_argument("--encrypt-block-kb", type=int, default=DEFAULT_BLOCK_SIZE // 1024,
+                        help="--encrypt-fraction 的块大小（KB）")
     args = parser.parse_args()
 
     # 优先用参数key，否则用写死key
@@ -86,7 +249,14 @@ def main():
     else:
         key_hex = DEFAULT_KEY
 
-    out_file = encrypt_model(args.model_path, args.output_path, key_hex)
+    policy = EncryptionPolicy(
+        patterns=[p for p in (args.encrypt_tensors or "").split(",") if p],
+        fraction=args.encrypt_fraction,
+        max_tensor_bytes=args.encrypt_max_tensor_kb * 1024 if args.encrypt_max_tensor_kb is not None else None,
+        block_size=args.encrypt_block_kb * 1024,
+    )
+    out_file = encrypt_model(args.model_path, args.output_path, key_hex, chunk_size=args.chunk_size * 1024**2,
+                             manifest=args.manifest, to_safetensors=args.to_safetensors, policy=policy)
     print(f"加密完成！输出文件: {out_file}\n加密key: {key_hex}")
 
 if __name__ == "__main__":